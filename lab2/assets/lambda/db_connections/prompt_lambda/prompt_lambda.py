@@ -6,23 +6,743 @@ Lambda that performs summarization with Bedrock
 #   LIBRARIES & LOGGER
 #########################
 import ast
+import base64
+import binascii
+import hashlib
 import json
 import logging
 import os
+import random
 import sys
+import time
 
-import boto3
+from aws_clients import get_client
+from search_index import INDEXED_ATTRIBUTES, rebuild_index, search_prompts, update_index
+from text_storage import decode_item_texts, delete_spilled_texts, delete_spilled_texts_by_session, encode_item_texts
 
 LOGGER = logging.Logger("DDB LAMBDA", level=logging.DEBUG)
 HANDLER = logging.StreamHandler(sys.stdout)
 HANDLER.setFormatter(logging.Formatter("%(levelname)s | %(name)s | %(message)s"))
 LOGGER.addHandler(HANDLER)
 
+USER_INDEX_NAME = os.environ.get("USER_INDEX_NAME", "user_id-timestamp-index")
+
+# attributes of the catalog listing, all of them are projected into the user index
+SUMMARY_FIELDS = [
+    "session_id",
+    "user_id",
+    "timestamp",
+    "model",
+    "answer_length",
+    "temperature",
+    "Industry",
+    "Language",
+    "Task",
+    "Technique",
+]
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Catalog version counter of a user, kept in the prompts table without user_id so that it stays out of the index
+VERSION_KEY_PREFIX = "catalog-version#"
+
+# The version counter is read consistently but the pages come from the eventually consistent user index:
+# for this long after a write, pages are served without ETag so that a stale page is never cached
+GSI_SETTLE_SECONDS = int(os.environ.get("GSI_SETTLE_SECONDS", 10))
+
+# number of search results, BatchGetItem reads at most 100 items per call
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+# attributes of the DETAIL lookup of many prompts, BatchGetItem reads at most 100 items per call
+DETAIL_FIELDS = ["Prompt Template", "Prompt", "Output"]
+MAX_DETAIL_ITEMS = 100
+
+# BatchWriteItem accepts at most 25 requests per call
+BATCH_WRITE_SIZE = 25
+MAX_BATCH_OPERATIONS = 500
+MAX_BATCH_RETRIES = 5
+BATCH_RETRY_BASE_DELAY = 0.05
+
+# namespace of the custom metrics, written as CloudWatch embedded metric format log lines
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "PromptCatalog")
+
+# filter parameter -> prompt attribute, applied as FilterExpression on the user query
+ATTRIBUTE_FILTERS = {
+    "ai_model_filter": "model",
+    "industry_filter": "Industry",
+    "language_filter": "Language",
+    "task_filter": "Task",
+    "technique_filter": "Technique",
+}
+
+
+#########################
+#        HELPER
+#########################
+
+
+def put_metric(name, value):
+    """
+    Emits a count metric in the CloudWatch embedded metric format. The line is printed as bare JSON,
+    CloudWatch would not parse it behind the LOGGER prefix.
+    """
+    metric = {"Namespace": METRICS_NAMESPACE, "Dimensions": [[]], "Metrics": [{"Name": name, "Unit": "Count"}]}
+    print(json.dumps({"_aws": {"Timestamp": int(time.time() * 1000), "CloudWatchMetrics": [metric]}, name: value}))
+
 
 def remove_dynamodb_type_descriptors(item):
     return {k: list(v.values())[0] for k, v in item.items()}
 
 
+def build_user_query(table_name, user_id, filter_params, fields=SUMMARY_FIELDS):
+    """
+    Builds the Query arguments for the prompts of one user, newest first.
+    The model and attribute filters become a FilterExpression, since_timestamp a range on the index sort key
+    (prompts saved at or after it). Only the given fields are returned.
+    """
+    expression_attribute_names = {"#pk": "user_id"}
+    expression_attribute_values = {":pk": {"S": user_id}}
+    key_condition = "#pk = :pk"
+    if filter_params.get("since_timestamp"):
+        key_condition += " AND #sk >= :sk"
+        expression_attribute_names["#sk"] = "timestamp"
+        expression_attribute_values[":sk"] = {"S": filter_params["since_timestamp"]}
+
+    filter_expressions = []
+    for position, (filter_name, attribute) in enumerate(ATTRIBUTE_FILTERS.items()):
+        value = filter_params.get(filter_name)
+        if value and value != "ALL":
+            filter_expressions.append(f"#f{position} = :f{position}")
+            expression_attribute_names[f"#f{position}"] = attribute
+            expression_attribute_values[f":f{position}"] = {"S": value}
+
+    projection = []
+    for position, field in enumerate(fields):
+        projection.append(f"#p{position}")
+        expression_attribute_names[f"#p{position}"] = field
+
+    query = {
+        "TableName": table_name,
+        "IndexName": USER_INDEX_NAME,
+        "ProjectionExpression": ", ".join(projection),
+        "KeyConditionExpression": key_condition,
+        "ExpressionAttributeNames": expression_attribute_names,
+        "ExpressionAttributeValues": expression_attribute_values,
+        "ScanIndexForward": False,
+    }
+    if filter_expressions:
+        query["FilterExpression"] = " AND ".join(filter_expressions)
+    return query
+
+
+def encode_next_token(user_position, last_evaluated_key):
+    """
+    Encodes the position of the next page (user and LastEvaluatedKey) into an opaque token
+    """
+    cursor = {"user": user_position, "key": last_evaluated_key}
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode("utf-8")).decode("utf-8")
+
+
+def decode_next_token(next_token):
+    """
+    Returns (user_position, last_evaluated_key) of a token, (0, None) without token.
+    Raises ValueError on malformed tokens.
+    """
+    if not next_token:
+        return 0, None
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(next_token.encode("utf-8")))
+        return int(cursor["user"]), cursor["key"]
+    except (binascii.Error, ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid next_token: {e}") from e
+
+
+def parse_page_size(page_size):
+    """
+    Clamps the requested page size to [1, MAX_PAGE_SIZE]
+    """
+    try:
+        return max(1, min(int(page_size or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+
+
+def query_page(dynamodb, query, page_size, exclusive_start_key=None):
+    """
+    Reads up to page_size matching items, starting after exclusive_start_key.
+    Limit caps the evaluated items of each call to what is still missing, so that a FilterExpression
+    can never return more than the page and the LastEvaluatedKey always points after the last item.
+
+    Returns:
+        (items, last_evaluated_key): last_evaluated_key is None once the query is exhausted
+    """
+    items = []
+    while len(items) < page_size:
+        page_query = {**query, "Limit": page_size - len(items)}
+        if exclusive_start_key:
+            page_query["ExclusiveStartKey"] = exclusive_start_key
+        response = dynamodb.query(**page_query)
+        items.extend(response.get("Items", []))
+        exclusive_start_key = response.get("LastEvaluatedKey")
+        if not exclusive_start_key:
+            break
+    return items, exclusive_start_key
+
+
+def build_item_data(item):
+    """
+    Builds the typed DynamoDB item of a prompt
+    """
+    # Construct the item data as a dictionary
+    item_data = {
+        "session_id": {"S": item.get("session_id", "")},
+        "model": {"S": item.get("model", "")},
+        "answer_length": {"N": item.get("answer_length", "")},
+        "temperature": {"N": item.get("temperature", "")},
+        "Prompt Template": {"S": item.get("Prompt Template", "")},
+        "Prompt": {"S": item.get("Prompt", "")},
+        "Output": {"S": item.get("Output", "")},
+    }
+    # key attributes of the user index, which rejects empty strings: left out when absent,
+    # the prompt is then simply not listed in the index
+    for key in ("user_id", "timestamp"):
+        if item.get(key):
+            item_data[key] = {"S": item[key]}
+    return item_data
+
+
+def batch_write(dynamodb, table_name, requests):
+    """
+    Writes (index, WriteRequest) pairs with BatchWriteItem, in chunks of BATCH_WRITE_SIZE.
+    UnprocessedItems are retried with exponential backoff and jitter.
+
+    Returns:
+        dict: index -> error message of the requests that could not be written
+    """
+    errors = {}
+    for start in range(0, len(requests), BATCH_WRITE_SIZE):
+        chunk_requests = requests[start : start + BATCH_WRITE_SIZE]
+        # requests are matched back to their index through the session_id, unique within a batch
+        pending = {session_id_of(request): index for index, request in chunk_requests}
+        chunk = [request for _, request in chunk_requests]
+        for attempt in range(MAX_BATCH_RETRIES + 1):
+            if attempt:
+                time.sleep(random.uniform(0, BATCH_RETRY_BASE_DELAY * 2**attempt))
+            try:
+                response = dynamodb.batch_write_item(RequestItems={table_name: chunk})
+            except Exception as e:
+                LOGGER.error(f"BatchWriteItem failed: {e}")
+                errors.update({index: str(e) for index in pending.values()})
+                break
+            chunk = response.get("UnprocessedItems", {}).get(table_name, [])
+            if not chunk:
+                break
+            LOGGER.info(f"{len(chunk)} unprocessed items after attempt {attempt + 1}")
+        else:
+            errors.update(
+                {pending[session_id_of(request)]: "Unprocessed after retries" for request in chunk}
+            )
+    return errors
+
+
+def session_id_of(request):
+    """
+    Returns the session_id a BatchWriteItem request writes to
+    """
+    if "PutRequest" in request:
+        return request["PutRequest"]["Item"]["session_id"]["S"]
+    return request["DeleteRequest"]["Key"]["session_id"]["S"]
+
+
+def version_key(user_id):
+    return {"session_id": {"S": f"{VERSION_KEY_PREFIX}{user_id}"}}
+
+
+def bump_catalog_versions(dynamodb, table_name, user_ids):
+    """
+    Increments the catalog version of every user whose prompts were written and records the time of the write.
+    A failed increment is logged, the write itself already succeeded.
+    """
+    for user_id in {user_id for user_id in user_ids if user_id}:
+        try:
+            dynamodb.update_item(
+                TableName=table_name,
+                Key=version_key(user_id),
+                UpdateExpression="ADD #version :one SET #updated_at = :now",
+                ExpressionAttributeNames={"#version": "version", "#updated_at": "updated_at"},
+                ExpressionAttributeValues={":one": {"N": "1"}, ":now": {"N": str(time.time())}},
+            )
+        except Exception as e:
+            LOGGER.error(f"Error bumping catalog version of {user_id}: {e}")
+
+
+def get_catalog_versions(dynamodb, table_name, user_ids):
+    """
+    Returns the catalog version of each user (0 for users who never wrote) and the time of the last write
+    of any of them (0 if unknown)
+    """
+    versions = []
+    last_write = 0.0
+    for user_id in user_ids:
+        item = dynamodb.get_item(TableName=table_name, Key=version_key(user_id), ConsistentRead=True).get("Item")
+        versions.append(int(item["version"]["N"]) if item else 0)
+        if item and "updated_at" in item:
+            last_write = max(last_write, float(item["updated_at"]["N"]))
+    return versions, last_write
+
+
+def make_etag(versions, request):
+    """
+    Entity tag of a catalog page: changes with the catalog versions of its users and with the request
+    """
+    payload = json.dumps({"versions": versions, "request": request}, sort_keys=True)
+    return '"' + hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def etag_matches(etag, if_none_match):
+    """
+    Checks an If-None-Match header value (a list of entity tags or *) against an entity tag
+    """
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def lookup_user_ids(dynamodb, table_name, session_ids):
+    """
+    Returns the user_id of the given prompts with BatchGetItem (100 keys per call)
+    """
+    user_ids = {}
+    for start in range(0, len(session_ids), 100):
+        keys = [{"session_id": {"S": session_id}} for session_id in session_ids[start : start + 100]]
+        for attempt in range(MAX_BATCH_RETRIES + 1):
+            if attempt:
+                time.sleep(random.uniform(0, BATCH_RETRY_BASE_DELAY * 2**attempt))
+            response = dynamodb.batch_get_item(
+                RequestItems={table_name: {"Keys": keys, "ProjectionExpression": "session_id, user_id"}}
+            )
+            for item in response.get("Responses", {}).get(table_name, []):
+                user_ids[item["session_id"]["S"]] = item.get("user_id", {}).get("S")
+            keys = response.get("UnprocessedKeys", {}).get(table_name, {}).get("Keys", [])
+            if not keys:
+                break
+    return user_ids
+
+
+def update_search_indexes(s3, added, removed, user_ids):
+    """
+    Applies written prompts ({session_id: item}) and deleted session_ids to the search index of their users.
+    Index failures are logged and counted in the SearchIndexUpdateFailures metric, the catalog write itself
+    already succeeded. A REINDEX request repairs the index of a user.
+    """
+    failures = 0
+    changes = {}
+    for session_id, item in added.items():
+        changes.setdefault(user_ids.get(session_id), ({}, []))[0][session_id] = item
+    for session_id in removed:
+        changes.setdefault(user_ids.get(session_id), ({}, []))[1].append(session_id)
+    for user_id, (user_added, user_removed) in changes.items():
+        try:
+            update_index(s3, user_id, added=user_added, removed=user_removed)
+        except Exception as e:
+            LOGGER.error(f"Error updating the search index of {user_id}: {e}")
+            failures += 1
+    if failures:
+        put_metric("SearchIndexUpdateFailures", failures)
+
+
+def get_items(dynamodb, table_name, session_ids, fields=SUMMARY_FIELDS):
+    """
+    Returns the typed items of at most 100 prompts by session_id with BatchGetItem, limited to the given fields
+    """
+    names = {f"#p{position}": field for position, field in enumerate(fields)}
+    request = {
+        "Keys": [{"session_id": {"S": session_id}} for session_id in session_ids],
+        "ProjectionExpression": ", ".join(names),
+        "ExpressionAttributeNames": names,
+    }
+    items = {}
+    while request["Keys"]:
+        response = dynamodb.batch_get_item(RequestItems={table_name: request})
+        for item in response.get("Responses", {}).get(table_name, []):
+            items[item["session_id"]["S"]] = item
+        request = response.get("UnprocessedKeys", {}).get(table_name, {"Keys": []})
+    return items
+
+
+def parse_user_ids(filter_params):
+    """
+    Users of a catalog listing: the requesting user and the users of the optional user_ids_filter
+    """
+    user_ids_filter_str = filter_params.get("user_ids_filter", "")
+    if user_ids_filter_str != "":
+        user_ids_filter = ast.literal_eval(user_ids_filter_str)
+    else:
+        user_ids_filter = []
+
+    user_id = filter_params.get("user_id")
+    user_ids_filter.append(user_id)
+    # Incorporating user_ids_filter for possible filter expansion in UI: one indexed Query per user,
+    # the pages walk through the users one after the other
+    return [user_id for user_id in dict.fromkeys(user_ids_filter) if user_id]
+
+
+def read_catalog_page(dynamodb, table_name, user_ids, filter_params, fields, page_size, next_token):
+    """
+    Reads one page of the catalogs of the users, from the position of next_token
+
+    Returns:
+        (typed items, token of the next page or None)
+    """
+    user_position, exclusive_start_key = decode_next_token(next_token)
+    items = []
+    next_token = None
+    while user_position < len(user_ids) and len(items) < page_size:
+        query = build_user_query(table_name, user_ids[user_position], filter_params, fields)
+        LOGGER.info(f"Query: {query}")
+        user_items, exclusive_start_key = query_page(dynamodb, query, page_size - len(items), exclusive_start_key)
+        items.extend(user_items)
+        if exclusive_start_key:
+            next_token = encode_next_token(user_position, exclusive_start_key)
+            break
+        user_position += 1
+    if next_token is None and user_position < len(user_ids):
+        # page filled exactly at the end of a user, continue with the next one
+        next_token = encode_next_token(user_position, None)
+    return items, next_token
+
+
+def build_batch_requests(operations, s3):
+    """
+    Validates the {"type": "PUT" | "DELETE", "item": {...}} operations of a BATCH request
+
+    Returns:
+        (results, requests): one result per operation, FAILED for invalid ones, and the
+        (index, WriteRequest) pairs of the valid ones
+    """
+    results = []
+    requests = []
+    session_ids = set()
+    for index, operation in enumerate(operations):
+        item = operation.get("item", {})
+        session_id = item.get("session_id")
+        result = {"index": index, "session_id": session_id, "status": "SUCCESS"}
+        results.append(result)
+        if not session_id:
+            result.update(status="FAILED", error="session_id is required")
+        elif session_id in session_ids:
+            # BatchWriteItem rejects the whole call if a key appears twice
+            result.update(status="FAILED", error="Duplicate session_id in batch")
+        elif operation.get("type") == "PUT":
+            try:
+                requests.append((index, {"PutRequest": {"Item": encode_item_texts(build_item_data(item), s3)}}))
+            except Exception as e:
+                result.update(status="FAILED", error=str(e))
+        elif operation.get("type") == "DELETE":
+            requests.append((index, {"DeleteRequest": {"Key": {"session_id": {"S": session_id}}}}))
+        else:
+            result.update(status="FAILED", error=f"Invalid operation type {operation.get('type')}")
+        session_ids.add(session_id)
+    return results, requests
+
+
+#########################
+#      OPERATIONS
+#########################
+
+
+def handle_put(dynamodb, table_name, s3, body, headers):
+    """
+    Saves a prompt
+    """
+    # Extract the 'item' dictionary from the body
+    item = body.get("item", {})
+    item_data = build_item_data(item)
+    LOGGER.info(f"Item data: {item_data}")
+
+    # Put the item into DynamoDB table, long texts compressed or spilled to S3
+    try:
+        item_data = encode_item_texts(item_data, s3)
+        dynamodb.put_item(TableName=table_name, Item=item_data)
+        bump_catalog_versions(dynamodb, table_name, [item.get("user_id")])
+        update_search_indexes(s3, {item.get("session_id"): item}, [], {item.get("session_id"): item.get("user_id")})
+
+        LOGGER.info("successfully put item!")
+        return {"statusCode": 200, "body": json.dumps("Item successfully added to DynamoDB table")}
+    except Exception as e:
+        LOGGER.info(f"Unuccessful! Exception: {e}")
+        return {"statusCode": 500, "body": json.dumps("Error adding item to DynamoDB table: {}".format(str(e)))}
+
+
+def handle_get(dynamodb, table_name, s3, body, headers):
+    """
+    Lists one page of prompt summaries of the catalogs of the requested users
+    """
+    # Extract filter parameters
+    filter_params = body.get("filter_params", {})
+    print(filter_params)
+    user_ids = parse_user_ids(filter_params)
+    page_size = parse_page_size(body.get("page_size"))
+    # the heavy texts are not in the index, they are served by the DETAIL request
+    fields = body.get("fields") or SUMMARY_FIELDS
+    unknown_fields = set(fields) - set(SUMMARY_FIELDS)
+    if unknown_fields:
+        LOGGER.error(f"Invalid fields: {unknown_fields}")
+        return {"statusCode": 400, "body": json.dumps(f"Invalid fields, expected a subset of {SUMMARY_FIELDS}")}
+    try:
+        decode_next_token(body.get("next_token"))
+    except ValueError as e:
+        LOGGER.error(str(e))
+        return {"statusCode": 400, "body": json.dumps(str(e))}
+
+    try:
+        # conditional GET: the page did not change if the catalog versions of its users did not,
+        # once the index the page is read from had the time to catch up with the last write
+        request = {
+            "user_ids": user_ids,
+            "filter_params": filter_params,
+            "page_size": page_size,
+            "next_token": body.get("next_token"),
+            "fields": fields,
+        }
+        versions, last_write = get_catalog_versions(dynamodb, table_name, user_ids)
+        etag = make_etag(versions, request)
+        if time.time() - last_write < GSI_SETTLE_SECONDS:
+            LOGGER.info("Catalog written recently, page served without ETag")
+            etag = None
+        if etag and etag_matches(etag, headers.get("if-none-match")):
+            LOGGER.info("Catalog page not modified")
+            return {"statusCode": 304, "headers": {"ETag": etag}}
+
+        items, next_token = read_catalog_page(
+            dynamodb, table_name, user_ids, filter_params, fields, page_size, body.get("next_token")
+        )
+        LOGGER.info(f"Retrieved {len(items)} items")
+        clean_item_list = [remove_dynamodb_type_descriptors(item) for item in items]
+
+        # Return the page, the token of the next one and the fields listed, for clients to shape their own items
+        return {
+            "statusCode": 200,
+            "headers": {"ETag": etag} if etag else {},
+            "body": json.dumps({"items": clean_item_list, "next_token": next_token, "fields": fields}),
+        }
+    except Exception as e:
+        LOGGER.error(f"Error retrieving items: {e}")
+        return {"statusCode": 500, "body": json.dumps(f"Error retrieving items from DynamoDB: {str(e)}")}
+
+
+def handle_search(dynamodb, table_name, s3, body, headers):
+    """
+    Full-text search over the prompt templates and outputs of a user
+    """
+    query = body.get("query", "")
+    user_id = body.get("user_id")
+    if not user_id or not query.strip():
+        return {"statusCode": 400, "body": json.dumps("user_id and query are required for SEARCH operation")}
+    try:
+        limit = max(1, min(int(body.get("limit") or DEFAULT_SEARCH_LIMIT), MAX_SEARCH_LIMIT))
+    except (TypeError, ValueError):
+        limit = DEFAULT_SEARCH_LIMIT
+
+    try:
+        matches = search_prompts(s3, user_id, query, limit=limit)
+        summaries = get_items(dynamodb, table_name, [session_id for session_id, _ in matches])
+    except Exception as e:
+        LOGGER.error(f"Error searching prompts: {e}")
+        return {"statusCode": 500, "body": json.dumps(f"Error searching prompts: {str(e)}")}
+
+    # the index can still reference prompts deleted a moment ago, they have no summary
+    items = [
+        {**remove_dynamodb_type_descriptors(summaries[session_id]), "score": round(score, 4)}
+        for session_id, score in matches
+        if session_id in summaries
+    ]
+    LOGGER.info(f"SEARCH returned {len(items)} items")
+    return {"statusCode": 200, "body": json.dumps({"items": items})}
+
+
+def handle_detail(dynamodb, table_name, s3, body, headers):
+    """
+    All attributes of one prompt ("item"), or selected texts of many prompts ("session_ids")
+    """
+    if "session_ids" in body:
+        return handle_detail_many(dynamodb, table_name, s3, body)
+
+    # Extract the 'session_id' from the body
+    session_id = body.get("item", {}).get("session_id")
+    if not session_id:
+        LOGGER.error("session_id is required for DETAIL operation")
+        return {"statusCode": 400, "body": json.dumps("session_id is required for DETAIL operation")}
+
+    try:
+        response = dynamodb.get_item(TableName=table_name, Key={"session_id": {"S": session_id}})
+        if "Item" not in response:
+            return {"statusCode": 404, "body": json.dumps(f"Item with session_id {session_id} not found")}
+        item = decode_item_texts(response["Item"], s3)
+    except Exception as e:
+        LOGGER.error(f"Error retrieving item: {e}")
+        return {"statusCode": 500, "body": json.dumps(f"Error retrieving item from DynamoDB: {str(e)}")}
+
+    return {"statusCode": 200, "body": json.dumps(remove_dynamodb_type_descriptors(item))}
+
+
+def handle_detail_many(dynamodb, table_name, s3, body):
+    """
+    Selected attributes of many prompts, e.g. the templates of a catalog page
+    """
+    session_ids = list(dict.fromkeys(body["session_ids"]))
+    fields = body.get("fields") or DETAIL_FIELDS
+    if len(session_ids) > MAX_DETAIL_ITEMS or not set(fields) <= set(DETAIL_FIELDS):
+        return {
+            "statusCode": 400,
+            "body": json.dumps(f"At most {MAX_DETAIL_ITEMS} session_ids and fields among {DETAIL_FIELDS}"),
+        }
+
+    try:
+        found = get_items(dynamodb, table_name, session_ids, fields=["session_id"] + fields)
+        items = [
+            remove_dynamodb_type_descriptors(decode_item_texts(found[session_id], s3))
+            for session_id in session_ids
+            if session_id in found
+        ]
+    except Exception as e:
+        LOGGER.error(f"Error retrieving items: {e}")
+        return {"statusCode": 500, "body": json.dumps(f"Error retrieving items from DynamoDB: {str(e)}")}
+
+    LOGGER.info(f"DETAIL returned {len(items)} of {len(session_ids)} items")
+    return {"statusCode": 200, "body": json.dumps({"items": items})}
+
+
+def handle_batch(dynamodb, table_name, s3, body, headers):
+    """
+    Applies a list of {"type": "PUT" | "DELETE", "item": {...}} operations with BatchWriteItem,
+    with one result per operation
+    """
+    operations = body.get("operations", [])
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return {
+            "statusCode": 400,
+            "body": json.dumps(f"At most {MAX_BATCH_OPERATIONS} operations per BATCH request"),
+        }
+    results, requests = build_batch_requests(operations, s3)
+
+    # the user of a deleted prompt is needed to bump its catalog version
+    items = [operation.get("item", {}) for operation in operations]
+    user_ids = {item.get("session_id"): item.get("user_id") for item in items}
+    missing_user_ids = [
+        session_id_of(request)
+        for _, request in requests
+        if "DeleteRequest" in request and not user_ids.get(session_id_of(request))
+    ]
+    if missing_user_ids:
+        try:
+            user_ids.update(lookup_user_ids(dynamodb, table_name, missing_user_ids))
+        except Exception as e:
+            LOGGER.error(f"Error looking up the users of deleted prompts: {e}")
+
+    for index, error in batch_write(dynamodb, table_name, requests).items():
+        results[index].update(status="FAILED", error=error)
+    bump_catalog_versions(
+        dynamodb,
+        table_name,
+        [user_ids.get(result["session_id"]) for result in results if result["status"] == "SUCCESS"],
+    )
+    succeeded = {index for index, _ in requests if results[index]["status"] == "SUCCESS"}
+    update_search_indexes(
+        s3,
+        {items[index]["session_id"]: items[index] for index in succeeded if operations[index]["type"] == "PUT"},
+        [items[index]["session_id"] for index in succeeded if operations[index]["type"] == "DELETE"],
+        user_ids,
+    )
+
+    # BatchWriteItem does not return the deleted items, spilled texts are removed by their key
+    deleted = [items[index]["session_id"] for index in succeeded if operations[index]["type"] == "DELETE"]
+    try:
+        delete_spilled_texts_by_session(deleted, s3)
+    except Exception as e:
+        LOGGER.error(f"Error deleting spilled texts: {e}")
+
+    failed = sum(result["status"] == "FAILED" for result in results)
+    LOGGER.info(f"BATCH of {len(results)} operations, {failed} failed")
+    return {"statusCode": 200, "body": json.dumps(results)}
+
+
+def handle_delete(dynamodb, table_name, s3, body, headers):
+    """
+    Deletes a prompt and its spilled texts
+    """
+    # Extract the 'session_id' from the body
+    print("made it into the delete section! ")
+    session_id = body["item"]["session_id"]
+    LOGGER.debug(f"session_id {session_id}, {type(session_id)}")
+
+    if not session_id:
+        LOGGER.error("session_id is required for DELETE operation")
+        return {"statusCode": 400, "body": json.dumps("session_id is required for DELETE operation")}
+
+    try:
+        response = dynamodb.delete_item(
+            TableName=table_name,
+            Key={"session_id": {"S": session_id}},  # "S" indicates that the datatype is a string.
+            ReturnValues="ALL_OLD",
+        )
+        delete_spilled_texts(response.get("Attributes", {}), s3)
+        deleted_user_id = response.get("Attributes", {}).get("user_id", {}).get("S")
+        bump_catalog_versions(dynamodb, table_name, [deleted_user_id])
+        update_search_indexes(s3, {}, [session_id], {session_id: deleted_user_id})
+
+        LOGGER.info(f"Deleted item with session_id: {session_id}")
+
+        return {"statusCode": 200, "body": json.dumps(f"Item with session_id {session_id} successfully deleted")}
+    except Exception as e:
+        LOGGER.error(f"Error deleting item: {e}")
+        return {"statusCode": 500, "body": json.dumps(f"Error deleting item from DynamoDB: {str(e)}")}
+
+
+def handle_reindex(dynamodb, table_name, s3, body, headers):
+    """
+    Rebuilds the search index of a user from all their prompts
+    """
+    user_id = body.get("user_id")
+    if not user_id:
+        return {"statusCode": 400, "body": json.dumps("user_id is required for REINDEX operation")}
+    try:
+        query = build_user_query(table_name, user_id, {}, fields=["session_id"])
+        session_ids, last_evaluated_key = [], None
+        while True:
+            items, last_evaluated_key = query_page(dynamodb, query, MAX_PAGE_SIZE, last_evaluated_key)
+            session_ids.extend(item["session_id"]["S"] for item in items)
+            if not last_evaluated_key:
+                break
+        prompts = {}
+        for start in range(0, len(session_ids), MAX_DETAIL_ITEMS):
+            found = get_items(
+                dynamodb, table_name, session_ids[start : start + MAX_DETAIL_ITEMS], ["session_id"] + INDEXED_ATTRIBUTES
+            )
+            for session_id, item in found.items():
+                prompts[session_id] = remove_dynamodb_type_descriptors(decode_item_texts(item, s3))
+        rebuild_index(s3, user_id, prompts)
+    except Exception as e:
+        LOGGER.error(f"Error rebuilding the search index of {user_id}: {e}")
+        return {"statusCode": 500, "body": json.dumps(f"Error rebuilding the search index: {str(e)}")}
+    return {"statusCode": 200, "body": json.dumps({"indexed": len(prompts)})}
+
+
+# payload type -> handler(dynamodb, table_name, s3, body, headers)
+OPERATIONS = {
+    "PUT": handle_put,
+    "GET": handle_get,
+    "SEARCH": handle_search,
+    "DETAIL": handle_detail,
+    "BATCH": handle_batch,
+    "DELETE": handle_delete,
+    "REINDEX": handle_reindex,
+}
+
+
 #########################
 #        HANDLER
 #########################
@@ -45,153 +765,18 @@ def lambda_handler(event, context):
 
     LOGGER.info(f"The incoming payload body:{body}")
 
+    handler = OPERATIONS.get(payload_type) if isinstance(payload_type, str) else None
+    if handler is None:
+        return {"statusCode": 400, "body": json.dumps("Invalid payload type")}
+
     LOGGER.info("Standing up DDB connection!")
-    dynamodb = boto3.client("dynamodb")
+    dynamodb = get_client("dynamodb")
 
     # Get the DynamoDB table name from environment variable
     table_name = os.environ["TABLE_NAME"]
     LOGGER.info("boto3 dynamo established!")
+    # bucket of the texts too large for the item
+    s3 = get_client("s3")
 
-    if payload_type == "PUT":
-        # Extract the 'item' dictionary from the body
-        item = body.get("item", {})
-        # Construct the item data as a dictionary
-        item_data = {
-            "session_id": {"S": item.get("session_id", "")},
-            "user_id": {"S": item.get("user_id", "")},
-            "timestamp": {"S": item.get("timestamp", "")},
-            "model": {"S": item.get("model", "")},
-            "answer_length": {"N": item.get("answer_length", "")},
-            "temperature": {"N": item.get("temperature", "")},
-            "Prompt Template": {"S": item.get("Prompt Template", "")},
-            "Prompt": {"S": item.get("Prompt", "")},
-            "Output": {"S": item.get("Output", "")},
-        }
-        LOGGER.info(f"Item data: {item_data}")
-
-        # Put the item into DynamoDB table
-        try:
-            response = dynamodb.put_item(TableName=table_name, Item=item_data)
-
-            LOGGER.info(f"successfully put item!")
-            return {"statusCode": 200, "body": json.dumps("Item successfully added to DynamoDB table")}
-        except Exception as e:
-            LOGGER.info(f"Unuccessful! Exception: {e}")
-            return {"statusCode": 500, "body": json.dumps("Error adding item to DynamoDB table: {}".format(str(e)))}
-
-    if payload_type == "GET":
-        # Extract filter parameters
-        filter_params = body.get("filter_params", {})
-        print(filter_params)
-        user_ids_filter_str = filter_params.get("user_ids_filter", "")
-        if user_ids_filter_str != "":
-            user_ids_filter = ast.literal_eval(user_ids_filter_str)
-        else:
-            user_ids_filter = []
-
-        # retrieving filter values
-        industry_filter = filter_params.get("industry_filter")
-        language_filter = filter_params.get("language_filter")
-        task_filter = filter_params.get("task_filter")
-        technique_filter = filter_params.get("technique_filter")
-        ai_model_filter = filter_params.get("ai_model_filter")
-
-        user_id = filter_params.get("user_id")
-        user_ids_filter.append(user_id)
-        # Create FilterExpression and ExpressionAttributeValues
-        filter_expressions = []
-        expression_attribute_values = {}
-        # Use an expression attribute names dictionary to handle reserved words
-        expression_attribute_names = {}
-
-        # Incorporating user_ids_filter for possiblle filter expansion in UI
-        if user_ids_filter:
-            user_id_placeholders = [f":user_id_{i}" for i, _ in enumerate(user_ids_filter)]
-            filter_expressions.append(f"user_id IN ({', '.join(user_id_placeholders)})")
-            for placeholder, user_id in zip(user_id_placeholders, user_ids_filter):
-                expression_attribute_values[placeholder] = {"S": user_id}
-
-        if industry_filter and industry_filter != "ALL":
-            filter_expressions.append("Industry = :industry")
-            expression_attribute_values[":industry"] = {"S": industry_filter}
-
-        # Incorporating language_filter
-        if language_filter and language_filter != "ALL":
-            filter_expressions.append("#Language = :language")
-            expression_attribute_values[":language"] = {"S": language_filter}
-            expression_attribute_names["#Language"] = "Language"
-
-        # Incorporating task_filter
-        if task_filter and task_filter != "ALL":
-            filter_expressions.append("Task = :task")
-            expression_attribute_values[":task"] = {"S": task_filter}
-
-        # Incorporating technique_filter
-        if technique_filter and technique_filter != "ALL":
-            filter_expressions.append("Technique = :technique")
-            expression_attribute_values[":technique"] = {"S": technique_filter}
-
-        # Incorporating ai_model_filter
-        if ai_model_filter and ai_model_filter != "ALL":
-            filter_expressions.append("model = :model")
-            expression_attribute_values[":model"] = {"S": ai_model_filter}
-
-        filter_expression_string = " AND ".join(filter_expressions)
-        print(f"FilterExpressions = {filter_expression_string}")
-        print(f"Expression Attributes: {expression_attribute_values}")
-        try:
-            if expression_attribute_names != {}:
-                response = dynamodb.scan(
-                    TableName=table_name,
-                    Limit=1000,
-                    FilterExpression=filter_expression_string if filter_expressions else None,
-                    ExpressionAttributeValues=expression_attribute_values if expression_attribute_values else None,
-                    ExpressionAttributeNames=expression_attribute_names if expression_attribute_names else None,
-                )
-            else:
-                # Use scan with FilterExpression to get items. Limit to 1000 items.
-                response = dynamodb.scan(
-                    TableName=table_name,
-                    Limit=1000,
-                    FilterExpression=filter_expression_string if filter_expressions else None,
-                    ExpressionAttributeValues=expression_attribute_values if expression_attribute_values else None,
-                )
-
-            items = response.get("Items", {})
-            LOGGER.info(f"Retrieved {len(items)} items")
-            clean_item_list = []
-            for item in items:
-                clean_item = remove_dynamodb_type_descriptors(item)
-                clean_item_list.append(clean_item)
-
-            # Return items in response
-            return {"statusCode": 200, "body": json.dumps(clean_item_list)}
-        except Exception as e:
-            LOGGER.error(f"Error retrieving items: {e}")
-            return {"statusCode": 500, "body": json.dumps(f"Error retrieving items from DynamoDB: {str(e)}")}
-
-    elif payload_type == "DELETE":
-        # Extract the 'session_id' from the body
-        print("made it into the delete section! ")
-        session_id = body["item"]["session_id"]
-        LOGGER.debug(f"session_id {session_id}, {type(session_id)}")
-
-        if not session_id:
-            LOGGER.error("session_id is required for DELETE operation")
-            return {"statusCode": 400, "body": json.dumps("session_id is required for DELETE operation")}
-
-        try:
-            response = dynamodb.delete_item(
-                TableName=table_name,
-                Key={"session_id": {"S": session_id}},  # "S" indicates that the datatype is a string.
-            )
-
-            LOGGER.info(f"Deleted item with session_id: {session_id}")
-
-            return {"statusCode": 200, "body": json.dumps(f"Item with session_id {session_id} successfully deleted")}
-        except Exception as e:
-            LOGGER.error(f"Error deleting item: {e}")
-            return {"statusCode": 500, "body": json.dumps(f"Error deleting item from DynamoDB: {str(e)}")}
-
-    else:
-        return {"statusCode": 400, "body": json.dumps("Invalid payload type")}
+    headers = {key.lower(): value for key, value in (event.get("headers") or {}).items()}
+    return handler(dynamodb, table_name, s3, body, headers)
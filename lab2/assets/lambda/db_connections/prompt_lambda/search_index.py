@@ -0,0 +1,326 @@
+"""
+BM25 full-text index over the saved prompts of a user, persisted in S3 as gzip JSON shards so that
+a write only rewrites the shards of the terms and documents it touches:
+- terms-NN: postings of the terms hashed to the shard, term -> {session_id: [term frequency, document length]}
+- docs-NN: documents hashed to the shard, session_id -> [document length, unique terms], the terms are
+  kept to remove a document without scanning the vocabulary
+- stats: number of documents and their total length, for the BM25 length normalization
+"""
+
+#########################
+#   LIBRARIES & LOGGER
+#########################
+
+import gzip
+import json
+import logging
+import math
+import os
+import re
+import sys
+import zlib
+from collections import Counter
+from functools import partial
+
+from botocore import __version__ as BOTOCORE_VERSION
+from botocore.exceptions import ClientError
+
+LOGGER = logging.Logger("Search-index", level=logging.DEBUG)
+HANDLER = logging.StreamHandler(sys.stdout)
+HANDLER.setFormatter(logging.Formatter("%(levelname)s | %(name)s | %(message)s"))
+LOGGER.addHandler(HANDLER)
+
+SEARCH_INDEX_BUCKET = os.environ.get("SEARCH_INDEX_BUCKET")
+
+# item attributes that are indexed
+INDEXED_ATTRIBUTES = ["Prompt Template", "Output"]
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# shards of an index, fixed for the life of the indexes (terms are hashed to a shard)
+TERM_SHARDS = 64
+DOC_SHARDS = 16
+STATS_SHARD = "stats"
+
+# optimistic concurrency retries of the read-modify-write of a shard
+MAX_WRITE_ATTEMPTS = 5
+
+# the shards are written with S3 conditional writes, PutObject accepts IfMatch from botocore 1.35.69 on
+MIN_BOTOCORE_VERSION = (1, 35, 69)
+CONDITIONAL_WRITES = tuple(int(part) for part in BOTOCORE_VERSION.split(".")[:3]) >= MIN_BOTOCORE_VERSION
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+", re.UNICODE)
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from has he in is it its of on or that the to was were will with you your".split()
+)
+
+
+#########################
+#        HELPER
+#########################
+
+
+def tokenize(text):
+    """
+    Lowercased word tokens without stop words and single characters
+    """
+    return [
+        token for token in TOKEN_PATTERN.findall(text.lower()) if len(token) > 1 and token not in STOP_WORDS
+    ]
+
+
+def shard_key(user_id, shard):
+    """
+    S3 key of a shard of the index of a user
+    """
+    return f"search-index/{user_id}/{shard}.json.gz"
+
+
+def legacy_index_key(user_id):
+    """
+    S3 key of the single-object index of a user, written before the indexes were sharded
+    """
+    return f"search-index/{user_id}.json.gz"
+
+
+def term_shard(term):
+    return f"terms-{zlib.crc32(term.encode('utf-8')) % TERM_SHARDS:02d}"
+
+
+def doc_shard(session_id):
+    return f"docs-{zlib.crc32(session_id.encode('utf-8')) % DOC_SHARDS:02d}"
+
+
+def all_shards():
+    """
+    Names of every shard of an index
+    """
+    return (
+        [f"docs-{number:02d}" for number in range(DOC_SHARDS)]
+        + [f"terms-{number:02d}" for number in range(TERM_SHARDS)]
+        + [STATS_SHARD]
+    )
+
+
+def group_by_shard(values, shard_of):
+    """
+    Splits a dict by the shard of its keys
+    """
+    groups = {}
+    for key, value in values.items():
+        groups.setdefault(shard_of(key), {})[key] = value
+    return groups
+
+
+def document_text(item):
+    """
+    Indexed text of a prompt item (plain, untyped attributes)
+    """
+    return "\n".join(item.get(attribute) or "" for attribute in INDEXED_ATTRIBUTES)
+
+
+#########################
+#        SHARDS
+#########################
+
+
+def replace_documents(docs, documents):
+    """
+    Replaces documents ({session_id: term counts, None to remove}) in the content of a document shard
+
+    Returns:
+        (postings changes, document count delta, total length delta), the changes are
+        term -> {session_id: posting, None to remove the posting}
+    """
+    changes, doc_delta, length_delta = {}, 0, 0
+    for session_id, counts in documents.items():
+        previous = docs.pop(session_id, None)
+        if previous is not None:
+            for term in previous[1]:
+                changes.setdefault(term, {})[session_id] = None
+            doc_delta, length_delta = doc_delta - 1, length_delta - previous[0]
+        if counts is None:
+            continue
+        length = sum(counts.values())
+        docs[session_id] = [length, list(counts)]
+        for term, count in counts.items():
+            changes.setdefault(term, {})[session_id] = [count, length]
+        doc_delta, length_delta = doc_delta + 1, length_delta + length
+    return changes, doc_delta, length_delta
+
+
+def apply_postings(terms, changes):
+    """
+    Applies postings changes to the content of a term shard
+    """
+    for term, postings in changes.items():
+        term_postings = terms.setdefault(term, {})
+        for session_id, posting in postings.items():
+            if posting is None:
+                term_postings.pop(session_id, None)
+            else:
+                term_postings[session_id] = posting
+        if not term_postings:
+            terms.pop(term)
+
+
+def apply_stats(stats, doc_delta, length_delta):
+    stats["docs"] = stats.get("docs", 0) + doc_delta
+    stats["length"] = stats.get("length", 0) + length_delta
+
+
+#########################
+#        STORAGE
+#########################
+
+# shards read by this container: (user_id, shard) -> (S3 ETag, content)
+_LOADED = {}
+
+
+def load_shard(s3_client, user_id, shard):
+    """
+    Returns (etag, content) of a shard, revalidating the copy of a warm container with If-None-Match.
+    A missing shard is empty, with a None etag.
+    """
+    cached = _LOADED.get((user_id, shard))
+    request = {"Bucket": SEARCH_INDEX_BUCKET, "Key": shard_key(user_id, shard)}
+    if cached:
+        request["IfNoneMatch"] = cached[0]
+    try:
+        response = s3_client.get_object(**request)
+    except ClientError as e:
+        code = e.response["Error"]["Code"]
+        if code in ("304", "NotModified"):
+            return cached
+        if code in ("NoSuchKey", "404"):
+            return None, {}
+        raise
+    loaded = (response["ETag"], json.loads(gzip.decompress(response["Body"].read())))
+    _LOADED[(user_id, shard)] = loaded
+    return loaded
+
+
+def write_shard(s3_client, user_id, shard, content, **condition):
+    """
+    Writes the content of a shard, with an optional IfMatch / IfNoneMatch condition
+    """
+    response = s3_client.put_object(
+        Bucket=SEARCH_INDEX_BUCKET,
+        Key=shard_key(user_id, shard),
+        Body=gzip.compress(json.dumps(content, separators=(",", ":")).encode("utf-8")),
+        ContentEncoding="gzip",
+        **condition,
+    )
+    _LOADED[(user_id, shard)] = (response["ETag"], content)
+
+
+def update_shard(s3_client, user_id, shard, apply):
+    """
+    Read-modify-write of a shard: apply(content) modifies the content in place and returns a result.
+    The write is retried when another writer updated the shard in between.
+
+    Returns:
+        the result of apply on the content that was written
+
+    Raises:
+        RuntimeError: if the shard could not be written in MAX_WRITE_ATTEMPTS attempts
+    """
+    for attempt in range(MAX_WRITE_ATTEMPTS):
+        etag, content = load_shard(s3_client, user_id, shard)
+        # the loaded copy is modified in place, it is only kept if the write succeeds
+        _LOADED.pop((user_id, shard), None)
+        result = apply(content)
+        try:
+            write_shard(s3_client, user_id, shard, content, **({"IfMatch": etag} if etag else {"IfNoneMatch": "*"}))
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("PreconditionFailed", "ConditionalRequestConflict", "412"):
+                raise
+            LOGGER.info(f"Shard {shard} of {user_id} changed concurrently, attempt {attempt + 1}/{MAX_WRITE_ATTEMPTS}")
+            continue
+        return result
+    raise RuntimeError(f"Shard {shard} of {user_id} not updated after {MAX_WRITE_ATTEMPTS} attempts")
+
+
+#########################
+#         INDEX
+#########################
+
+
+def update_index(s3_client, user_id, added=None, removed=None):
+    """
+    Applies added documents ({session_id: plain item}) and removed session_ids to the index of a user.
+    The document shards are written first, they hold the previous version of every document, then the
+    postings of the terms that changed and the statistics. The shards are not written atomically,
+    rebuild_index repairs an index left partial by a failed update.
+
+    Raises:
+        RuntimeError: if the SDK cannot make conditional writes or a shard could not be written
+    """
+    if not SEARCH_INDEX_BUCKET or not user_id:
+        return
+    if not CONDITIONAL_WRITES:
+        raise RuntimeError(f"botocore {BOTOCORE_VERSION} cannot make S3 conditional writes, 1.35.69 or later needed")
+    documents = {session_id: None for session_id in removed or []}
+    documents.update({session_id: Counter(tokenize(document_text(item))) for session_id, item in (added or {}).items()})
+
+    changes, doc_delta, length_delta = {}, 0, 0
+    for shard, shard_documents in group_by_shard(documents, doc_shard).items():
+        shard_changes, shard_doc_delta, shard_length_delta = update_shard(
+            s3_client, user_id, shard, partial(replace_documents, documents=shard_documents)
+        )
+        for term, postings in shard_changes.items():
+            changes.setdefault(term, {}).update(postings)
+        doc_delta, length_delta = doc_delta + shard_doc_delta, length_delta + shard_length_delta
+
+    for shard, shard_changes in group_by_shard(changes, term_shard).items():
+        update_shard(s3_client, user_id, shard, partial(apply_postings, changes=shard_changes))
+    if doc_delta or length_delta:
+        update_shard(
+            s3_client, user_id, STATS_SHARD, partial(apply_stats, doc_delta=doc_delta, length_delta=length_delta)
+        )
+
+
+def rebuild_index(s3_client, user_id, items):
+    """
+    Rewrites every shard of the index of a user from all their prompts ({session_id: plain item}): repairs an
+    index left partial by a failed update and indexes the prompts saved before the search index existed.
+    Updates made while the prompts are read can be lost, the rebuild is meant for a quiet catalog.
+    """
+    if not SEARCH_INDEX_BUCKET or not user_id:
+        return
+    shards = {shard: {} for shard in all_shards()}
+    for session_id, item in items.items():
+        changes, doc_delta, length_delta = replace_documents(
+            shards[doc_shard(session_id)], {session_id: Counter(tokenize(document_text(item)))}
+        )
+        for term, postings in changes.items():
+            shards[term_shard(term)].setdefault(term, {}).update(postings)
+        apply_stats(shards[STATS_SHARD], doc_delta, length_delta)
+    for shard, content in shards.items():
+        write_shard(s3_client, user_id, shard, content)
+    s3_client.delete_object(Bucket=SEARCH_INDEX_BUCKET, Key=legacy_index_key(user_id))
+    LOGGER.info(f"Rebuilt the index of {user_id} from {len(items)} prompts")
+
+
+def search_prompts(s3_client, user_id, query, limit=20):
+    """
+    Returns the (session_id, score) pairs of the best BM25 matches of a query, best first.
+    Only the statistics and the shards of the query terms are read.
+    """
+    _, stats = load_shard(s3_client, user_id, STATS_SHARD)
+    n_docs = stats.get("docs", 0)
+    if n_docs <= 0:
+        return []
+    average_length = max(stats.get("length", 0), 1) / n_docs
+    scores = Counter()
+    for term in set(tokenize(query)):
+        _, terms = load_shard(s3_client, user_id, term_shard(term))
+        postings = terms.get(term)
+        if not postings:
+            continue
+        idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+        for session_id, (frequency, length) in postings.items():
+            scores[session_id] += idf * frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * length / average_length))
+    return scores.most_common(limit)
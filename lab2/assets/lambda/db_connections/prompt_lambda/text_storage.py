@@ -0,0 +1,117 @@
+"""
+Storage of the long prompt texts: gzip-compressed binary attributes, spilled to S3 above a size limit
+"""
+
+#########################
+#   LIBRARIES & LOGGER
+#########################
+
+import gzip
+import logging
+import os
+import sys
+
+LOGGER = logging.Logger("Text-storage", level=logging.DEBUG)
+HANDLER = logging.StreamHandler(sys.stdout)
+HANDLER.setFormatter(logging.Formatter("%(levelname)s | %(name)s | %(message)s"))
+LOGGER.addHandler(HANDLER)
+
+# item attributes holding long texts
+TEXT_ATTRIBUTES = ["Prompt Template", "Prompt", "Output"]
+
+# texts above COMPRESSION_THRESHOLD bytes are stored gzip-compressed, compressed texts above
+# SPILL_THRESHOLD bytes are moved to SPILL_BUCKET (if set) and replaced by a pointer map
+COMPRESSION_THRESHOLD = int(os.environ.get("COMPRESSION_THRESHOLD", 1024))
+SPILL_THRESHOLD = int(os.environ.get("SPILL_THRESHOLD", 100 * 1024))
+SPILL_BUCKET = os.environ.get("SPILL_BUCKET")
+
+
+#########################
+#        HELPER
+#########################
+
+
+def spill_key(session_id, attribute):
+    """
+    S3 key of a spilled text
+    """
+    return f"prompts/{session_id}/{attribute.replace(' ', '_')}.gz"
+
+
+def encode_text(session_id, attribute, text, s3_client=None):
+    """
+    Returns the typed DynamoDB value of a text: {"S": text} for short texts, {"B": gzip} for long ones
+    and {"M": pointer} for texts written to S3.
+    """
+    raw = text.encode("utf-8")
+    if len(raw) <= COMPRESSION_THRESHOLD:
+        return {"S": text}
+
+    compressed = gzip.compress(raw)
+    if SPILL_BUCKET and s3_client is not None and len(compressed) > SPILL_THRESHOLD:
+        key = spill_key(session_id, attribute)
+        s3_client.put_object(Bucket=SPILL_BUCKET, Key=key, Body=compressed, ContentEncoding="gzip")
+        LOGGER.info(f"Spilled {attribute} of {session_id} ({len(compressed)} bytes) to s3://{SPILL_BUCKET}/{key}")
+        return {"M": {"bucket": {"S": SPILL_BUCKET}, "key": {"S": key}, "encoding": {"S": "gzip"}}}
+    return {"B": compressed}
+
+
+def decode_text(value, s3_client=None):
+    """
+    Returns the text of a typed DynamoDB value written by encode_text
+    """
+    if "S" in value:
+        return value["S"]
+    if "B" in value:
+        return gzip.decompress(value["B"]).decode("utf-8")
+    pointer = {name: field["S"] for name, field in value["M"].items()}
+    body = s3_client.get_object(Bucket=pointer["bucket"], Key=pointer["key"])["Body"].read()
+    return gzip.decompress(body).decode("utf-8")
+
+
+def encode_item_texts(item_data, s3_client=None):
+    """
+    Returns a copy of a typed item with encoded text attributes
+    """
+    item_data = dict(item_data)
+    session_id = item_data["session_id"]["S"]
+    for attribute in TEXT_ATTRIBUTES:
+        if "S" in item_data.get(attribute, {}):
+            item_data[attribute] = encode_text(session_id, attribute, item_data[attribute]["S"], s3_client)
+    return item_data
+
+
+def decode_item_texts(item, s3_client=None):
+    """
+    Returns a copy of a typed item with the text attributes decoded back to plain {"S": text} values
+    """
+    item = dict(item)
+    for attribute in TEXT_ATTRIBUTES:
+        if attribute in item:
+            item[attribute] = {"S": decode_text(item[attribute], s3_client)}
+    return item
+
+
+def delete_spilled_texts(item, s3_client):
+    """
+    Deletes the S3 objects a typed item points to
+    """
+    for attribute in TEXT_ATTRIBUTES:
+        value = item.get(attribute, {})
+        if "M" in value:
+            s3_client.delete_object(Bucket=value["M"]["bucket"]["S"], Key=value["M"]["key"]["S"])
+
+
+def delete_spilled_texts_by_session(session_ids, s3_client):
+    """
+    Deletes the S3 objects the texts of the given prompts may have been spilled to
+    """
+    if not SPILL_BUCKET or not session_ids:
+        return
+    keys = [spill_key(session_id, attribute) for session_id in session_ids for attribute in TEXT_ATTRIBUTES]
+    # DeleteObjects accepts at most 1000 keys, missing keys are not an error
+    for start in range(0, len(keys), 1000):
+        s3_client.delete_objects(
+            Bucket=SPILL_BUCKET,
+            Delete={"Objects": [{"Key": key} for key in keys[start : start + 1000]], "Quiet": True},
+        )
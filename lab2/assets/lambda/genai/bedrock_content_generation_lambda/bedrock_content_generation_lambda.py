@@ -10,10 +10,22 @@ import json
 import logging
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 
-import boto3
+from aws_clients import get_client, reset_clients
 from botocore.config import Config
+from converse_engine import (
+    ENGINE_CONVERSE,
+    ENGINE_INVOKE_MODEL,
+    ENGINES,
+    build_converse_request,
+    parse_converse_response,
+    parse_converse_usage,
+)
+from embeddings import DEFAULT_EMBEDDING_DIMENSIONS, EMBEDDING_DIMENSIONS, MAX_EMBEDDING_TEXTS, embed_texts
+from model_adapters import create_adapter
+from response_cache import CACHE_BYPASS, CACHE_HIT, CACHE_MISS, create_response_cache, is_cacheable, make_cache_key
 
 LOGGER = logging.Logger("Content-generation", level=logging.DEBUG)
 HANDLER = logging.StreamHandler(sys.stdout)
@@ -25,13 +37,38 @@ LOGGER.addHandler(HANDLER)
 #        HELPER
 #########################
 BEDROCK_ROLE_ARN = os.environ["BEDROCK_ROLE_ARN"]
-BEDROCK_CONFIG = Config(connect_timeout=60, read_timeout=60, retries={"max_attempts": 10})
+
+# Upper bound of parallel Bedrock calls for a batch request
+MAX_BATCH_CONCURRENCY = 16
+DEFAULT_BATCH_CONCURRENCY = 4
+
+# The records of a batch request are generated in a single round of parallel calls, so a request
+# takes about as long as one generation and stays within the 30 s HTTP API integration timeout
+MAX_BATCH_RECORDS = MAX_BATCH_CONCURRENCY
+
+BEDROCK_CONFIG = Config(
+    connect_timeout=60,
+    read_timeout=60,
+    retries={"mode": "adaptive", "max_attempts": 10},
+    max_pool_connections=MAX_BATCH_CONCURRENCY,
+)
 
 MODELS_MAPPING = {
     "Bedrock: Amazon Titan": "amazon.titan-text-express-v1",
-    "Bedrock: Claude 3 Sonnet": "anthropic.claude-3-sonnet-20240229-v1:0"
+    "Bedrock: Claude 3 Sonnet": "anthropic.claude-3-sonnet-20240229-v1:0",
+    "Bedrock: Claude 3.5 Haiku": "anthropic.claude-3-5-haiku-20241022-v1:0",
+    "Bedrock: Amazon Titan Premier": "amazon.titan-text-premier-v1:0",
+    "Bedrock: Llama 3 8B Instruct": "meta.llama3-8b-instruct-v1:0",
+    "Bedrock: Mistral 7B Instruct": "mistral.mistral-7b-instruct-v0:2",
 }
 
+# Fixed model params, one JSON file per model
+MODEL_CONFIGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_configs")
+REQUIRED_CONFIG_KEYS = {"STOP_WORDS", "TOP_P"}
+
+# Content type of the batch response (one JSON result per line)
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
 
 def create_bedrock_client():
     """
@@ -41,11 +78,7 @@ def create_bedrock_client():
         A tuple containing the Bedrock client and the expiration time (which is None).
     """
     LOGGER.info("Using bedrock client from same account.")
-    bedrock_client = boto3.client(
-        service_name="bedrock-runtime",
-        region_name=os.environ["BEDROCK_REGION"],
-        config=BEDROCK_CONFIG,
-    )
+    bedrock_client = get_client("bedrock-runtime", region_name=os.environ["BEDROCK_REGION"], config=BEDROCK_CONFIG)
     expiration = None
     LOGGER.info("Successfully set bedrock client")
 
@@ -53,6 +86,7 @@ def create_bedrock_client():
 
 
 BEDROCK_CLIENT, EXPIRATION = create_bedrock_client()
+RESPONSE_CACHE = create_response_cache()
 
 
 def verify_bedrock_client():
@@ -70,6 +104,172 @@ def verify_bedrock_client():
     return True
 
 
+def load_model_registry():
+    """
+    Loads the fixed params of every model in MODELS_MAPPING once at cold start and creates its adapter.
+    The config file of a model is named after its ID without the ':<version>' suffix.
+
+    Returns:
+        dict: model name -> ModelAdapter
+    """
+    registry = {}
+    for model_name, MODEL_ID in MODELS_MAPPING.items():
+        model_config_path = os.path.join(MODEL_CONFIGS_DIR, f"{MODEL_ID.split(':')[0]}.json")
+        if not os.path.exists(model_config_path):
+            raise FileNotFoundError(f"Missing model config for {model_name}: {model_config_path}")
+        with open(model_config_path) as f:
+            fixed_params = json.load(f)
+
+        missing_keys = REQUIRED_CONFIG_KEYS - fixed_params.keys()
+        if missing_keys:
+            raise ValueError(f"Model config {model_config_path} is missing {sorted(missing_keys)}")
+
+        registry[model_name] = create_adapter(MODEL_ID, fixed_params)
+    LOGGER.info(f"Loaded model registry: { {name: type(adapter).__name__ for name, adapter in registry.items()} }")
+    return registry
+
+
+MODEL_REGISTRY = load_model_registry()
+
+
+def invoke_engine(
+    adapter, query_value, model_params_value, system_prompt=None, engine=ENGINE_INVOKE_MODEL, cache_point=None
+):
+    """
+    Invokes the model with the selected engine.
+    The InvokeModel engine has no separate system prompt, so it is prepended to the user prompt.
+
+    Returns:
+        tuple: (text, usage) with the prompt-caching token counts in usage
+    """
+    if engine == ENGINE_CONVERSE:
+        request = build_converse_request(
+            adapter,
+            query_value,
+            model_params_value["answer_length"],
+            model_params_value["temperature"],
+            system_prompt=system_prompt,
+            cache_point=cache_point,
+        )
+        response = BEDROCK_CLIENT.converse(**request)
+        return parse_converse_response(response), parse_converse_usage(response.get("usage", {}))
+
+    if system_prompt:
+        query_value = f"{system_prompt}\n\n{query_value}"
+        cache_point = cache_point + len(system_prompt) + 2 if cache_point else None
+    body, invoke_kwargs = adapter.prepare_request(
+        query_value, model_params_value["answer_length"], model_params_value["temperature"], cache_point=cache_point
+    )
+    response = BEDROCK_CLIENT.invoke_model(body=body, modelId=adapter.model_id, **invoke_kwargs)
+
+    response_body = json.loads(response.get("body").read())
+
+    return adapter.parse_response(response_body), adapter.parse_usage(response_body)
+
+
+def request_cache_key(adapter, query_value, model_params_value, system_prompt, engine):
+    """
+    Cache key of a request, the fixed params of the model, the system prompt and the engine are part of the key.
+    """
+    return make_cache_key(
+        adapter.model_id,
+        adapter.fixed_params,
+        query_value,
+        {**model_params_value, "system_prompt": system_prompt, "engine": engine},
+    )
+
+
+def generate_content(
+    query_value, model_params_value, system_prompt=None, engine=ENGINE_INVOKE_MODEL, cache_point=None
+):
+    """
+    Invokes the model and returns the complete generated text.
+    Deterministic requests are served from the response cache when possible.
+
+    Returns:
+        tuple: (text, cache_status, usage) with cache_status one of HIT, MISS or BYPASS
+        and the prompt-caching token counts in usage
+    """
+    adapter = MODEL_REGISTRY[model_params_value["model_id"]]
+    LOGGER.info(f"MODEL_ID: {adapter.model_id}, ENGINE: {engine}")
+
+    cache_key = None
+    if is_cacheable(model_params_value):
+        cache_key = request_cache_key(adapter, query_value, model_params_value, system_prompt, engine)
+        cached_response = RESPONSE_CACHE.get(cache_key)
+        if cached_response is not None:
+            return cached_response, CACHE_HIT, {}
+
+    response, usage = invoke_engine(
+        adapter, query_value, model_params_value, system_prompt=system_prompt, engine=engine, cache_point=cache_point
+    )
+    if cache_key is None:
+        return response, CACHE_BYPASS, usage
+    RESPONSE_CACHE.put(cache_key, response)
+    return response, CACHE_MISS, usage
+
+
+def generate_batch_item(
+    index, record, model_params_value, system_prompt=None, engine=ENGINE_INVOKE_MODEL, cache_point=None
+):
+    """
+    Generates the content of one customer record. The prompts are rendered by the client: a record
+    carries its "prompt" and, if the instructions are customer-specific, its "system_prompt".
+
+    Returns:
+        dict: per-item result with status SUCCESS or ERROR
+    """
+    result = {"index": index, "user_id": record.get("User.UserId")}
+    try:
+        if not record.get("prompt"):
+            raise ValueError("The record has no prompt")
+        result["output"], result["cache"], result["usage"] = generate_content(
+            record["prompt"],
+            model_params_value,
+            system_prompt=record.get("system_prompt", system_prompt),
+            engine=engine,
+            cache_point=cache_point,
+        )
+        result["status"] = "SUCCESS"
+    except Exception as e:
+        LOGGER.error(f"Content generation failed for item {index}: {e}")
+        result["status"] = "ERROR"
+        result["error"] = str(e)
+    return result
+
+
+def generate_batch(body_data):
+    """
+    Generates the content of all customer records at once, one thread per record.
+
+    Yields:
+        dict: per-item results in order of completion
+    """
+    records = body_data["records"]
+    model_params_value = body_data["model_params"]
+    system_prompt = body_data.get("system_prompt")
+    engine = body_data.get("engine", ENGINE_INVOKE_MODEL)
+    # prompt-caching checkpoint: length of the static prefix the prompts share, found by the client
+    cache_point = body_data.get("cache_point")
+    LOGGER.info(f"Generating batch of {len(records)} items")
+
+    with ThreadPoolExecutor(max_workers=max(1, len(records))) as executor:
+        futures = [
+            executor.submit(
+                generate_batch_item,
+                index,
+                record,
+                model_params_value,
+                system_prompt=system_prompt,
+                engine=engine,
+                cache_point=cache_point,
+            )
+            for index, record in enumerate(records)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
 #########################
 #        HANDLER
 #########################
@@ -85,97 +285,80 @@ def lambda_handler(event, context):
     # Convert the 'body' string to a dictionary
     body_data = json.loads(event["body"])
 
-    # Extract the 'query' value
-    query_value = body_data["query"]
-
-    # Extract the 'model_params' value
-    model_params_value = body_data["model_params"]
-
-    # get fixed model params
-    MODEL_ID = MODELS_MAPPING[model_params_value["model_id"]]
-    LOGGER.info(f"MODEL_ID: {MODEL_ID}")
-
-    if "claude-3" in MODEL_ID:
-        model_config_path = f"model_configs/{MODEL_ID[:-2]}.json"
-    else:
-        model_config_path = f"model_configs/{MODEL_ID}.json"
-    with open(model_config_path) as f:
-        fixed_params = json.load(f)
-
-    # load variable model params
-    amazon_flag = False
-    model_params = {}
-    if MODEL_ID.startswith("amazon"):
-        model_params = {
-            "maxTokenCount": model_params_value["answer_length"],
-            "stopSequences": fixed_params["STOP_WORDS"],
-            "temperature": model_params_value["temperature"],
-            "topP": fixed_params["TOP_P"],
-        }
-        amazon_flag = True
-    elif "claude-3" in MODEL_ID:
-        model_params = {
-            "max_tokens": model_params_value["answer_length"],
-            "temperature": model_params_value["temperature"],
-            "top_p": fixed_params["TOP_P"],
-        }
-        message = {"role": "user",
-                   "content": [
-                       {"type": "text", "text": query_value}
-                   ]
-                   }
-        messages = [message]
-    elif MODEL_ID.startswith("anthropic"):
-        model_params = {
-            "max_tokens_to_sample": model_params_value["answer_length"],
-            "temperature": model_params_value["temperature"],
-            "top_p": fixed_params["TOP_P"],
-            "stop_sequences": fixed_params["STOP_WORDS"],
-        }
-        query_value = f"\n\nHuman:{query_value}\n\nAssistant:"
-
-    LOGGER.info(f"MODEL_PARAMS: {model_params}")
+    engine = body_data.get("engine", ENGINE_INVOKE_MODEL)
+    if engine not in ENGINES:
+        LOGGER.error(f"Invalid engine: {engine}")
+        return {"statusCode": 400, "body": json.dumps(f"Invalid engine, valid engines: {', '.join(ENGINES)}")}
 
     if not verify_bedrock_client():
         LOGGER.info("Bedrock client expired, will refresh token.")
         global BEDROCK_CLIENT, EXPIRATION
+        reset_clients()
         BEDROCK_CLIENT, EXPIRATION = create_bedrock_client()
 
-    accept = "application/json"
-    contentType = "application/json"
+    if body_data.get("type") == "batch_content_generation":
+        if len(body_data.get("records", [])) > MAX_BATCH_RECORDS:
+            return {
+                "statusCode": 400,
+                "body": json.dumps(f"At most {MAX_BATCH_RECORDS} records per batch request"),
+            }
+        # Batch contract: newline-delimited JSON results, one per record in order of completion
+        results = [json.dumps(result) for result in generate_batch(body_data)]
+        LOGGER.info(f"Response cache: {RESPONSE_CACHE.hits} hits, {RESPONSE_CACHE.misses} misses in this container")
+        return {
+            "statusCode": 200,
+            "headers": {"Content-Type": NDJSON_CONTENT_TYPE},
+            "body": "\n".join(results) + "\n",
+        }
 
-    if amazon_flag == True:
-        input_data = json.dumps(
-            {
-                "inputText": query_value,
-                "textGenerationConfig": model_params,
+    if body_data.get("type") == "embeddings":
+        # Embeddings contract: {"embeddings": [[...], ...]} in the order of the texts
+        texts = body_data.get("texts", [])
+        dimensions = body_data.get("dimensions", DEFAULT_EMBEDDING_DIMENSIONS)
+        if not texts or len(texts) > MAX_EMBEDDING_TEXTS or dimensions not in EMBEDDING_DIMENSIONS:
+            return {
+                "statusCode": 400,
+                "body": json.dumps(
+                    f"Between 1 and {MAX_EMBEDDING_TEXTS} texts and dimensions among {list(EMBEDDING_DIMENSIONS)}"
+                ),
             }
-        )
-        print(input_data)
-        response = BEDROCK_CLIENT.invoke_model(
-            body=input_data, modelId=MODEL_ID, accept=accept, contentType=contentType
-        )
-    elif "claude-3" in MODEL_ID:
-        body = json.dumps({
-            "anthropic_version": "bedrock-2023-05-31",
-            "messages": messages,
-            **model_params
-            })
-        response = BEDROCK_CLIENT.invoke_model(body=body, modelId=MODEL_ID)
-    else:
-        body = json.dumps({"prompt": query_value, **model_params})
-        response = BEDROCK_CLIENT.invoke_model(body=body, modelId=MODEL_ID, accept=accept, contentType=contentType)
+        max_concurrency = max(1, min(body_data.get("max_concurrency", DEFAULT_BATCH_CONCURRENCY), MAX_BATCH_CONCURRENCY))
+        LOGGER.info(f"Embedding {len(texts)} texts with {dimensions} dimensions")
+        embeddings = embed_texts(BEDROCK_CLIENT, texts, dimensions=dimensions, max_concurrency=max_concurrency)
+        return {
+            "statusCode": 200,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"embeddings": embeddings}),
+        }
 
-    response_body = json.loads(response.get("body").read())
+    # Extract the 'query' value
+    query_value = body_data["query"]
+
+    # Extract the 'model_params' value
+    model_params_value = body_data["model_params"]
+
+    # Optional system prompt, sent separately from the user prompt by the Converse engine
+    system_prompt = body_data.get("system_prompt")
+
+    # Optional prompt-caching checkpoint: length of the static prefix of the prompt
+    cache_point = body_data.get("cache_point")
+
+    response, cache_status, usage = generate_content(
+        query_value, model_params_value, system_prompt=system_prompt, engine=engine, cache_point=cache_point
+    )
+    LOGGER.info(
+        f"Response cache {cache_status}: {RESPONSE_CACHE.hits} hits, {RESPONSE_CACHE.misses} misses in this container"
+    )
 
-    if "amazon" in MODEL_ID:
-        response = response_body.get("results")[0].get("outputText")
-    elif "claude-3" in MODEL_ID:
-        response = response_body.get("content")[0].get("text")
-    elif "anthropic" in MODEL_ID:
-        response = response_body.get("completion")
-    else:
-        LOGGER.info("Unknown model type!")
-    print("Responese: ", response)
-
-    return json.dumps(response)
+    # The generation is returned whole: the HTTP API buffers the integration response, tokens cannot be streamed
+    # through it
+    return {
+        "statusCode": 200,
+        "headers": {
+            "Content-Type": "application/json",
+            "X-Cache": cache_status,
+            "X-Cache-Read-Input-Tokens": str(usage.get("cache_read_input_tokens", 0)),
+            "X-Cache-Write-Input-Tokens": str(usage.get("cache_write_input_tokens", 0)),
+        },
+        "body": json.dumps(response),
+    }
@@ -0,0 +1,71 @@
+"""
+Invocation engine on top of the Bedrock Converse API
+"""
+
+#########################
+#       CONSTANTS
+#########################
+
+ENGINE_INVOKE_MODEL = "invoke_model"
+ENGINE_CONVERSE = "converse"
+ENGINES = (ENGINE_INVOKE_MODEL, ENGINE_CONVERSE)
+
+
+#########################
+#        HELPER
+#########################
+
+
+def build_converse_request(adapter, prompt, answer_length, temperature, system_prompt=None, cache_point=None):
+    """
+    Builds the arguments of converse for a model adapter.
+    The system prompt is sent separately from the user message, or prepended to it for models
+    without system prompts (e.g. Titan Text). For models with prompt caching, a cache point is
+    placed after the first cache_point characters of the prompt.
+    """
+    if system_prompt and not adapter.supports_system_prompt:
+        prompt = f"{system_prompt}\n\n{prompt}"
+        cache_point = cache_point + len(system_prompt) + 2 if cache_point else None
+        system_prompt = None
+
+    inference_config = {
+        "maxTokens": adapter.max_tokens(answer_length),
+        "temperature": temperature,
+        "topP": adapter.fixed_params["TOP_P"],
+    }
+    if adapter.fixed_params["STOP_WORDS"]:
+        inference_config["stopSequences"] = adapter.fixed_params["STOP_WORDS"]
+
+    request = {
+        "modelId": adapter.model_id,
+        "messages": [{"role": "user", "content": [{"text": prompt}]}],
+        "inferenceConfig": inference_config,
+    }
+    if adapter.supports_prompt_caching and cache_point and 0 < cache_point < len(prompt):
+        request["messages"][0]["content"] = [
+            {"text": prompt[:cache_point]},
+            {"cachePoint": {"type": "default"}},
+            {"text": prompt[cache_point:]},
+        ]
+    if system_prompt:
+        request["system"] = [{"text": system_prompt}]
+    return request
+
+
+def parse_converse_response(response):
+    """
+    Returns the generated text of a converse response.
+    """
+    content = response["output"]["message"]["content"]
+    return "".join(block["text"] for block in content if "text" in block)
+
+
+def parse_converse_usage(usage):
+    """
+    Returns the prompt-caching token counts of converse usage metadata.
+    """
+    return {
+        "cache_read_input_tokens": usage.get("cacheReadInputTokens", 0),
+        "cache_write_input_tokens": usage.get("cacheWriteInputTokens", 0),
+    }
+
@@ -0,0 +1,55 @@
+"""
+Text embeddings with Amazon Titan Text Embeddings on Bedrock
+"""
+
+#########################
+#       LIBRARIES
+#########################
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+#########################
+#       CONSTANTS
+#########################
+
+EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v2:0"
+
+# output sizes supported by Titan Text Embeddings V2
+EMBEDDING_DIMENSIONS = (256, 512, 1024)
+DEFAULT_EMBEDDING_DIMENSIONS = 512
+
+# Titan embeds one text per call, a request embeds at most MAX_EMBEDDING_TEXTS texts
+MAX_EMBEDDING_TEXTS = 100
+
+# Titan V2 accepts at most 50k characters per text
+MAX_EMBEDDING_CHARACTERS = 50000
+
+
+#########################
+#        HELPER
+#########################
+
+
+def embed_text(bedrock_client, text, dimensions=DEFAULT_EMBEDDING_DIMENSIONS):
+    """
+    Returns the normalized embedding of one text
+    """
+    body = json.dumps({"inputText": text[:MAX_EMBEDDING_CHARACTERS], "dimensions": dimensions, "normalize": True})
+    response = bedrock_client.invoke_model(
+        body=body, modelId=EMBEDDING_MODEL_ID, accept="application/json", contentType="application/json"
+    )
+    return json.loads(response.get("body").read())["embedding"]
+
+
+def embed_texts(bedrock_client, texts, dimensions=DEFAULT_EMBEDDING_DIMENSIONS, max_concurrency=4):
+    """
+    Returns the embeddings of texts in input order, computed with bounded concurrency.
+    Identical texts are embedded once.
+    """
+    unique_texts = list(dict.fromkeys(texts))
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(unique_texts) or 1))) as executor:
+        vectors = dict(
+            zip(unique_texts, executor.map(lambda text: embed_text(bedrock_client, text, dimensions), unique_texts))
+        )
+    return [vectors[text] for text in texts]
@@ -0,0 +1,272 @@
+"""
+Model adapters: request building and response parsing per Bedrock model family
+"""
+
+#########################
+#       LIBRARIES
+#########################
+
+import json
+
+ACCEPT = "application/json"
+CONTENT_TYPE = "application/json"
+
+
+#########################
+#      BASE ADAPTER
+#########################
+
+
+class ModelAdapter:
+    """
+    Builds the request of one model family and parses its responses.
+    The part of the body that only depends on the fixed model params is computed once per model.
+    """
+
+    max_tokens_limit = 4096
+    supports_prompt_caching = False
+    # whether the model accepts a separate system prompt in the Converse API
+    supports_system_prompt = True
+
+    def __init__(self, model_id, fixed_params):
+        self.model_id = model_id
+        self.fixed_params = fixed_params
+        self.body_template = self.build_body_template(fixed_params)
+        self.invoke_kwargs = {"accept": ACCEPT, "contentType": CONTENT_TYPE}
+
+    def build_body_template(self, fixed_params):
+        """
+        Returns the request body fields that do not depend on the request.
+        """
+        raise NotImplementedError
+
+    def build_body(self, prompt, answer_length, temperature):
+        """
+        Returns the request body for a prompt and the user parameters.
+        """
+        raise NotImplementedError
+
+    def parse_response(self, response_body):
+        """
+        Returns the generated text of a complete response body.
+        """
+        raise NotImplementedError
+
+    def max_tokens(self, answer_length):
+        return min(int(answer_length), self.max_tokens_limit)
+
+    def add_cache_point(self, body, cache_point):
+        """
+        Marks the first cache_point characters of the prompt as a prompt-caching checkpoint.
+        """
+        raise NotImplementedError
+
+    def parse_usage(self, response_body):
+        """
+        Returns the prompt-caching token counts of a complete response body.
+        """
+        return {}
+
+    def prepare_request(self, prompt, answer_length, temperature, cache_point=None):
+        """
+        Returns the serialized body and the invoke_model arguments.
+        A cache point is only placed for models that support prompt caching.
+        """
+        body = self.build_body(prompt, answer_length, temperature)
+        if self.supports_prompt_caching and cache_point and 0 < cache_point < len(prompt):
+            body = self.add_cache_point(body, cache_point)
+        return json.dumps(body), self.invoke_kwargs
+
+
+#########################
+#        ADAPTERS
+#########################
+
+
+class TitanTextAdapter(ModelAdapter):
+    """
+    Amazon Titan Text (Lite, Express)
+    """
+
+    max_tokens_limit = 8192
+    supports_system_prompt = False
+
+    def build_body_template(self, fixed_params):
+        return {
+            "textGenerationConfig": {
+                "stopSequences": fixed_params["STOP_WORDS"],
+                "topP": fixed_params["TOP_P"],
+            },
+        }
+
+    def build_body(self, prompt, answer_length, temperature):
+        return {
+            "inputText": prompt,
+            "textGenerationConfig": {
+                **self.body_template["textGenerationConfig"],
+                "maxTokenCount": self.max_tokens(answer_length),
+                "temperature": temperature,
+            },
+        }
+
+    def parse_response(self, response_body):
+        return response_body.get("results")[0].get("outputText")
+
+
+class TitanPremierAdapter(TitanTextAdapter):
+    """
+    Amazon Titan Text Premier
+    """
+
+    max_tokens_limit = 3072
+
+
+class ClaudeMessagesAdapter(ModelAdapter):
+    """
+    Anthropic Claude 3 and later (Messages API)
+    """
+
+    def __init__(self, model_id, fixed_params):
+        super().__init__(model_id, fixed_params)
+        self.invoke_kwargs = {}
+        self.supports_prompt_caching = model_id.startswith(PROMPT_CACHING_MODELS)
+
+    def build_body_template(self, fixed_params):
+        return {
+            "anthropic_version": "bedrock-2023-05-31",
+            "top_p": fixed_params["TOP_P"],
+        }
+
+    def build_body(self, prompt, answer_length, temperature):
+        return {
+            **self.body_template,
+            "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+            "max_tokens": self.max_tokens(answer_length),
+            "temperature": temperature,
+        }
+
+    def add_cache_point(self, body, cache_point):
+        text = body["messages"][0]["content"][0]["text"]
+        body["messages"][0]["content"] = [
+            {"type": "text", "text": text[:cache_point], "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": text[cache_point:]},
+        ]
+        return body
+
+    def parse_response(self, response_body):
+        return response_body.get("content")[0].get("text")
+
+    def parse_usage(self, response_body):
+        usage = response_body.get("usage", {})
+        return {
+            "cache_read_input_tokens": usage.get("cache_read_input_tokens", 0),
+            "cache_write_input_tokens": usage.get("cache_creation_input_tokens", 0),
+        }
+
+
+class ClaudeTextAdapter(ModelAdapter):
+    """
+    Anthropic Claude v2 and Claude Instant (Text Completions API)
+    """
+
+    def build_body_template(self, fixed_params):
+        return {
+            "top_p": fixed_params["TOP_P"],
+            "stop_sequences": fixed_params["STOP_WORDS"],
+        }
+
+    def build_body(self, prompt, answer_length, temperature):
+        return {
+            **self.body_template,
+            "prompt": f"\n\nHuman:{prompt}\n\nAssistant:",
+            "max_tokens_to_sample": self.max_tokens(answer_length),
+            "temperature": temperature,
+        }
+
+    def parse_response(self, response_body):
+        return response_body.get("completion")
+
+
+class Llama3Adapter(ModelAdapter):
+    """
+    Meta Llama 3 Instruct
+    """
+
+    max_tokens_limit = 2048
+
+    def build_body_template(self, fixed_params):
+        return {"top_p": fixed_params["TOP_P"]}
+
+    def build_body(self, prompt, answer_length, temperature):
+        return {
+            **self.body_template,
+            "prompt": (
+                "<|begin_of_text|><|start_header_id|>user<|end_header_id|>\n\n"
+                f"{prompt}<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"
+            ),
+            "max_gen_len": self.max_tokens(answer_length),
+            "temperature": temperature,
+        }
+
+    def parse_response(self, response_body):
+        return response_body.get("generation")
+
+
+class MistralAdapter(ModelAdapter):
+    """
+    Mistral AI Instruct models
+    """
+
+    max_tokens_limit = 8192
+    supports_system_prompt = False
+
+    def build_body_template(self, fixed_params):
+        return {
+            "top_p": fixed_params["TOP_P"],
+            "stop": fixed_params["STOP_WORDS"],
+        }
+
+    def build_body(self, prompt, answer_length, temperature):
+        return {
+            **self.body_template,
+            "prompt": f"<s>[INST] {prompt} [/INST]",
+            "max_tokens": self.max_tokens(answer_length),
+            "temperature": temperature,
+        }
+
+    def parse_response(self, response_body):
+        return response_body.get("outputs")[0].get("text")
+
+
+#########################
+#        REGISTRY
+#########################
+
+# Claude models with Bedrock prompt caching
+PROMPT_CACHING_MODELS = (
+    "anthropic.claude-3-5-haiku",
+    "anthropic.claude-3-7-sonnet",
+    "anthropic.claude-sonnet-4",
+    "anthropic.claude-opus-4",
+)
+
+# Model ID prefix -> adapter, the first matching prefix wins
+ADAPTER_FAMILIES = [
+    ("amazon.titan-text-premier", TitanPremierAdapter),
+    ("amazon.titan-text", TitanTextAdapter),
+    ("anthropic.claude-v2", ClaudeTextAdapter),
+    ("anthropic.claude-instant", ClaudeTextAdapter),
+    ("anthropic.claude", ClaudeMessagesAdapter),
+    ("meta.llama3", Llama3Adapter),
+    ("mistral.", MistralAdapter),
+]
+
+
+def create_adapter(model_id, fixed_params):
+    """
+    Creates the adapter of the family the model ID belongs to.
+    """
+    for prefix, adapter_class in ADAPTER_FAMILIES:
+        if model_id.startswith(prefix):
+            return adapter_class(model_id, fixed_params)
+    raise ValueError(f"No model adapter registered for {model_id}")
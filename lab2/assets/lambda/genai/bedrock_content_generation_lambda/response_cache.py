@@ -0,0 +1,166 @@
+"""
+Content-addressed cache of model responses for deterministic generation settings
+"""
+
+#########################
+#   LIBRARIES & LOGGER
+#########################
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from aws_clients import get_client
+
+LOGGER = logging.Logger("Response-cache", level=logging.DEBUG)
+HANDLER = logging.StreamHandler(sys.stdout)
+HANDLER.setFormatter(logging.Formatter("%(levelname)s | %(name)s | %(message)s"))
+LOGGER.addHandler(HANDLER)
+
+CACHE_HIT = "HIT"
+CACHE_MISS = "MISS"
+CACHE_BYPASS = "BYPASS"
+
+
+#########################
+#        HELPER
+#########################
+
+
+def make_cache_key(model_id, fixed_params, prompt, model_params):
+    """
+    Hashes the model ID, its fixed params (model config: TOP_P, STOP_WORDS...), the formatted prompt and
+    the model params into a cache key. Editing a model config invalidates the responses cached with it.
+    """
+    payload = json.dumps(
+        {"model_id": model_id, "fixed_params": fixed_params, "prompt": prompt, "model_params": model_params},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(model_params):
+    """
+    Only deterministic (temperature=0) generations are cached.
+    """
+    return float(model_params.get("temperature", 1.0)) == 0.0
+
+
+#########################
+#       BACKENDS
+#########################
+
+
+class LRUCacheBackend:
+    """
+    In-process LRU cache, shared by the invocations of a warm Lambda container.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DynamoDBCacheBackend:
+    """
+    DynamoDB table cache keyed on 'cache_key', items expire through the 'expires_at' TTL attribute.
+    """
+
+    def __init__(self, table_name, ttl_seconds=86400, client=None):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.client = client or get_client("dynamodb")
+
+    def get(self, key):
+        item = self.client.get_item(TableName=self.table_name, Key={"cache_key": {"S": key}}).get("Item")
+        # TTL deletion is eventual, expired items can still be returned
+        if item is None or int(item["expires_at"]["N"]) < time.time():
+            return None
+        return item["response"]["S"]
+
+    def put(self, key, value):
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                "cache_key": {"S": key},
+                "response": {"S": value},
+                "expires_at": {"N": str(int(time.time()) + self.ttl_seconds)},
+            },
+        )
+
+
+#########################
+#        CACHE
+#########################
+
+
+class ResponseCache:
+    """
+    Read-through cache over an ordered list of backends (fastest first).
+    A hit in a slower backend is written back to the faster ones.
+    """
+
+    def __init__(self, backends):
+        self.backends = backends
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        for position, backend in enumerate(self.backends):
+            try:
+                value = backend.get(key)
+            except Exception as e:
+                LOGGER.error(f"Cache backend {type(backend).__name__} get failed: {e}")
+                continue
+            if value is not None:
+                for faster_backend in self.backends[:position]:
+                    faster_backend.put(key, value)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        if value is None:
+            return
+        for backend in self.backends:
+            try:
+                backend.put(key, value)
+            except Exception as e:
+                LOGGER.error(f"Cache backend {type(backend).__name__} put failed: {e}")
+
+
+def create_response_cache():
+    """
+    Creates the response cache from the environment.
+    RESPONSE_CACHE_SIZE sets the LRU size, RESPONSE_CACHE_TABLE enables the DynamoDB backend
+    and RESPONSE_CACHE_TTL its expiry in seconds.
+    """
+    backends = [LRUCacheBackend(max_entries=int(os.environ.get("RESPONSE_CACHE_SIZE", 256)))]
+    table_name = os.environ.get("RESPONSE_CACHE_TABLE")
+    if table_name:
+        backends.append(
+            DynamoDBCacheBackend(table_name, ttl_seconds=int(os.environ.get("RESPONSE_CACHE_TTL", 86400)))
+        )
+    LOGGER.info(f"Response cache backends: {[type(backend).__name__ for backend in backends]}")
+    return ResponseCache(backends)
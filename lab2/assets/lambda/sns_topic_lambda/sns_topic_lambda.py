@@ -11,7 +11,7 @@ import json
 import logging
 import sys
 
-import boto3
+from aws_clients import get_client
 
 LOGGER = logging.Logger("SNS TOPIC LAMBDA", level=logging.DEBUG)
 HANDLER = logging.StreamHandler(sys.stdout)
@@ -27,7 +27,7 @@ LOGGER.addHandler(HANDLER)
 def lambda_handler(event, context):
     topic_arn = os.environ["SNS_TOPIC_ARN"]
     body = json.loads(event["body"])
-    client = boto3.client("sns")
+    client = get_client("sns")
     if body["type"] == "PUBLISH":
         LOGGER.info(f"Publishing to topic: {topic_arn}")
         client.publish(TopicArn=topic_arn, Message=body["message"], Subject=body["subject"])
@@ -0,0 +1,70 @@
+"""
+Shared factory of boto3 clients, reused across the invocations of a warm Lambda container
+"""
+
+#########################
+#   LIBRARIES & LOGGER
+#########################
+
+import logging
+import os
+import sys
+import threading
+
+import boto3
+from botocore.config import Config
+
+LOGGER = logging.Logger("AWS-clients", level=logging.DEBUG)
+HANDLER = logging.StreamHandler(sys.stdout)
+HANDLER.setFormatter(logging.Formatter("%(levelname)s | %(name)s | %(message)s"))
+LOGGER.addHandler(HANDLER)
+
+# Defaults of every client: a connection pool large enough for the threaded batch paths,
+# adaptive retries on throttling and TCP keep-alive on idle pooled connections
+DEFAULT_CONFIG = Config(
+    max_pool_connections=int(os.environ.get("AWS_CLIENT_POOL_SIZE", 32)),
+    retries={"mode": "adaptive", "max_attempts": int(os.environ.get("AWS_CLIENT_MAX_ATTEMPTS", 5))},
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=30,
+)
+
+# boto3.client() on the default session is not thread-safe, clients are created from one session under a lock
+_SESSION = boto3.session.Session()
+_CLIENTS = {}
+_LOCK = threading.Lock()
+
+
+#########################
+#        FACTORY
+#########################
+
+
+def get_client(service_name, region_name=None, config=None):
+    """
+    Returns the client of a service, created on first use and cached at module scope.
+
+    Args:
+        service_name (str): boto3 service name, e.g. "dynamodb"
+        region_name (str): region of the client, the Lambda region if None
+        config (Config): overrides merged on top of DEFAULT_CONFIG, clients are cached per config object
+    """
+    key = (service_name, region_name, id(config) if config is not None else None)
+    client = _CLIENTS.get(key)
+    if client is None:
+        with _LOCK:
+            client = _CLIENTS.get(key)
+            if client is None:
+                client_config = DEFAULT_CONFIG.merge(config) if config is not None else DEFAULT_CONFIG
+                client = _SESSION.client(service_name, region_name=region_name, config=client_config)
+                _CLIENTS[key] = client
+                LOGGER.info(f"Created {service_name} client")
+    return client
+
+
+def reset_clients():
+    """
+    Drops the cached clients, e.g. after the credentials they were created with expired
+    """
+    with _LOCK:
+        _CLIENTS.clear()
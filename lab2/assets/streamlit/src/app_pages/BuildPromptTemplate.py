@@ -10,7 +10,6 @@ import os
 import sys
 from pathlib import Path
 import boto3
-import re
 
 from datetime import datetime
 
@@ -25,6 +24,9 @@ sys.path.append(str(path.parent.parent.parent.absolute()))
 
 import components.authenticate as authenticate  # noqa: E402
 import components.genai_api as genai_api  # noqa: E402
+import components.catalog_cache as catalog_cache  # noqa: E402
+import components.similarity as similarity  # noqa: E402
+from components.prompt_template import compile_template  # noqa: E402
 from components.utils import (
     display_cover_with_title,
     reset_session_state,
@@ -114,6 +116,7 @@ st.session_state.setdefault("ai_model", MODELS_DISPLAYED[0])  # default model
 LOGGER.log(logging.DEBUG, (f"ai_model selected: {st.session_state['ai_model']}"))
 
 st.session_state.setdefault("query", "")
+st.session_state.setdefault("pending_duplicates", None)  # near-duplicates found on save
 
 
 #########################
@@ -135,32 +138,15 @@ def format_prompt(prompt: str) -> str:
     Replaces input parameter in prompt string with actual user values and product information.
     """
     LOGGER.debug("INSIDE format_prompt()")
-    # Remove dots inside curly braces but keep dots outside.
-    prompt_cleaned = re.sub(r"\{(.*?)\}", lambda x: x.group(0).replace(".", ""), prompt)
-    LOGGER.debug(f"PROMPT TEMPLATE: {prompt_cleaned}")
-    # Convert DataFrame to Series to Dictionary
-    user_attributes_dict = st.session_state["df_selected"].squeeze().to_dict()
-    # Remove dots inside dictionary keys
-    user_attributes_cleaned = {
-        key.replace(".", ""): value for key, value in user_attributes_dict.items()
-    }
-    product_info_cleaned = {
-        key.replace("Name", "Product"): value
-        for key, value in st.session_state["product_info"].items()
-    }
-    product_info_cleaned = {
-        key.replace("Title", "Campaign Phrase"): value
-        for key, value in product_info_cleaned.items()
-    }
-
     prompt_formatted = ""
     try:
-        prompt_formatted = prompt_cleaned.format(
-            **user_attributes_cleaned, **product_info_cleaned
+        prompt_formatted = compile_template(prompt).render(
+            st.session_state["df_selected"].squeeze(), st.session_state["product_info"]
         )
-    except KeyError as e:
-        LOGGER.error(f"Invalid input parameter in prompt: {e}")
-        st.error(f"Invalid input parameter in prompt: {e}")
+    except ValueError as e:
+        # all the invalid placeholders are reported at once
+        LOGGER.error(f"Invalid prompt template: {e}")
+        st.error(str(e))
     LOGGER.debug(f"PROMPT FORMATTED: {prompt_formatted}")
     return prompt_formatted
 
@@ -185,10 +171,10 @@ def run_genai_prompt(ai_model, prompt, answer_length=4096, temperature=0) -> str
 
 def put_prompt(item) -> None:
     """
-    Runs API call to retrieve LLM answer and references
+    Runs API call to save the prompt template to the catalog
     """
     with st.spinner("Saving prompt template..."):
-        success = genai_api.invoke_dynamo_put(
+        success = catalog_cache.put_prompt(
             item=item,
             access_token=st.session_state["access_token"],
         )
@@ -196,6 +182,69 @@ def put_prompt(item) -> None:
     return success
 
 
+def find_near_duplicates(prompt_template: str) -> list:
+    """
+    Returns the saved templates of the user that are near-duplicates of a prompt template.
+    The check never blocks saving: if it fails, no duplicates are reported.
+    """
+    try:
+        with st.spinner("Checking the catalog for similar templates..."):
+            return similarity.find_near_duplicates(
+                user_id=st.session_state["user_id"],
+                session_id=st.session_state["session_id"],
+                template=prompt_template,
+                access_token=st.session_state["access_token"],
+            )
+    except Exception as e:
+        LOGGER.error(f"Near-duplicate check failed: {e}")
+        return []
+
+
+def save_prompt_template(
+    prompt_template: str, ai_model: str, answer_length: int, temperature: float
+) -> None:
+    """
+    Saves the prompt template with its output to the catalog
+    """
+    user_id = st.session_state["user_id"]
+
+    session_id, timestamp = generate_session_id(user_id=user_id)
+    session_id = st.session_state["session_id"]
+    if st.session_state["ai_model"] != "Bedrock: LLama2":
+        model_output = st.session_state["model_output"]
+    else:
+        model_output = prompt_template
+    item = {
+        "session_id": session_id,
+        "user_id": user_id,
+        "timestamp": str(timestamp),
+        "model": ai_model,
+        "answer_length": str(answer_length),
+        "temperature": str(temperature),
+        # "Language": language,     #TODO - AFTER REINVENT - UNCOMMENT
+        # "Industry": industry,
+        # "Task": task,
+        # "Technique": technique,
+        "Prompt Template": prompt_template,
+        "Prompt": format_prompt(prompt_template),
+        "Output": model_output,
+    }
+
+    success = put_prompt(item=item)
+    print(success)
+
+    if success:
+        similarity.add_saved_template(
+            user_id=user_id,
+            session_id=session_id,
+            template=prompt_template,
+            access_token=st.session_state["access_token"],
+        )
+        st.success("Prompt saved to the catalog successfully.")
+    else:
+        st.error("Failed to save prompt.")
+
+
 #########################
 #        SIDEBAR
 #########################
@@ -312,37 +361,29 @@ else:
                 help="Save this prompt template to the catalog",
             )
         if save_button:
-            user_id = st.session_state["user_id"]
-
-            session_id, timestamp = generate_session_id(user_id=user_id)
-            session_id = st.session_state["session_id"]
-            if st.session_state["ai_model"] != "Bedrock: LLama2":
-                model_output = st.session_state["model_output"]
-            else:
-                model_output = prompt_area
-            item = {
-                "session_id": session_id,
-                "user_id": user_id,
-                "timestamp": str(timestamp),
-                "model": ai_model,
-                "answer_length": str(answer_length),
-                "temperature": str(temperature),
-                # "Language": language,     #TODO - AFTER REINVENT - UNCOMMENT
-                # "Industry": industry,
-                # "Task": task,
-                # "Technique": technique,
-                "Prompt Template": prompt_area,
-                "Prompt": format_prompt(prompt_area),
-                "Output": model_output,
-            }
-
-            success = put_prompt(item=item)
-            print(success)
-
-            if success:
-                st.success("Prompt saved to the catalog successfully.")
+            duplicates = find_near_duplicates(prompt_area)
+            if duplicates:
+                # ask for confirmation before writing a near-duplicate
+                st.session_state["pending_duplicates"] = {
+                    "template": prompt_area,
+                    "matches": duplicates,
+                }
             else:
-                st.error("Failed to save prompt.")
+                st.session_state["pending_duplicates"] = None
+                save_prompt_template(prompt_area, ai_model, answer_length, temperature)
+
+        pending = st.session_state["pending_duplicates"]
+        if pending is not None and pending["template"] == prompt_area:
+            st.warning(
+                "Your catalog already contains very similar templates: "
+                + ", ".join(
+                    f"{match['session_id']} ({match['similarity']:.0%})"
+                    for match in pending["matches"]
+                )
+            )
+            if st.button("Save anyway", key="save_duplicate"):
+                st.session_state["pending_duplicates"] = None
+                save_prompt_template(prompt_area, ai_model, answer_length, temperature)
 
     st.markdown(
         "If you like the output, save the prompt to the catalog which is ready to be applied for more customers in further steps."
@@ -15,12 +15,6 @@ import sys
 import re
 from pathlib import Path
 import pandas as pd
-from pandas.api.types import (
-    is_categorical_dtype,
-    is_datetime64_any_dtype,
-    is_numeric_dtype,
-    is_object_dtype,
-)
 from datetime import datetime
 
 
@@ -33,6 +27,8 @@ sys.path.append(str(path.parent.parent.absolute()))
 
 import components.authenticate as authenticate  # noqa: E402
 import components.genai_api as genai_api  # noqa: E402
+from components.customer_data import load_customers  # noqa: E402
+from components.filter_engine import filter_dataframe  # noqa: E402
 from components.utils import (
     display_cover_with_title,
     reset_session_state,
@@ -132,7 +128,7 @@ def load_data_from_source_systems():
     """
     st.toast("Loading...")
     if "df" not in st.session_state or st.session_state["df"].shape[0] == 0:
-        df = pd.read_csv(f"{path.parent.absolute()}/data/df_segment_data.csv")
+        df = load_customers("df_segment_data")
         st.session_state["df"] = df
         st.session_state["df_name"] = "df_segment_data"
     else:
@@ -148,72 +144,6 @@ def extract_session_id_string(s):
         return None
 
 
-def filter_dataframe(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    Adds a UI on top of a dataframe to let viewers filter columns
-    Args: df (pd.DataFrame): Original dataframe
-    Returns: pd.DataFrame: Filtered dataframe
-    """
-    modify = st.checkbox("Add filters")
-    if not modify:
-        return df
-    st.toast("Adding filters...")
-    df = df.copy()
-    # Try to convert datetimes into a standard format (datetime, no timezone)
-    for col in df.columns:
-        if is_object_dtype(df[col]):
-            try:
-                df[col] = pd.to_datetime(df[col])
-            except Exception as e:
-                logger.exception(f"Error converting column {col} to datetime: {e}")
-        if is_datetime64_any_dtype(df[col]):
-            df[col] = df[col].dt.tz_localize(None)
-    modification_container = st.container()
-    with modification_container:
-        to_filter_columns = st.multiselect("Filter dataframe on", df.columns)
-        for column in to_filter_columns:
-            left, right = st.columns((1, 20))
-            # Treat columns with < 10 unique values as categorical
-            if is_categorical_dtype(df[column]) or df[column].nunique() < 10:
-                user_cat_input = right.multiselect(
-                    f"Values for {column}",
-                    df[column].unique(),
-                    default=list(df[column].unique()),
-                )
-                df = df[df[column].isin(user_cat_input)]
-            elif is_numeric_dtype(df[column]):
-                _min = float(df[column].min())
-                _max = float(df[column].max())
-                step = (_max - _min) / 100
-                user_num_input = right.slider(
-                    f"Values for {column}",
-                    min_value=_min,
-                    max_value=_max,
-                    value=(_min, _max),
-                    step=step,
-                )
-                df = df[df[column].between(*user_num_input)]
-            elif is_datetime64_any_dtype(df[column]):
-                user_date_input = right.date_input(
-                    f"Values for {column}",
-                    value=(
-                        df[column].min(),
-                        df[column].max(),
-                    ),
-                )
-                if len(user_date_input) == 2:
-                    user_date_input = tuple(map(pd.to_datetime, user_date_input))
-                    start_date, end_date = user_date_input
-                    df = df.loc[df[column].between(start_date, end_date)]
-            else:
-                user_text_input = right.text_input(
-                    f"Substring or regex in {column}",
-                )
-                if user_text_input:
-                    df = df[df[column].astype(str).str.contains(user_text_input)]
-    return df
-
-
 def dataframe_with_selections(df):
     df_with_selections = df.copy()
     df_with_selections.insert(0, "Select", False)
@@ -249,6 +179,7 @@ else:
     # instruction
     st.markdown("Select a user for Build Prompt Template experimentation.")
 
+    df = filter_dataframe(df, st.session_state.get("df_name"))
     selection = dataframe_with_selections(df)
     print(f"Selected user - {selection}")
     if not hasattr(st.session_state, "delete_prompt_clicked"):
@@ -1,9 +1,9 @@
 import streamlit as st
-import pandas as pd
 import os
 import sys
 import re
 import json
+from itertools import chain
 from pathlib import Path
 from st_pages import show_pages_from_config
 from components.utils import (
@@ -16,13 +16,16 @@ from components.utils import (
 import components.authenticate as authenticate  # noqa: E402
 import components.genai_api as genai_api  # noqa: E402
 import components.sns_api as sns_api
+from components.prefetch import DraftPrefetcher, make_prefetch_key
+from components.customer_data import get_customer_data, load_customers
+from components.prompt_template import compile_template, render_segment
 
 import logging
 from streamlit_extras.switch_page_button import switch_page
 
 # import s3fs
 
-from components.utils_models import BEDROCK_MODELS
+from components.utils_models import BEDROCK_MODELS, SYSTEM_PROMPT_MODELS
 
 
 LOGGER = logging.Logger("AI-Chat", level=logging.DEBUG)
@@ -98,6 +101,9 @@ MODELS_NOT_DEPLOYED = []  # Remove models from this list after deploying the mod
 
 BUCKET_NAME = os.environ.get("BUCKET_NAME")
 
+# number of customers after the current one whose drafts are generated in the background
+PREFETCH_DEPTH = 2
+
 #########################
 # SESSION STATE VARIABLES
 #########################
@@ -111,6 +117,11 @@ st.session_state.setdefault(
     "prompt_formatted", {}
 )  # formatted prompt for each customer
 st.session_state.setdefault("model_output", {})  # model output for each customer
+# opt-in: each prefetched draft is a model call, also for customers never viewed
+st.session_state.setdefault("prefetch_enabled", False)
+if "prefetcher" not in st.session_state:
+    # kept across reruns so that in-flight drafts survive navigation
+    st.session_state["prefetcher"] = DraftPrefetcher(max_workers=PREFETCH_DEPTH)
 
 if "df_selected_prompt" in st.session_state:
     st.session_state["ai_model"] = st.session_state["df_selected_prompt"].model.iloc[0]
@@ -186,42 +197,88 @@ box_style = {
 def format_prompt_template(prompt_template, product_info, customer_details) -> str:
     """
     Replaces input parameter in prompt string with actual user values and product information.
+    The template is parsed once and reused for every customer; invalid templates are reported
+    for the whole segment by validate_prompt_template, they render to an empty prompt here.
     """
-    LOGGER.debug("INSIDE format_prompt()")
-    # Remove dots inside curly braces but keep dots outside.
-    prompt_cleaned = re.sub(
-        r"\{(.*?)\}", lambda x: x.group(0).replace(".", ""), prompt_template
-    )
-    LOGGER.debug(f"PROMPT TEMPLATE: {prompt_cleaned}")
-    # Convert DataFrame to Series to Dictionary
-    user_attributes_dict = customer_details.squeeze().to_dict()
-    # Remove dots inside dictionary keys
-    user_attributes_cleaned = {
-        key.replace(".", ""): value for key, value in user_attributes_dict.items()
-    }
-    # LOGGER.debug(f"USER ATTRIBUTES: {user_attributes_cleaned}")
-    # LOGGER.debug(f"PRODUCT INFO: {st.session_state['product_info']}")
-    # Fix product info keys as displayed
-    product_info_cleaned = {
-        key.replace("Name", "Product"): value for key, value in product_info.items()
-    }
-    product_info_cleaned = {
-        key.replace("Title", "Campaign Phrase"): value
-        for key, value in product_info_cleaned.items()
-    }
-
     prompt_formatted = ""
     try:
-        prompt_formatted = prompt_cleaned.format(
-            **user_attributes_cleaned, **product_info_cleaned
+        prompt_formatted = compile_template(prompt_template).render(
+            customer_details, product_info
         )
-    except KeyError as e:
-        LOGGER.error(f"Invalid input parameter in prompt: {e}")
-        st.error(f"Invalid input parameter in prompt: {e}")
+    except ValueError as e:
+        LOGGER.error(f"Invalid prompt template: {e}")
     LOGGER.debug(f"PROMPT FORMATTED: {prompt_formatted}")
     return prompt_formatted
 
 
+def validate_prompt_template(prompt_template: str, df) -> str:
+    """
+    Checks the placeholders of the prompt template against the columns of the segment
+    and the fields of all its products. Returns the error message, None if the template is valid.
+    """
+    product_fields = None
+    for product_id in df["User.UserAttributes.Product"].unique():
+        fields = set(get_product_info(product_id) or {})
+        product_fields = fields if product_fields is None else product_fields & fields
+    try:
+        compile_template(prompt_template).bind(df.columns, product_fields or ())
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def split_system_prompt(prompt: str, ai_model: str):
+    """
+    Splits the <INST>...</INST> instructions of a prompt off the user prompt, so that
+    they can be sent as a system prompt through the Converse API.
+    Returns (None, prompt) if the model has no system prompts (e.g. Titan), if there are
+    no instructions or if nothing is left for the user prompt.
+    """
+    if ai_model not in SYSTEM_PROMPT_MODELS:
+        return None, prompt
+    match = re.search(r"<INST>(.*?)</INST>", prompt, flags=re.DOTALL)
+    if not match:
+        return None, prompt
+    user_prompt = (prompt[: match.start()] + prompt[match.end() :]).strip()
+    if not user_prompt:
+        return None, prompt
+    return match.group(1).strip(), user_prompt
+
+
+def find_cache_point(prompt_template: str) -> int:
+    """
+    Returns the length of the static part of the prompt template, i.e. the position
+    of its first {placeholder}. All formatted prompts of the segment share this prefix,
+    so it is sent as prompt-caching checkpoint.
+    """
+    try:
+        return compile_template(prompt_template).static_prefix_length
+    except ValueError:
+        return len(prompt_template)
+
+
+def build_generation_request(prompt_formatted: str) -> dict:
+    """
+    Returns the genai_api arguments to generate the content of a formatted prompt
+    with the current model settings.
+    """
+    ai_model = st.session_state["ai_model"]
+    system_prompt, user_prompt = split_system_prompt(prompt_formatted, ai_model)
+    _, user_prompt_template = split_system_prompt(
+        st.session_state["prompt_template"], ai_model
+    )
+    return {
+        "prompt": user_prompt,
+        "model_id": ai_model,
+        "access_token": st.session_state["access_token"],
+        "answer_length": st.session_state["answer_length"],
+        "temperature": st.session_state["temperature"],
+        "system_prompt": system_prompt,
+        "engine": "converse" if system_prompt else "invoke_model",
+        "cache_point": find_cache_point(user_prompt_template),
+    }
+
+
 def generate_marketing_email() -> str:
     """
     Runs API call to retrieve LLM answer and references
@@ -238,86 +295,140 @@ def generate_marketing_email() -> str:
                 st.session_state["customer_details"],
             )
         content = ""
-        if st.session_state["prompt_formatted"].get(
-            st.session_state["customer_counter"]
-        ):
-            content = genai_api.invoke_content_creation(
-                prompt=st.session_state["prompt_formatted"][
-                    st.session_state["customer_counter"]
-                ],
-                model_id=st.session_state["ai_model"],
-                access_token=st.session_state["access_token"],
-                answer_length=st.session_state["answer_length"],
-                temperature=st.session_state["temperature"],
+        request = build_generation_request(
+            st.session_state["prompt_formatted"].get(
+                st.session_state["customer_counter"], ""
             )
+        )
+        if request["prompt"]:
+            content = genai_api.invoke_content_creation(**request)
         st.session_state["model_output"][st.session_state["customer_counter"]] = content
         return content
 
 
-# Convert attributes that are lists based on their content
-def convert_value(val):
-    if isinstance(val, list) and val:  # Check if it's a non-empty list
-        item = val[0]
-        try:
-            # Convert to int if possible
-            return int(item)
-        except ValueError:
-            pass  # Continue to the next check
-
-        try:
-            # Convert to float if possible
-            return float(item)
-        except ValueError:
-            pass  # Continue to the next check
-
-        # If none of the above, return as string
-        return str(item)
-
-    elif isinstance(val, list) and not val:  # Handle empty lists
-        return None
-
-    return val
+def prefetch_next_drafts(df) -> None:
+    """
+    Collects the drafts generated in the background and queues the next customers.
+    Drafts are dropped when the template, the model settings or the segment change,
+    including those already shown.
+    """
+    prefetcher = st.session_state["prefetcher"]
+    stale_drafts = prefetcher.reset(
+        make_prefetch_key(
+            prompt_template=st.session_state["prompt_template"],
+            ai_model=st.session_state["ai_model"],
+            answer_length=st.session_state["answer_length"],
+            temperature=st.session_state["temperature"],
+            df_name=st.session_state["df_name"],
+        )
+    )
+    for index, draft in stale_drafts.items():
+        # unless the message was generated again since
+        if st.session_state["model_output"].get(index) == draft:
+            del st.session_state["model_output"][index]
+    st.session_state["model_output"].update(prefetcher.collect())
+    if not st.session_state["prefetch_enabled"]:
+        return
+
+    start = st.session_state["customer_counter"] + 1
+    for index in range(start, min(len(df), start + PREFETCH_DEPTH)):
+        if index in st.session_state["model_output"] or prefetcher.is_pending(index):
+            continue
+        customer = df.iloc[index]
+        prompt_formatted = format_prompt_template(
+            st.session_state["prompt_template"],
+            get_product_info(customer["User.UserAttributes.Product"]),
+            customer,
+        )
+        request = build_generation_request(prompt_formatted)
+        if not request["prompt"]:
+            continue
+        st.session_state["prompt_formatted"][index] = prompt_formatted
+        # bind the request now, the worker thread cannot read st.session_state
+        prefetcher.submit(
+            index, lambda request=request: genai_api.invoke_content_creation(**request)
+        )
 
 
-def process_df(df):
+def iter_segment_records(df, products: dict, prompt_template: str, system_prompt: str):
     """
-    Process the received df
+    Yields the batch records of the segment with their rendered prompts. The segment is
+    rendered chunk by chunk, so only the prompts of one chunk are held in memory.
     """
-
-    # Convert attributes that are lists to strings
-    df = df.applymap(convert_value)
-    # Group the user attributes, attributes and metrics columns
-    user_attribute_columns = [
-        col for col in df.columns if col.startswith("User.UserAttributes.")
-    ]
-    attribute_columns = [col for col in df.columns if col.startswith("Attributes.")]
-    metric_columns = [col for col in df.columns if col.startswith("Metrics.")]
-    other_columns = [
-        col
-        for col in df.columns
-        if col not in user_attribute_columns + attribute_columns + metric_columns
-    ]
-    # Start with an empty list for the ordered columns
-    ordered_columns = []
-
-    # Check if 'FirstName' and 'LastName' columns are present and add them first
-    if "User.UserAttributes.FirstName" in df.columns:
-        ordered_columns.append("User.UserAttributes.FirstName")
-        user_attribute_columns.remove("User.UserAttributes.FirstName")
-
-    if "User.UserAttributes.LastName" in df.columns:
-        ordered_columns.append("User.UserAttributes.LastName")
-        user_attribute_columns.remove("User.UserAttributes.LastName")
-
-    # Concatenate the lists in the desired order
-    ordered_columns += (
-        user_attribute_columns + attribute_columns + metric_columns + other_columns
+    user_ids = df["User.UserId"].tolist()
+    prompt_chunks = render_segment(prompt_template, df, products)
+    system_prompt_chunks = (
+        render_segment(system_prompt, df, products) if system_prompt else None
     )
+    position = 0
+    for prompts in prompt_chunks:
+        system_prompts = next(system_prompt_chunks) if system_prompt else None
+        for offset, prompt in enumerate(prompts.tolist()):
+            record = {"User.UserId": user_ids[position + offset], "prompt": prompt}
+            if system_prompts is not None:
+                record["system_prompt"] = system_prompts.iloc[offset]
+            yield record
+        position += len(prompts)
+
+
+def generate_segment_messages(df) -> None:
+    """
+    Generates the messages of all customers in the segment with the batch API, several
+    slices of the segment in flight at once.
+    The prompts are rendered here in one vectorized pass, the job only receives the prompts.
+    """
+    products = {}
+    for product_id in df["User.UserAttributes.Product"].unique():
+        product_info = get_product_info(product_id)
+        if product_info:
+            products[str(product_id)] = product_info
+    # the instructions are shared by the whole segment, send them as system prompt
+    system_prompt, prompt_template = split_system_prompt(
+        st.session_state["prompt_template"], st.session_state["ai_model"]
+    )
+    try:
+        records = iter_segment_records(df, products, prompt_template, system_prompt)
+        # render the first chunk now, so that template errors are reported before the job starts
+        records = chain([next(records)], records) if len(df) else records
+    except ValueError as e:
+        st.error(str(e))
+        return
+
+    done, failed = 0, 0
+    progress_bar = st.progress(0.0, text="Generating content for the segment...")
+    for results in genai_api.invoke_batch_content_creation(
+        records=records,
+        model_id=st.session_state["ai_model"],
+        access_token=st.session_state["access_token"],
+        answer_length=st.session_state["answer_length"],
+        temperature=st.session_state["temperature"],
+        engine="converse" if system_prompt else "invoke_model",
+        cache_point=find_cache_point(prompt_template),
+    ):
+        for result in results:
+            if result["status"] == "SUCCESS":
+                st.session_state["model_output"][result["index"]] = result["output"]
+            else:
+                failed += 1
+                LOGGER.error(
+                    f"Generation failed for customer {result['index']}: {result['error']}"
+                )
+        # one progress update per slice of the segment
+        done += len(results)
+        progress_bar.progress(
+            done / len(df), text=f"Generated {done}/{len(df)} messages"
+        )
+    progress_bar.empty()
+    if failed:
+        st.warning(f"{failed} of {len(df)} messages could not be generated.")
 
-    # Reorder the DataFrame columns
-    df = df[ordered_columns]
 
-    return df, user_attribute_columns, attribute_columns, metric_columns, other_columns
+def process_df(df):
+    """
+    Process the received df: typed columns and column groups, computed once per dataset
+    and reused on every rerun
+    """
+    return get_customer_data(df, st.session_state["df_name"]).as_tuple()
 
 
 def send_message_sns() -> None:
@@ -403,7 +514,7 @@ def set_button_clicked():
 ########################################################################################################################################################################
 
 if df is None:
-    df = pd.read_csv(f"{path.parent.absolute()}/data/df_segment_data.csv")
+    df = load_customers("df_segment_data")
     st.session_state["df_name"] = "df_segment_data"
     st.session_state["df"] = df
 
@@ -420,6 +531,12 @@ else:
         st.markdown(f"Max answer length: {st.session_state.get('answer_length','')}")
         st.markdown(f"Temperature: {st.session_state.get('temperature', '')}")
 
+        st.checkbox(
+            "Prefetch next customers",
+            key="prefetch_enabled",
+            help=f"Generate the drafts of the next {PREFETCH_DEPTH} customers in the background",
+        )
+
         if st.session_state["ai_model"] in MODELS_UNAVAILABLE:
             st.error(f'{st.session_state["ai_model"]} not available', icon="⚠️")
             st.stop()
@@ -496,6 +613,10 @@ else:
         if st.button("Go to Prompt Catalog"):
             switch_page("Prompt Catalog")
     else:
+        # report all invalid placeholders of the template once for the whole segment
+        template_error = validate_prompt_template(st.session_state["prompt_template"], df)
+        if template_error:
+            st.error(template_error)
         # Format the prompt template
         st.session_state["prompt_formatted"][
             st.session_state["customer_counter"]
@@ -503,9 +624,30 @@ else:
             st.session_state["prompt_template"], product_info, customer_details
         )
 
-        run_button = st.button(
-            f"Generate {channel}", type="primary", on_click=generate_marketing_email
-        )
+        button_col, segment_button_col = st.columns([1, 1])
+        with button_col:
+            run_button = st.button(f"Generate {channel}", type="primary")
+        with segment_button_col:
+            segment_button = st.button(
+                "Generate for all customers",
+                help="Generate the messages of the whole segment in one batch job",
+            )
+        prefetcher = st.session_state["prefetcher"]
+        if run_button and prefetcher.is_pending(st.session_state["customer_counter"]):
+            # the draft is already being generated in the background, wait for it
+            with st.spinner("Generating content..."):
+                content = prefetcher.wait(st.session_state["customer_counter"])
+            if content:
+                st.session_state["model_output"][
+                    st.session_state["customer_counter"]
+                ] = content
+            else:
+                generate_marketing_email()
+        elif run_button:
+            generate_marketing_email()
+        if segment_button and not template_error:
+            generate_segment_messages(df)
+        prefetch_next_drafts(df)
 
         # Show the generated text in a text box
         if st.session_state["model_output"].get(st.session_state["customer_counter"]):
@@ -12,12 +12,6 @@ import sys
 import re
 from pathlib import Path
 import pandas as pd
-from pandas.api.types import (
-    is_categorical_dtype,
-    is_datetime64_any_dtype,
-    is_numeric_dtype,
-    is_object_dtype,
-)
 
 import streamlit as st
 from st_pages import show_pages_from_config
@@ -28,6 +22,8 @@ sys.path.append(str(path.parent.parent.absolute()))
 
 import components.authenticate as authenticate  # noqa: E402
 import components.genai_api as genai_api  # noqa: E402
+import components.catalog_cache as catalog_cache  # noqa: E402
+import components.similarity as similarity  # noqa: E402
 from components.utils import (
     display_cover_with_title,
     reset_session_state,
@@ -106,6 +102,15 @@ if not st.session_state["authenticated"]:
 # page name for caching
 PAGE_NAME = "PromptCatalog"
 
+# number of prompts loaded per request
+PAGE_SIZE = 25
+
+# number of prompts returned by a full-text search
+SEARCH_LIMIT = 50
+
+# attributes that are not part of the catalog listing, retrieved for the selected prompt only
+DETAIL_FIELDS = ["Prompt Template", "Prompt", "Output"]
+
 #########################
 # SESSION STATE VARIABLES
 #########################
@@ -122,6 +127,11 @@ LOGGER.debug("ai_model selected: %s", st.session_state["ai_model"])
 st.session_state.setdefault("query", "")
 st.session_state.setdefault("user_id", "AWS-User")
 st.session_state.setdefault("prompt_df", pd.DataFrame())
+st.session_state.setdefault("prompt_next_token", None)  # token of the next catalog page
+st.session_state.setdefault("prompt_df_filter", None)  # model filter of the loaded pages
+st.session_state.setdefault("prompt_details", {})  # prompt texts by session_id
+st.session_state.setdefault("prompt_search", "")  # full-text query of the catalog
+st.session_state.setdefault("similar_prompts", {})  # similar templates by session_id
 
 #########################
 #    HELPER FUNCTIONS
@@ -137,114 +147,119 @@ def extract_session_id_string(s):
         return None
 
 
-def get_all_user_prompts() -> None:
+def get_user_prompts_page(reset: bool = False) -> None:
     """
-    Runs API call to retrieve LLM answer and references
+    Retrieves the next page of the user prompts, from the catalog cache unless
+    the catalog changed. With reset, the loaded pages are dropped and the first page is retrieved.
     """
     user_id = st.session_state["user_id"]
 
     ai_model_session = st.session_state.get("ai_model", "ALL")
 
-    LOGGER.info("Retrieving all prompts for user: %s", user_id)
+    if reset:
+        st.session_state["prompt_df"] = pd.DataFrame()
+        st.session_state["prompt_next_token"] = None
+        st.session_state["prompt_df_filter"] = ai_model_session
+
+    LOGGER.info("Retrieving prompts page for user: %s", user_id)
 
     with st.spinner("Retrieving prompts..."):
-        response = genai_api.invoke_dynamo_get(
-            params={
-                "user_id": user_id,
-                "ai_model_filter": ai_model_session,
-            },
+        page = catalog_cache.get_catalog_page(
+            user_id=user_id,
+            ai_model_filter=ai_model_session,
             access_token=st.session_state["access_token"],
+            page_size=PAGE_SIZE,
+            next_token=st.session_state["prompt_next_token"],
         )
 
-    prompt_dataframe = pd.DataFrame(response.json())
-    st.session_state["prompt_df"] = prompt_dataframe
+    st.session_state["prompt_df"] = pd.concat(
+        [st.session_state["prompt_df"], pd.DataFrame(page["items"])],
+        ignore_index=True,
+    )
+    st.session_state["prompt_next_token"] = page["next_token"]
 
 
-def delete_prompt(prompt_id: str) -> None:
+def search_user_prompts(query: str) -> pd.DataFrame:
     """
-    Runs API call to retrieve LLM answer and references
+    Runs API call to retrieve the prompts best matching a full-text query
     """
-    LOGGER.debug("Deleting prompt: ####%s#####", prompt_id)
-    with st.spinner("Generating content..."):
-        response = genai_api.invoke_dynamo_delete(
-            params={"session_id": prompt_id},
+    with st.spinner("Searching prompts..."):
+        items = genai_api.invoke_dynamo_search(
+            query=query,
+            user_id=st.session_state["user_id"],
             access_token=st.session_state["access_token"],
+            limit=SEARCH_LIMIT,
         )
-
-    if response.status_code == 200:
-        st.success(f"Prompt {prompt_id} deleted successfully")
-        prompt_df = st.session_state["prompt_df"]
-        prompt_df.drop(
-            prompt_df[prompt_df["session_id"] == prompt_id].index, inplace=True
-        )
-        st.session_state["prompt_df"] = prompt_df
-    else:
-        st.error(f"Prompt {prompt_id} deletion failed")
+    prompt_df = pd.DataFrame(items)
+    ai_model_session = st.session_state.get("ai_model", "ALL")
+    if ai_model_session != "ALL" and not prompt_df.empty:
+        prompt_df = prompt_df[prompt_df["model"] == ai_model_session]
+    return prompt_df.reset_index(drop=True)
 
 
-def filter_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+def get_prompt_detail(session_id: str) -> dict:
     """
-    Adds a UI on top of a dataframe to let viewers filter columns
-    Args: df (pd.DataFrame): Original dataframe
-    Returns: pd.DataFrame: Filtered dataframe
+    Runs API call to retrieve the texts of one prompt, once per session_id
     """
-    modify = st.checkbox("Add filters")
-    if not modify:
-        return df
-    df = df.copy()
-    # Try to convert datetimes into a standard format (datetime, no timezone)
-    for col in df.columns:
-        if is_object_dtype(df[col]):
-            try:
-                df[col] = pd.to_datetime(df[col])
-            except Exception as e:
-                LOGGER.exception("Error converting column %s to datetime: %s", col, e)
-        if is_datetime64_any_dtype(df[col]):
-            df[col] = df[col].dt.tz_localize(None)
-    modification_container = st.container()
-    with modification_container:
-        to_filter_columns = st.multiselect("Filter dataframe on", df.columns)
-        for column in to_filter_columns:
-            left, right = st.columns((1, 20))
-            # Treat columns with < 10 unique values as categorical
-            if is_categorical_dtype(df[column]) or df[column].nunique() < 10:
-                user_cat_input = right.multiselect(
-                    f"Values for {column}",
-                    df[column].unique(),
-                    default=list(df[column].unique()),
-                )
-                df = df[df[column].isin(user_cat_input)]
-            elif is_numeric_dtype(df[column]):
-                _min = float(df[column].min())
-                _max = float(df[column].max())
-                step = (_max - _min) / 100
-                user_num_input = right.slider(
-                    f"Values for {column}",
-                    min_value=_min,
-                    max_value=_max,
-                    value=(_min, _max),
-                    step=step,
-                )
-                df = df[df[column].between(*user_num_input)]
-            elif is_datetime64_any_dtype(df[column]):
-                user_date_input = right.date_input(
-                    f"Values for {column}",
-                    value=(
-                        df[column].min(),
-                        df[column].max(),
-                    ),
-                )
-                if len(user_date_input) == 2:
-                    user_date_input = tuple(map(pd.to_datetime, user_date_input))
-                    start_date, end_date = user_date_input
-                    df = df.loc[df[column].between(start_date, end_date)]
-            else:
-                user_text_input = right.text_input(
-                    f"Substring or regex in {column}",
+    if session_id not in st.session_state["prompt_details"]:
+        with st.spinner("Retrieving prompt..."):
+            st.session_state["prompt_details"][
+                session_id
+            ] = genai_api.invoke_dynamo_get_detail(
+                session_id=session_id,
+                access_token=st.session_state["access_token"],
+            )
+    return st.session_state["prompt_details"][session_id]
+
+
+def get_similar_prompts(session_id: str) -> pd.DataFrame:
+    """
+    Retrieves the templates most similar to a saved one, once per session_id
+    """
+    if session_id not in st.session_state["similar_prompts"]:
+        with st.spinner("Finding similar templates..."):
+            st.session_state["similar_prompts"][session_id] = pd.DataFrame(
+                similarity.find_similar_templates(
+                    user_id=st.session_state["user_id"],
+                    session_id=session_id,
+                    access_token=st.session_state["access_token"],
                 )
-                if user_text_input:
-                    df = df[df[column].astype(str).str.contains(user_text_input)]
-    return df
+            )
+    return st.session_state["similar_prompts"][session_id]
+
+
+def delete_prompt(prompt_id: str) -> None:
+    """
+    Runs API call to delete one prompt
+    """
+    delete_prompts([prompt_id])
+
+
+def delete_prompts(prompt_ids: list) -> None:
+    """
+    Runs one batch API call to delete the selected prompts.
+    The prompts are removed from the displayed catalog right away.
+    """
+    LOGGER.debug("Deleting prompts: %s", prompt_ids)
+    with st.spinner("Deleting prompts..."):
+        results = catalog_cache.delete_prompts(
+            user_id=st.session_state["user_id"],
+            session_ids=prompt_ids,
+            access_token=st.session_state["access_token"],
+        )
+
+    deleted = [result["session_id"] for result in results if result["status"] == "SUCCESS"]
+    failed = [result["session_id"] for result in results if result["status"] != "SUCCESS"]
+    prompt_df = st.session_state["prompt_df"]
+    st.session_state["prompt_df"] = prompt_df[
+        ~prompt_df["session_id"].isin(deleted)
+    ].reset_index(drop=True)
+    if deleted:
+        # the similar templates shown so far may include the deleted prompts
+        st.session_state["similar_prompts"] = {}
+        st.success(f"{len(deleted)} prompts deleted successfully")
+    if failed:
+        st.error(f"Deletion failed for prompts: {', '.join(failed)}")
 
 
 def dataframe_with_selections(df):
@@ -286,20 +301,58 @@ with st.sidebar:
 #      MAIN APP PAGE
 #########################
 st.text("")
-get_all_user_prompts()
-if st.session_state["prompt_df"].shape[0] == 0:
-    st.info("No prompts for this model. Select your model on the left bar.")
-    get_all_user_prompts()
+# pages are only retrieved again when the model filter changes
+if st.session_state["prompt_df_filter"] != st.session_state["ai_model_filter"]:
+    get_user_prompts_page(reset=True)
+search_query = st.text_input(
+    "Search prompts",
+    key="prompt_search",
+    placeholder="Words of the prompt template or of the output",
+).strip()
+if search_query:
+    prompt_df = search_user_prompts(search_query)
 else:
-    st.markdown("Select a prompt template from your prompt calalog.")
     prompt_df = st.session_state["prompt_df"]
+if prompt_df.shape[0] == 0:
+    if search_query:
+        st.info("No prompts match your search.")
+    else:
+        st.info("No prompts for this model. Select your model on the left bar.")
+else:
+    st.markdown("Select a prompt template from your prompt calalog.")
     selection = dataframe_with_selections(prompt_df)
+    # Streamlit reports no scroll events (neither of the page nor of the dataframe),
+    # the next page is loaded on demand below the table instead of on scroll
+    if st.session_state["prompt_next_token"] and not search_query:
+        if st.button(f"Load more prompts ({len(prompt_df)} loaded)"):
+            get_user_prompts_page()
+            st.experimental_rerun()
+    if len(selection) > 0:
+        if st.button(f"Delete selected prompts ({len(selection)})"):
+            delete_prompts(selection["session_id"].tolist())
+            if search_query:
+                st.experimental_rerun()
     if len(selection) == 1:
+        detail = get_prompt_detail(selection["session_id"].iloc[0])
+        selection = selection.assign(
+            **{field: detail.get(field) for field in DETAIL_FIELDS}
+        )
         if st.button("Continue with selected prompt template", type="primary"):
             st.session_state[
                 "df_selected_prompt"
             ] = selection  # Todo - add it to session state
             switch_page("email generation wizard")
+        selected_id = selection["session_id"].iloc[0]
+        if (
+            st.button("Find similar templates")
+            or selected_id in st.session_state["similar_prompts"]
+        ):
+            similar_df = get_similar_prompts(selected_id)
+            if similar_df.empty:
+                st.info("No similar templates in your catalog.")
+            else:
+                st.markdown("**Similar templates:**")
+                st.dataframe(similar_df, hide_index=True)
         st.markdown("## Details")
         prompt_content = None
         output_content = None
@@ -0,0 +1,231 @@
+"""
+Read-through cache of the prompt catalog, shared by the sessions of the Streamlit server
+"""
+
+#########################
+#    IMPORTS & LOGGER
+#########################
+
+from __future__ import annotations
+
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import streamlit as st
+
+import components.genai_api as genai_api
+
+LOGGER = logging.Logger("Catalog-cache", level=logging.DEBUG)
+HANDLER = logging.StreamHandler(sys.stdout)
+HANDLER.setFormatter(logging.Formatter("%(levelname)s | %(name)s | %(message)s"))
+LOGGER.addHandler(HANDLER)
+
+#########################
+#      CONSTANTS
+#########################
+
+# seconds a catalog page is served without asking the backend, after that it is revalidated with its ETag
+CATALOG_FRESHNESS = 30
+
+# seconds the recent writes are overlaid on the fetched pages
+CATALOG_TTL = 300
+
+# number of pages kept across all users
+MAX_CACHED_PAGES = 1024
+
+
+#########################
+#        STORE
+#########################
+
+
+class CatalogStore:
+    """
+    In-process state of the catalog cache:
+    - the fetched pages with their ETag, in LRU order
+    - a version per user, bumped on every write of the user, pages fetched at an
+      older version are revalidated before they are served
+    - the prompts written recently, overlaid on the cached pages until the catalog
+      indexes (eventually consistent) reflect them, reduced to the fields the pages list
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()  # key -> (fetched_at, version, etag, page)
+        self._versions = {}
+        self._recent_puts = {}  # user_id -> {session_id: (written_at, summary item)}
+        self._recent_deletes = {}  # user_id -> {session_id: written_at}
+
+    def version(self, user_id: str) -> int:
+        return self._versions.get(user_id, 0)
+
+    def get_page(self, key: tuple):
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is not None:
+                self._pages.move_to_end(key)
+            return entry
+
+    def put_page(self, key: tuple, version: int, etag: str, page: dict) -> None:
+        with self._lock:
+            self._pages[key] = (time.time(), version, etag, page)
+            self._pages.move_to_end(key)
+            while len(self._pages) > MAX_CACHED_PAGES:
+                self._pages.popitem(last=False)
+
+    def record_put(self, user_id: str, item: dict) -> None:
+        expired = time.time() - CATALOG_TTL
+        with self._lock:
+            # the items keep their texts until they expire, the older ones are dropped now
+            puts = {
+                session_id: put
+                for session_id, put in self._recent_puts.get(user_id, {}).items()
+                if put[0] > expired
+            }
+            puts[item["session_id"]] = (time.time(), dict(item))
+            self._recent_puts[user_id] = puts
+            self._recent_deletes.get(user_id, {}).pop(item["session_id"], None)
+            self._versions[user_id] = self.version(user_id) + 1
+
+    def record_deletes(self, user_id: str, session_ids: list) -> None:
+        with self._lock:
+            for session_id in session_ids:
+                self._recent_deletes.setdefault(user_id, {})[session_id] = time.time()
+                self._recent_puts.get(user_id, {}).pop(session_id, None)
+            self._versions[user_id] = self.version(user_id) + 1
+
+    def deleted_since(self, user_id: str, since: float) -> list:
+        """
+        Returns the prompts of a user deleted through this server since a time
+        """
+        with self._lock:
+            return [
+                session_id
+                for session_id, written_at in self._recent_deletes.get(user_id, {}).items()
+                if written_at >= since
+            ]
+
+    def overlay(
+        self, user_id: str, ai_model_filter: str, page: dict, first_page: bool, since: str = None
+    ) -> dict:
+        """
+        Returns the page without the recently deleted prompts and, on the first page,
+        with the recently saved prompts (at or after since) the backend does not return yet.
+        These get the fields the backend listed in the page.
+        """
+        expired = time.time() - CATALOG_TTL
+        with self._lock:
+            deletes = {
+                session_id
+                for session_id, written_at in self._recent_deletes.get(user_id, {}).items()
+                if written_at > expired
+            }
+            puts = [
+                item
+                for written_at, item in self._recent_puts.get(user_id, {}).values()
+                if written_at > expired
+            ]
+        items = [item for item in page["items"] if item.get("session_id") not in deletes]
+        if first_page:
+            returned = {item.get("session_id") for item in items}
+            missing = [
+                item
+                for item in puts
+                if item["session_id"] not in returned
+                and ai_model_filter in ("ALL", item.get("model"))
+                and item["timestamp"] >= (since or "")
+            ]
+            # pages of a backend that does not list its fields get the whole items
+            fields = page.get("fields") or {field for item in missing for field in item}
+            summaries = [
+                {field: item[field] for field in fields if field in item}
+                for item in sorted(missing, key=lambda item: item["timestamp"], reverse=True)
+            ]
+            items = summaries + items
+        return {**page, "items": items}
+
+
+@st.cache_resource
+def get_catalog_store() -> CatalogStore:
+    return CatalogStore()
+
+
+#########################
+#        READS
+#########################
+
+
+def get_catalog_page(
+    user_id: str,
+    ai_model_filter: str,
+    access_token: str,
+    page_size: int,
+    next_token: str = None,
+    since: str = None,
+) -> dict:
+    """
+    Returns one page of the user prompts, {"items": [...], "next_token": ...}, only the
+    prompts saved at or after the since timestamp if one is given.
+    A cached page is served as is while it is fresh and the user did not write to the catalog,
+    afterwards it is revalidated with a conditional GET, which is answered without reading
+    the catalog if nothing changed.
+    """
+    store = get_catalog_store()
+    key = (user_id, ai_model_filter, page_size, next_token, since)
+    version = store.version(user_id)
+    entry = store.get_page(key)
+    if (
+        entry is not None
+        and entry[1] == version
+        and time.time() - entry[0] < CATALOG_FRESHNESS
+    ):
+        page = entry[3]
+    else:
+        params = {"user_id": user_id, "ai_model_filter": ai_model_filter}
+        if since:
+            params["since_timestamp"] = since
+        response = genai_api.invoke_dynamo_get(
+            params=params,
+            access_token=access_token,
+            page_size=page_size,
+            next_token=next_token,
+            etag=entry[2] if entry is not None else None,
+        )
+        if response.status_code == 304:
+            LOGGER.info(f"Catalog page of user {user_id} not modified")
+            page = entry[3]
+        else:
+            page = response.json()
+        store.put_page(key, version, response.headers.get("ETag"), page)
+    return store.overlay(
+        user_id, ai_model_filter, page, first_page=next_token is None, since=since
+    )
+
+
+#########################
+#        WRITES
+#########################
+
+
+def put_prompt(item: dict, access_token: str) -> str:
+    """
+    Saves a prompt and invalidates the catalog pages of its user
+    """
+    success = genai_api.invoke_dynamo_put(item=item, access_token=access_token)
+    get_catalog_store().record_put(item["user_id"], item)
+    return success
+
+
+def delete_prompts(user_id: str, session_ids: list, access_token: str) -> list:
+    """
+    Deletes prompts in one batch request and invalidates the catalog pages of their user
+    """
+    results = genai_api.invoke_dynamo_delete_many(
+        session_ids=session_ids, access_token=access_token, user_id=user_id
+    )
+    deleted = [result["session_id"] for result in results if result["status"] == "SUCCESS"]
+    get_catalog_store().record_deletes(user_id, deleted)
+    return results
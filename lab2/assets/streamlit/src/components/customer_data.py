@@ -0,0 +1,245 @@
+"""
+Typed loading of the customer segment data: schema inference and vectorized column conversion,
+and a columnar store serving the source datasets to all sessions from memory-mapped Arrow files
+"""
+
+#########################
+#    IMPORTS & LOGGER
+#########################
+
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List
+
+import pandas as pd
+import pyarrow as pa
+import streamlit as st
+
+LOGGER = logging.Logger("Customer-data", level=logging.DEBUG)
+HANDLER = logging.StreamHandler(sys.stdout)
+HANDLER.setFormatter(logging.Formatter("%(levelname)s | %(name)s | %(message)s"))
+LOGGER.addHandler(HANDLER)
+
+#########################
+#      CONSTANTS
+#########################
+
+# column kinds of the inferred schema
+KIND_INT = "int"
+KIND_FLOAT = "float"
+KIND_STRING = "string"
+# columns that are not list-valued keep the dtype they were loaded with
+KIND_NATIVE = "native"
+
+# column groups, in display order after the first and last name
+USER_ATTRIBUTE_PREFIX = "User.UserAttributes."
+ATTRIBUTE_PREFIX = "Attributes."
+METRIC_PREFIX = "Metrics."
+LEADING_COLUMNS = ["User.UserAttributes.FirstName", "User.UserAttributes.LastName"]
+
+# session state key of the processed segment
+SESSION_KEY = "customer_data"
+
+INTEGER_PATTERN = r"[+-]?\d+"
+
+# source datasets of the customer store, by dataset name
+DATA_PATH = Path(os.path.dirname(__file__)).parent / "data"
+CUSTOMER_SOURCES = {
+    "df_segment_data": DATA_PATH / "df_segment_data.csv",
+    "Customers": DATA_PATH / "Customers.csv",
+}
+
+# directory of the converted Arrow files, shared by the processes of a task
+CUSTOMER_STORE_DIR = Path(
+    os.environ.get("CUSTOMER_STORE_DIR", Path(tempfile.gettempdir()) / "customer_store")
+)
+
+
+#########################
+#        SCHEMA
+#########################
+
+
+def first_elements(column: pd.Series) -> pd.Series:
+    """
+    First element of every list of a column, missing for empty lists
+    """
+    exploded = pd.Series(column.to_numpy(), dtype=object).explode()
+    first = exploded[~exploded.index.duplicated()]
+    return pd.Series(first.to_numpy(), index=column.index, name=column.name)
+
+
+def type_column(column: pd.Series):
+    """
+    Infers the kind of a column and converts it with vectorized casts, in one pass.
+    Attributes exported as lists (e.g. ["42"]) are reduced to their first element, typed int
+    if every element is an integer, float if every element is a number and string otherwise.
+    Empty lists become missing values.
+
+    Returns:
+        tuple: (kind, converted column)
+    """
+    if not pd.api.types.is_object_dtype(column.dtype):
+        return KIND_NATIVE, column
+    values = column.dropna()
+    # plain string columns are recognized from their first value without a full scan
+    if values.empty or not isinstance(values.iloc[0], list):
+        return KIND_NATIVE, column
+    if not values.map(lambda value: isinstance(value, list)).all():
+        LOGGER.warning(f"Column {column.name} mixes lists and scalars, left unconverted")
+        return KIND_NATIVE, column
+
+    first = first_elements(column)
+    present = first.notna()
+    numbers = pd.to_numeric(first, errors="coerce")
+    if present.any() and numbers[present].notna().all():
+        if first[present].astype(str).str.fullmatch(INTEGER_PATTERN).all():
+            return KIND_INT, numbers.astype("int64" if present.all() else "Int64")
+        return KIND_FLOAT, numbers.astype("float64")
+    return KIND_STRING, first.astype(str).where(present, None).astype(object)
+
+
+def infer_schema(df: pd.DataFrame) -> Dict[str, str]:
+    """
+    Kind of every column of a dataset
+    """
+    return {column: type_column(df[column])[0] for column in df.columns}
+
+
+#########################
+#     COLUMN GROUPS
+#########################
+
+
+class CustomerData:
+    """
+    Typed segment data with its column groups, columns ordered for display
+    """
+
+    def __init__(self, df: pd.DataFrame, schema: Dict[str, str]) -> None:
+        self.schema = schema
+        self.user_attribute_columns: List[str] = [
+            col
+            for col in df.columns
+            if col.startswith(USER_ATTRIBUTE_PREFIX) and col not in LEADING_COLUMNS
+        ]
+        self.attribute_columns = [col for col in df.columns if col.startswith(ATTRIBUTE_PREFIX)]
+        self.metric_columns = [col for col in df.columns if col.startswith(METRIC_PREFIX)]
+        grouped = set(
+            LEADING_COLUMNS
+            + self.user_attribute_columns
+            + self.attribute_columns
+            + self.metric_columns
+        )
+        self.other_columns = [col for col in df.columns if col not in grouped]
+        ordered_columns = (
+            [col for col in LEADING_COLUMNS if col in df.columns]
+            + self.user_attribute_columns
+            + self.attribute_columns
+            + self.metric_columns
+            + self.other_columns
+        )
+        self.df = df[ordered_columns]
+
+    def as_tuple(self) -> tuple:
+        return (
+            self.df,
+            self.user_attribute_columns,
+            self.attribute_columns,
+            self.metric_columns,
+            self.other_columns,
+        )
+
+
+def process_customer_data(df: pd.DataFrame) -> CustomerData:
+    """
+    Infers the schema of a dataset and converts it
+    """
+    schema, converted = {}, {}
+    for column in df.columns:
+        schema[column], values = type_column(df[column])
+        if schema[column] != KIND_NATIVE:
+            converted[column] = values
+    LOGGER.info(
+        f"Processed {len(df)} customers, converted columns: "
+        f"{ {column: schema[column] for column in converted} }"
+    )
+    return CustomerData(df.assign(**converted) if converted else df, schema)
+
+
+def get_customer_data(df: pd.DataFrame, df_name: str) -> CustomerData:
+    """
+    Returns the processed segment, memoized in the session by dataset identity:
+    reruns (e.g. the navigation between customers) reuse it until another dataset is loaded.
+    Datasets of the customer store are processed once for all sessions.
+    """
+    if df_name in CUSTOMER_SOURCES and df is load_customers(df_name):
+        return _shared_customer_data(df_name, source_version(df_name))
+    identity = (df_name, id(df), df.shape)
+    cached = st.session_state.get(SESSION_KEY)
+    if cached is not None and cached[0] == identity:
+        return cached[1]
+    customer_data = process_customer_data(df)
+    st.session_state[SESSION_KEY] = (identity, customer_data)
+    return customer_data
+
+
+#########################
+#     CUSTOMER STORE
+#########################
+
+
+def source_version(name: str) -> int:
+    """
+    Modification time of the source of a dataset, the converted file and the loaded table
+    are rebuilt when it changes
+    """
+    return CUSTOMER_SOURCES[name].stat().st_mtime_ns
+
+
+def build_store(name: str) -> Path:
+    """
+    Converts the CSV source of a dataset to an uncompressed Arrow IPC file, unless it is up to date.
+    The file carries the modification time of its source and is written under a temporary name
+    then renamed, concurrent builders never expose a partial file.
+    """
+    source = CUSTOMER_SOURCES[name]
+    target = CUSTOMER_STORE_DIR / f"{name}.arrow"
+    version = source_version(name)
+    if target.exists() and target.stat().st_mtime_ns == version:
+        return target
+    CUSTOMER_STORE_DIR.mkdir(parents=True, exist_ok=True)
+    table = pa.Table.from_pandas(pd.read_csv(source), preserve_index=False)
+    partial = target.with_suffix(f".{os.getpid()}.tmp")
+    with pa.OSFile(str(partial), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.utime(partial, ns=(version, version))
+    os.replace(partial, target)
+    LOGGER.info(f"Converted {source.name} to {target} ({table.num_rows} rows)")
+    return target
+
+
+@st.cache_resource
+def _load_customers(name: str, version: int) -> pd.DataFrame:
+    table = pa.ipc.open_file(pa.memory_map(str(build_store(name)), "r")).read_all()
+    LOGGER.info(f"Mapped {name}: {table.num_rows} rows, {table.nbytes / 1e6:.1f} MB")
+    # Arrow-backed columns reference the mapped buffers, nothing is copied to the heap
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def load_customers(name: str) -> pd.DataFrame:
+    """
+    Returns a dataset of the customer store. The frame is memory-mapped from its Arrow file
+    and shared by all sessions: it must not be modified in place.
+    """
+    return _load_customers(name, source_version(name))
+
+
+@st.cache_resource
+def _shared_customer_data(name: str, version: int) -> CustomerData:
+    return process_customer_data(_load_customers(name, version))
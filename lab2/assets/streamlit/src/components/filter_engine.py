@@ -0,0 +1,342 @@
+"""
+Filtering engine for customer and prompt tables: column profiles (kind, categorical codes,
+min/max) are inferred once per dataset, the filters of all columns are combined into a single
+boolean mask and the dataset is subset once
+"""
+
+#########################
+#    IMPORTS & LOGGER
+#########################
+
+from __future__ import annotations
+
+import logging
+import re
+import sys
+import threading
+import warnings
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from pandas.api.types import (
+    is_datetime64_any_dtype,
+    is_numeric_dtype,
+    is_object_dtype,
+)
+
+from components.customer_data import CUSTOMER_SOURCES, load_customers, source_version
+
+LOGGER = logging.Logger("Filter-engine", level=logging.DEBUG)
+HANDLER = logging.StreamHandler(sys.stdout)
+HANDLER.setFormatter(logging.Formatter("%(levelname)s | %(name)s | %(message)s"))
+LOGGER.addHandler(HANDLER)
+
+#########################
+#      CONSTANTS
+#########################
+
+# column kinds, each with its own filter widget
+KIND_CATEGORY = "category"
+KIND_NUMBER = "number"
+KIND_DATETIME = "datetime"
+KIND_TEXT = "text"
+
+# columns with fewer distinct values are filtered as categories
+MAX_CATEGORIES = 10
+
+# values parsed to decide whether a text column holds dates, before parsing the whole column
+DATETIME_SAMPLE_SIZE = 100
+
+# an equality filter matching fewer rows than this share of the table is served by the index
+INDEX_SELECTIVITY = 0.125
+
+# masks of recently evaluated filters, kept to skip their evaluation on reruns
+MAX_CACHED_MASKS = 32
+
+# session state key of the engines of the page datasets
+SESSION_KEY = "filter_engines"
+
+
+#########################
+#    COLUMN PROFILES
+#########################
+
+
+class ColumnProfile:
+    """
+    Kind of a column and the arrays its filters are evaluated on:
+    - category: codes of every row (one code per distinct value, missing values included)
+      and an index of the rows of every code
+    - number, datetime: values as a numpy array with their min and max
+    - text: the values as strings
+    """
+
+    def __init__(self, column: pd.Series) -> None:
+        self.name = column.name
+        self.categories: Optional[list] = None
+        self.codes: Optional[np.ndarray] = None
+        self.values = None
+        self.min = self.max = None
+        # (row positions sorted by code, start of every code in them), built with the codes
+        self.index: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+        if not is_numeric_dtype(column.dtype) and not is_datetime64_any_dtype(column.dtype):
+            column = parse_datetimes(column)
+        if is_datetime64_any_dtype(column.dtype) and getattr(column.dt, "tz", None) is not None:
+            column = column.dt.tz_localize(None)
+
+        codes, uniques = pd.factorize(column, use_na_sentinel=False)
+        distinct = int(pd.notna(uniques).sum())
+        if isinstance(column.dtype, pd.CategoricalDtype) or distinct < MAX_CATEGORIES:
+            self.kind = KIND_CATEGORY
+            self.codes = codes.astype(np.int32, copy=False)
+            self.categories = list(uniques)
+            order = np.argsort(self.codes, kind="stable")
+            bounds = np.searchsorted(self.codes[order], np.arange(len(self.categories) + 1))
+            self.index = (order, bounds)
+        elif not (is_numeric_dtype(column.dtype) or is_datetime64_any_dtype(column.dtype)):
+            self.kind = KIND_TEXT
+            # Arrow strings are searched by pyarrow kernels, other objects are searched as text
+            self.values = column.astype(str) if is_object_dtype(column.dtype) else column
+        elif is_datetime64_any_dtype(column.dtype):
+            self.kind = KIND_DATETIME
+            self.values = column.to_numpy(dtype="datetime64[ns]")
+            self.min, self.max = column.min(), column.max()
+        else:
+            self.kind = KIND_NUMBER
+            self.values = column.to_numpy(dtype="float64", na_value=np.nan)
+            self.min, self.max = float(np.nanmin(self.values)), float(np.nanmax(self.values))
+
+    def rows(self, code: int) -> np.ndarray:
+        """
+        Positions of the rows of a category, from the index sorting the rows by code
+        """
+        order, bounds = self.index
+        return order[bounds[code] : bounds[code + 1]]
+
+    def mask(self, value) -> Optional[np.ndarray]:
+        """
+        Rows matching a filter value: selected category codes, a (low, high) range
+        or a regular expression. None when the filter keeps every row.
+        """
+        if self.kind == KIND_CATEGORY:
+            selected = sorted(set(value))
+            if len(selected) == len(self.categories):
+                return None
+            counts = [len(self.rows(code)) for code in selected]
+            if sum(counts) < INDEX_SELECTIVITY * len(self.codes):
+                mask = np.zeros(len(self.codes), dtype=bool)
+                for code in selected:
+                    mask[self.rows(code)] = True
+                return mask
+            lookup = np.zeros(len(self.categories), dtype=bool)
+            lookup[selected] = True
+            return lookup[self.codes]
+        if self.kind == KIND_NUMBER:
+            low, high = value
+            return (self.values >= low) & (self.values <= high)
+        if self.kind == KIND_DATETIME:
+            low, high = (np.datetime64(pd.Timestamp(bound), "ns") for bound in value)
+            return (self.values >= low) & (self.values <= high)
+        if not value:
+            return None
+        return self.matches(value)
+
+    def matches(self, pattern: str, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Whether the text of every row, or of the given row positions, matches a regular expression
+        """
+        values = self.values if rows is None else self.values.iloc[rows]
+        return values.str.contains(pattern, na=False).to_numpy(dtype=bool)
+
+
+def parse_datetimes(column: pd.Series) -> pd.Series:
+    """
+    Returns the column parsed as dates if all its values are dates, unchanged otherwise.
+    A sample is parsed first, columns of free text are rejected without a full parse.
+    """
+    present = column.dropna()
+    if present.empty:
+        return column
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        try:
+            if pd.to_datetime(present.iloc[:DATETIME_SAMPLE_SIZE], errors="coerce").isna().any():
+                return column
+            parsed = pd.to_datetime(column, errors="coerce")
+        except (TypeError, ValueError):
+            return column
+    if parsed.notna().sum() != len(present):
+        return column
+    return parsed
+
+
+#########################
+#        ENGINE
+#########################
+
+
+class FilterEngine:
+    """
+    Filters of a dataset: column profiles are built on first use and kept,
+    as are the masks of the last filter values
+    """
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.df = df
+        self.profiles: Dict[str, ColumnProfile] = {}
+        self._masks: OrderedDict = OrderedDict()
+        # engines of the customer store are shared by the sessions, each on its own thread
+        self._lock = threading.Lock()
+        self._profile_lock = threading.Lock()
+
+    def profile(self, column: str) -> ColumnProfile:
+        """
+        Returns the profile of a column. Profiles are built under their own lock, so that
+        concurrent sessions build a column once and never see a partial profile.
+        """
+        profile = self.profiles.get(column)
+        if profile is None:
+            with self._profile_lock:
+                profile = self.profiles.get(column)
+                if profile is None:
+                    profile = ColumnProfile(self.df[column])
+                    self.profiles[column] = profile
+                    LOGGER.debug(f"Profiled column {column} as {profile.kind}")
+        return profile
+
+    def column_mask(self, column: str, value) -> Optional[np.ndarray]:
+        key = (column, repr(value))
+        with self._lock:
+            if key in self._masks:
+                self._masks.move_to_end(key)
+                return self._masks[key]
+        mask = self.profile(column).mask(value)
+        with self._lock:
+            self._masks[key] = mask
+            if len(self._masks) > MAX_CACHED_MASKS:
+                self._masks.popitem(last=False)
+        return mask
+
+    def mask(self, filters: Sequence[Tuple[str, object]]) -> Optional[np.ndarray]:
+        """
+        Combined mask of (column, value) filters, None when they keep every row
+
+        Raises:
+            re.error, ValueError: if a text filter is not a valid regular expression
+            (ValueError for Arrow-backed columns, matched by pyarrow)
+        """
+        combined = None
+        text_filters = []
+        for column, value in filters:
+            if self.profile(column).kind == KIND_TEXT:
+                text_filters.append((column, value))
+                continue
+            mask = self.column_mask(column, value)
+            if mask is None:
+                continue
+            combined = mask.copy() if combined is None else np.logical_and(combined, mask, out=combined)
+        # regular expressions are the costliest filters, they are matched last and only
+        # against the rows kept by the other filters
+        for column, value in text_filters:
+            if not value:
+                continue
+            if combined is None:
+                combined = self.column_mask(column, value).copy()
+                continue
+            rows = np.flatnonzero(combined)
+            combined[rows] = self.profile(column).matches(value, rows)
+        return combined
+
+    def apply(self, filters: Sequence[Tuple[str, object]]) -> pd.DataFrame:
+        """
+        Rows of the dataset matching all filters
+        """
+        mask = self.mask(filters)
+        return self.df if mask is None else self.df[mask]
+
+
+@st.cache_resource
+def _shared_filter_engine(name: str, version: int) -> FilterEngine:
+    return FilterEngine(load_customers(name))
+
+
+def get_filter_engine(df: pd.DataFrame, df_name: str) -> FilterEngine:
+    """
+    Returns the engine of a dataset, memoized in the session by dataset identity.
+    Datasets of the customer store share one engine across sessions.
+    """
+    if df_name in CUSTOMER_SOURCES and df is load_customers(df_name):
+        return _shared_filter_engine(df_name, source_version(df_name))
+    identity = (id(df), df.shape)
+    engines = st.session_state.setdefault(SESSION_KEY, {})
+    cached = engines.get(df_name)
+    if cached is not None and cached[0] == identity:
+        return cached[1]
+    engine = FilterEngine(df)
+    engines[df_name] = (identity, engine)
+    return engine
+
+
+#########################
+#       FILTER UI
+#########################
+
+
+def filter_dataframe(df: pd.DataFrame, df_name: str) -> pd.DataFrame:
+    """
+    Adds a UI on top of a dataframe to let viewers filter columns
+    Args:
+        df (pd.DataFrame): Original dataframe
+        df_name (str): Name of the dataset, profiles are kept per dataset
+    Returns: pd.DataFrame: Filtered dataframe
+    """
+    modify = st.checkbox("Add filters")
+    if not modify:
+        return df
+    engine = get_filter_engine(df, df_name)
+    filters: List[Tuple[str, object]] = []
+    modification_container = st.container()
+    with modification_container:
+        to_filter_columns = st.multiselect("Filter dataframe on", df.columns)
+        for column in to_filter_columns:
+            left, right = st.columns((1, 20))
+            profile = engine.profile(column)
+            if profile.kind == KIND_CATEGORY:
+                codes = list(range(len(profile.categories)))
+                user_cat_input = right.multiselect(
+                    f"Values for {column}",
+                    codes,
+                    default=codes,
+                    format_func=lambda code, profile=profile: str(profile.categories[code]),
+                )
+                filters.append((column, user_cat_input))
+            elif profile.kind == KIND_NUMBER:
+                user_num_input = right.slider(
+                    f"Values for {column}",
+                    min_value=profile.min,
+                    max_value=profile.max,
+                    value=(profile.min, profile.max),
+                    step=(profile.max - profile.min) / 100,
+                )
+                filters.append((column, user_num_input))
+            elif profile.kind == KIND_DATETIME:
+                user_date_input = right.date_input(
+                    f"Values for {column}",
+                    value=(profile.min, profile.max),
+                )
+                if len(user_date_input) == 2:
+                    filters.append((column, tuple(map(pd.to_datetime, user_date_input))))
+            else:
+                user_text_input = right.text_input(
+                    f"Substring or regex in {column}",
+                )
+                filters.append((column, user_text_input))
+    try:
+        return engine.apply(filters)
+    except (re.error, ValueError) as e:
+        st.error(f"Invalid regular expression: {e}")
+        return df
@@ -8,11 +8,22 @@ Helper classes for LLM inference
 
 from __future__ import annotations
 
+import asyncio
 import json
+import logging
 import os
-from typing import Callable
+import sys
+from itertools import islice
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Tuple, Union
 
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+
+LOGGER = logging.Logger("GenAI-API", level=logging.DEBUG)
+HANDLER = logging.StreamHandler(sys.stdout)
+HANDLER.setFormatter(logging.Formatter("%(levelname)s | %(name)s | %(message)s"))
+LOGGER.addHandler(HANDLER)
 
 #########################
 #      CONSTANTS
@@ -20,6 +31,19 @@ import requests
 
 API_URI = os.environ.get("API_URI")
 
+# Size of the HTTP connection pools to API Gateway
+POOL_MAXSIZE = 10
+
+# Records per batch content generation request, at most MAX_BATCH_RECORDS of the lambda
+MAX_BATCH_RECORDS = 16
+
+# Batch content generation requests in flight at once
+BATCH_CONCURRENCY = 4
+
+# Shared session: keeps TLS connections to API Gateway alive across calls and reruns
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE))
+
 # DEFAULT_NEGATIVE_ANSWER_QUESTION = "Could not answer based on the provided documents. Please rephrase your question, reduce the relevance threshold, or ask another question."  # noqa: E501
 # DEFAULT_NEGATIVE_ANSWER_SUMMARY = "Could not summarize the document."  # noqa: E501
 # WS_SSL = (os.environ.get("WS_SSL", "True")) == "True"
@@ -35,14 +59,22 @@ def invoke_content_creation(
     access_token: str,
     answer_length: int = 4096,
     temperature: float = 0.0,
+    system_prompt: str = None,
+    engine: str = "invoke_model",
+    cache_point: int = None,
 ) -> str:
     """
-    Run LLM to generate content via API
+    Run LLM to generate content via API.
+    engine is "invoke_model" or "converse", the latter sends system_prompt separately from the prompt.
+    cache_point is the length of the static prefix of the prompt, cached by models with prompt caching.
     """
 
     params = {
         "query": prompt,
         "type": "content_generation",
+        "engine": engine,
+        "system_prompt": system_prompt,
+        "cache_point": cache_point,
         "model_params": {
             "model_id": model_id,
             "answer_length": answer_length,
@@ -50,20 +82,113 @@ def invoke_content_creation(
         },
     }
     try:
-        response = requests.post(
+        response = SESSION.post(
             url=API_URI + "/content/bedrock",
             json=params,
             stream=False,
             headers={"Authorization": access_token},
             timeout=60,  # add a timeout parameter of 10 seconds
         )
-        print(response)
-        # response.raise_for_status()  # This will raise an HTTPError if the HTTP request returned an unsuccessful status code
+        LOGGER.debug(
+            f"{response}, response cache: {response.headers.get('X-Cache')}, "
+            f"prompt cache read/write tokens: {response.headers.get('X-Cache-Read-Input-Tokens')}"
+            f"/{response.headers.get('X-Cache-Write-Input-Tokens')}"
+        )
+        # response.raise_for_status()
         response = json.loads(response.text)
         return response
     except requests.RequestException as e:
         # Handle exception as needed
-        raise ValueError(f"Error making request to LLM API: {str(e)}")
+        raise ValueError(f"Error making request to LLM API: {str(e)}") from e
+
+
+def invoke_batch_content_creation(
+    records: Iterable[dict],
+    model_id: int,
+    access_token: str,
+    answer_length: int = 4096,
+    temperature: float = 0.0,
+    batch_size: int = MAX_BATCH_RECORDS,
+    system_prompt: str = None,
+    engine: str = "invoke_model",
+    cache_point: int = None,
+    concurrency: int = BATCH_CONCURRENCY,
+) -> Iterator[List[dict]]:
+    """
+    Run LLM to generate content for many customer records via API.
+    Each record carries its rendered "prompt" and, if the instructions are customer-specific,
+    its "system_prompt", otherwise system_prompt is shared by all records.
+    cache_point is the length of the static prefix the prompts share, see invoke_content_creation.
+    records can be a generator, e.g. of a large segment rendered chunk by chunk.
+    Records are sent in slices of batch_size (at most MAX_BATCH_RECORDS), up to concurrency
+    slices at once. The API generates the records of a slice in parallel, so a request lasts
+    about one generation and stays within the API timeout.
+
+    Yields the per-item results of each slice, as the slices complete:
+    [{"index": ..., "user_id": ..., "status": "SUCCESS" | "ERROR", "output" | "error": ...}]
+    """
+
+    params = {
+        "type": "batch_content_generation",
+        "engine": engine,
+        "system_prompt": system_prompt,
+        "cache_point": cache_point,
+        "model_params": {
+            "model_id": model_id,
+            "answer_length": answer_length,
+            "temperature": temperature,
+        },
+    }
+
+    async def generate_slices() -> AsyncIterator[List[dict]]:
+        async with AsyncGenAIClient(access_token) as client:
+            batches = client.generate_batches(
+                records,
+                params,
+                batch_size=min(batch_size, MAX_BATCH_RECORDS),
+                concurrency=concurrency,
+            )
+            try:
+                async for results in batches:
+                    yield results
+            finally:
+                # cancels the requests in flight if the caller stops early
+                await batches.aclose()
+
+    yield from iterate_async(generate_slices())
+
+
+def invoke_embeddings(
+    texts: list,
+    access_token: str,
+    dimensions: int = 512,
+    batch_size: int = 100,
+) -> list:
+    """
+    Embed texts via API, in slices of batch_size texts per request.
+    Returns one normalized vector (list of floats) per text, in input order.
+    """
+
+    embeddings = []
+    for offset in range(0, len(texts), batch_size):
+        params = {
+            "type": "embeddings",
+            "texts": texts[offset : offset + batch_size],
+            "dimensions": dimensions,
+        }
+        try:
+            response = SESSION.post(
+                url=API_URI + "/content/bedrock/embed",
+                json=params,
+                headers={"Authorization": access_token},
+                timeout=30,
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            # Handle exception as needed
+            raise ValueError(f"Error making request to LLM API: {str(e)}") from e
+        embeddings.extend(response.json()["embeddings"])
+    return embeddings
 
 
 def invoke_dynamo_put(
@@ -82,47 +207,144 @@ def invoke_dynamo_put(
     headers = {"Authorization": access_token}
 
     try:
-        response = requests.post(
+        response = SESSION.post(
             url=API_URI + "/dynamo/put",
             json=data,  # Use json=data to send as JSON payload
             headers=headers,
             timeout=10,
         )
-        response.raise_for_status()  # This will raise an HTTPError if the HTTP request returned an unsuccessful status code
+        response.raise_for_status()
         return response.json()
     except requests.RequestException as e:
         # Handle exception as needed
-        raise ValueError(f"Error making request to Dynamo API: {str(e)}")
+        raise ValueError(f"Error making request to Dynamo API: {str(e)}") from e
 
-    except json.JSONDecodeError:
+    except json.JSONDecodeError as e:
         # Handle JSON parsing exception as needed
-        raise ValueError("Received a non-JSON response from the server.")
+        raise ValueError("Received a non-JSON response from the server.") from e
 
 
 def invoke_dynamo_get(
     params: dict,
     access_token: str,
+    page_size: int = None,
+    next_token: str = None,
+    etag: str = None,
 ) -> str:
     """
-    Get the elements from DynamoDB via an API endpoint.
+    Get one page of elements from DynamoDB via an API endpoint.
+    The response body is {"items": [...], "next_token": ...}, pass next_token back to get the next page.
+    With the ETag of a previous response, the response is a 304 without body if the page did not change.
     """
 
     data = {
         "filter_params": params,
         "type": "GET",
+        "page_size": page_size,
+        "next_token": next_token,
     }
 
     headers = {"Authorization": access_token}
+    if etag:
+        headers["If-None-Match"] = etag
 
     try:
-        response = requests.get(
+        response = SESSION.get(
             url=API_URI + "/dynamo/get", json=data, headers=headers, timeout=10
         )
-        response.raise_for_status()  # This will raise an HTTPError if the HTTP request returned an unsuccessful status code
+        response.raise_for_status()
         return response
     except requests.RequestException as e:
         # Handle exception as needed
-        raise ValueError(f"Error making request to Dynamo API: {str(e)}")
+        raise ValueError(f"Error making request to Dynamo API: {str(e)}") from e
+
+
+def invoke_dynamo_get_detail(
+    session_id: str,
+    access_token: str,
+) -> dict:
+    """
+    Get all attributes of one element, including the prompt and output texts, from DynamoDB via an API endpoint.
+    """
+
+    data = {
+        "item": {"session_id": session_id},
+        "type": "DETAIL",
+    }
+
+    headers = {"Authorization": access_token}
+
+    try:
+        response = SESSION.get(
+            url=API_URI + "/dynamo/detail", json=data, headers=headers, timeout=10
+        )
+        response.raise_for_status()
+        return response.json()
+    except requests.RequestException as e:
+        # Handle exception as needed
+        raise ValueError(f"Error making request to Dynamo API: {str(e)}") from e
+
+
+def invoke_dynamo_search(
+    query: str,
+    user_id: str,
+    access_token: str,
+    limit: int = 20,
+) -> list:
+    """
+    Full-text search of the prompts of a user via an API endpoint, best matches first.
+    """
+
+    data = {
+        "type": "SEARCH",
+        "query": query,
+        "user_id": user_id,
+        "limit": limit,
+    }
+
+    headers = {"Authorization": access_token}
+
+    try:
+        response = SESSION.get(
+            url=API_URI + "/dynamo/search", json=data, headers=headers, timeout=10
+        )
+        response.raise_for_status()
+        return response.json()["items"]
+    except requests.RequestException as e:
+        # Handle exception as needed
+        raise ValueError(f"Error making request to Dynamo API: {str(e)}") from e
+
+
+def invoke_dynamo_get_details(
+    session_ids: list,
+    access_token: str,
+    fields: list = None,
+    batch_size: int = 100,
+) -> list:
+    """
+    Get the texts (or the given text fields) of many elements from DynamoDB via an API endpoint,
+    in slices of batch_size elements per request. Elements that do not exist are left out.
+    """
+
+    headers = {"Authorization": access_token}
+
+    items = []
+    for offset in range(0, len(session_ids), batch_size):
+        data = {
+            "type": "DETAIL",
+            "session_ids": session_ids[offset : offset + batch_size],
+            "fields": fields,
+        }
+        try:
+            response = SESSION.get(
+                url=API_URI + "/dynamo/detail", json=data, headers=headers, timeout=30
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            # Handle exception as needed
+            raise ValueError(f"Error making request to Dynamo API: {str(e)}") from e
+        items.extend(response.json()["items"])
+    return items
 
 
 def invoke_dynamo_delete(
@@ -142,11 +364,306 @@ def invoke_dynamo_delete(
     headers = {"Authorization": access_token}
 
     try:
-        response = requests.delete(
+        response = SESSION.delete(
             url=f"{API_URI}/dynamo/delete", json=data, headers=headers, timeout=10
         )
-        response.raise_for_status()  # This will raise an HTTPError if the HTTP request returned an unsuccessful status code
+        response.raise_for_status()
         return response
     except requests.RequestException as e:
         # Handle exception as needed
-        raise ValueError(f"Error making request to Dynamo API: {str(e)}")
+        raise ValueError(f"Error making request to Dynamo API: {str(e)}") from e
+
+
+def invoke_dynamo_batch(
+    operations: list,
+    access_token: str,
+) -> list:
+    """
+    Run PUT / DELETE operations on DynamoDB in one request via an API endpoint.
+    operations are {"type": "PUT" | "DELETE", "item": {...}} dicts, DELETE items only need the session_id.
+    Returns one {"index", "session_id", "status", "error"} result per operation.
+    """
+
+    data = {
+        "operations": operations,
+        "type": "BATCH",
+    }
+
+    headers = {"Authorization": access_token}
+
+    try:
+        response = SESSION.post(
+            url=API_URI + "/dynamo/batch", json=data, headers=headers, timeout=30
+        )
+        response.raise_for_status()
+        return response.json()
+    except requests.RequestException as e:
+        # Handle exception as needed
+        raise ValueError(f"Error making request to Dynamo API: {str(e)}") from e
+
+
+def _invoke_dynamo_batches(
+    operations: list, access_token: str, batch_size: int
+) -> list:
+    """
+    Sends operations in requests of batch_size and returns the results indexed on the whole list
+    """
+    results = []
+    for start in range(0, len(operations), batch_size):
+        for result in invoke_dynamo_batch(
+            operations[start : start + batch_size], access_token
+        ):
+            result["index"] += start
+            results.append(result)
+    return results
+
+
+def invoke_dynamo_put_many(
+    items: list,
+    access_token: str,
+    batch_size: int = 100,
+) -> list:
+    """
+    Put many json items into DynamoDB via the batch API endpoint, see invoke_dynamo_batch.
+    """
+    operations = [{"type": "PUT", "item": item} for item in items]
+    return _invoke_dynamo_batches(operations, access_token, batch_size)
+
+
+def invoke_dynamo_delete_many(
+    session_ids: list,
+    access_token: str,
+    batch_size: int = 100,
+    user_id: str = None,
+) -> list:
+    """
+    Delete many elements from DynamoDB via the batch API endpoint, see invoke_dynamo_batch.
+    user_id, the owner of all elements, saves the backend from looking it up.
+    """
+    operations = [
+        {"type": "DELETE", "item": {"session_id": session_id, "user_id": user_id}}
+        for session_id in session_ids
+    ]
+    return _invoke_dynamo_batches(operations, access_token, batch_size)
+
+
+#########################
+#     ASYNC CLIENT
+#########################
+
+
+def iterate_async(iterator: AsyncIterator) -> Iterator:
+    """
+    Iterates over an async iterator from blocking code (Streamlit pages),
+    on an event loop of its own
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(iterator.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(iterator.aclose())
+        loop.close()
+
+
+class AsyncGenAIClient:
+    """
+    Async client for the content generation API on a pooled HTTP client
+    (keep-alive, HTTP/2 when the h2 package is installed).
+
+    Usage:
+        async with AsyncGenAIClient(access_token) as client:
+            async for index, content in client.generate_many(prompts, model_id, concurrency=4):
+                ...
+    """
+
+    def __init__(
+        self,
+        access_token: str,
+        api_uri: str = None,
+        max_connections: int = POOL_MAXSIZE,
+        timeout: float = 60.0,
+    ) -> None:
+        try:
+            import h2  # noqa: F401
+
+            http2 = True
+        except ImportError:
+            http2 = False
+        self._client = httpx.AsyncClient(
+            base_url=api_uri or API_URI,
+            headers={"Authorization": access_token},
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=timeout,
+        )
+
+    async def __aenter__(self) -> AsyncGenAIClient:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    async def generate(
+        self,
+        prompt: str,
+        model_id: str,
+        answer_length: int = 4096,
+        temperature: float = 0.0,
+        system_prompt: str = None,
+        engine: str = "invoke_model",
+        cache_point: int = None,
+    ) -> str:
+        """
+        Run LLM to generate content via API, see invoke_content_creation
+        """
+        params = {
+            "query": prompt,
+            "type": "content_generation",
+            "engine": engine,
+            "system_prompt": system_prompt,
+            "cache_point": cache_point,
+            "model_params": {
+                "model_id": model_id,
+                "answer_length": answer_length,
+                "temperature": temperature,
+            },
+        }
+        try:
+            response = await self._client.post("/content/bedrock", json=params)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            raise ValueError(f"Error making request to LLM API: {str(e)}") from e
+
+    async def generate_batch(
+        self, params: dict, records: List[dict], offset: int = 0
+    ) -> List[dict]:
+        """
+        Run LLM to generate content for one slice of records via the batch API, see
+        invoke_batch_content_creation. offset, the position of the slice in all records,
+        is added to the indexes.
+        """
+        try:
+            response = await self._client.post(
+                "/content/bedrock/batch", json={**params, "records": records}
+            )
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise ValueError(f"Error making request to LLM API: {str(e)}") from e
+        # one JSON result per line, its index is the position within the slice
+        results = [json.loads(line) for line in response.text.splitlines() if line]
+        for result in results:
+            result["index"] += offset
+        return results
+
+    async def generate_batches(
+        self,
+        records: Iterable[dict],
+        params: dict,
+        batch_size: int = MAX_BATCH_RECORDS,
+        concurrency: int = BATCH_CONCURRENCY,
+    ) -> AsyncIterator[List[dict]]:
+        """
+        Send records in slices of batch_size, at most `concurrency` slices in flight.
+        records are read lazily, one slice ahead of a free request slot.
+
+        Yields the results of each slice as it completes.
+        """
+        records = iter(records)
+        pending = set()
+        offset = 0
+        try:
+            while True:
+                while len(pending) < concurrency:
+                    batch = list(islice(records, batch_size))
+                    if not batch:
+                        break
+                    pending.add(
+                        asyncio.ensure_future(self.generate_batch(params, batch, offset))
+                    )
+                    offset += len(batch)
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def generate_many(
+        self,
+        prompts: List[str],
+        model_id: str,
+        concurrency: int = 4,
+        ordered: bool = True,
+        timeout: float = None,
+        **params,
+    ) -> AsyncIterator[Tuple[int, Union[str, Exception]]]:
+        """
+        Generate content for many prompts with at most `concurrency` calls in flight.
+
+        Yields (index, content) pairs, in prompt order if ordered else as they complete.
+        content is the exception instead of the text if that call failed or exceeded
+        the per-call timeout.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(index: int, prompt: str) -> Tuple[int, Union[str, Exception]]:
+            async with semaphore:
+                try:
+                    content = await asyncio.wait_for(
+                        self.generate(prompt, model_id, **params), timeout
+                    )
+                except Exception as e:  # noqa: B902
+                    content = e
+                return index, content
+
+        tasks = [
+            asyncio.ensure_future(run(index, prompt))
+            for index, prompt in enumerate(prompts)
+        ]
+        try:
+            for task in tasks if ordered else asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def generate_many(
+    prompts: List[str],
+    model_id: str,
+    access_token: str,
+    concurrency: int = 4,
+    timeout: float = None,
+    **params,
+) -> List[Union[str, Exception]]:
+    """
+    Blocking helper around AsyncGenAIClient.generate_many for Streamlit pages.
+    Returns the contents in prompt order, failed calls as exceptions.
+    """
+
+    async def collect() -> List[Union[str, Exception]]:
+        contents = [None] * len(prompts)
+        async with AsyncGenAIClient(access_token) as client:
+            async for index, content in client.generate_many(
+                prompts, model_id, concurrency=concurrency, timeout=timeout, **params
+            ):
+                contents[index] = content
+        return contents
+
+    return asyncio.run(collect())
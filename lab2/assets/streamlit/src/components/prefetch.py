@@ -0,0 +1,108 @@
+"""
+Background pre-generation of drafts for the next customers
+"""
+
+#########################
+#    IMPORTS & LOGGER
+#########################
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict
+
+LOGGER = logging.Logger("Prefetch", level=logging.DEBUG)
+HANDLER = logging.StreamHandler(sys.stdout)
+HANDLER.setFormatter(logging.Formatter("%(levelname)s | %(name)s | %(message)s"))
+LOGGER.addHandler(HANDLER)
+
+
+#########################
+#      PREFETCHER
+#########################
+
+
+def make_prefetch_key(**settings) -> str:
+    """
+    Hashes the generation settings (template, model, params, segment) that drafts depend on
+    """
+    payload = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DraftPrefetcher:
+    """
+    Generates drafts on a small thread pool while the user reviews the current customer.
+
+    Worker threads never touch st.session_state: the page script submits the generation
+    calls and moves finished drafts into its own state with collect() on every rerun.
+    Drafts are tied to a settings key; changing it cancels the queued calls, discards
+    the results of the running ones and hands back the drafts already collected, for the
+    page to remove them from its state.
+    """
+
+    def __init__(self, max_workers: int = 2) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._futures: Dict[int, Future] = {}
+        self._collected: Dict[int, str] = {}
+        self.key = None
+
+    def reset(self, key: str) -> Dict[int, str]:
+        """
+        Drops all drafts if the settings key changed
+
+        Returns:
+            the drafts collected under the previous settings by customer index, empty if
+            the key did not change
+        """
+        if key == self.key:
+            return {}
+        cancelled = sum(future.cancel() for future in self._futures.values())
+        if self._futures or self._collected:
+            LOGGER.info(
+                f"Settings changed, dropped {len(self._futures)} pending drafts ({cancelled} not started)"
+                f" and {len(self._collected)} collected drafts"
+            )
+        collected = self._collected
+        self._futures = {}
+        self._collected = {}
+        self.key = key
+        return collected
+
+    def is_pending(self, index: int) -> bool:
+        return index in self._futures
+
+    def submit(self, index: int, generate: Callable[[], str]) -> None:
+        """
+        Queues the generation of the draft of a customer, unless it is already queued
+        """
+        if index not in self._futures:
+            self._futures[index] = self._executor.submit(generate)
+
+    def wait(self, index: int, timeout: float = None) -> str:
+        """
+        Blocks until the draft of a customer is generated and returns it, None if it failed
+        """
+        future = self._futures.pop(index)
+        try:
+            return future.result(timeout=timeout)
+        except Exception as e:
+            LOGGER.error(f"Prefetch failed for customer {index}: {e}")
+            return None
+
+    def collect(self) -> Dict[int, str]:
+        """
+        Returns the finished drafts by customer index, they are handed back by the next
+        reset of the settings
+        """
+        drafts = {}
+        for index in [index for index, future in self._futures.items() if future.done()]:
+            content = self.wait(index)
+            if content:
+                drafts[index] = content
+        self._collected.update(drafts)
+        return drafts
@@ -0,0 +1,276 @@
+"""
+Prompt template engine: templates are parsed once into literal and placeholder segments,
+validated against the customer columns and product fields, then rendered without regex
+or dict rebuilding per customer
+"""
+
+#########################
+#    IMPORTS & LOGGER
+#########################
+
+from __future__ import annotations
+
+import logging
+import string
+import sys
+from functools import lru_cache
+from itertools import repeat
+from typing import Dict, Iterable, Iterator, List, Mapping, Tuple, Union
+
+import pandas as pd
+
+LOGGER = logging.Logger("Prompt-template", level=logging.DEBUG)
+HANDLER = logging.StreamHandler(sys.stdout)
+HANDLER.setFormatter(logging.Formatter("%(levelname)s | %(name)s | %(message)s"))
+LOGGER.addHandler(HANDLER)
+
+#########################
+#      CONSTANTS
+#########################
+
+# product fields are referenced by their displayed names, e.g. {Product} for "Name"
+PRODUCT_FIELD_ALIASES = [("Name", "Product"), ("Title", "Campaign Phrase")]
+
+# number of compiled templates kept in memory
+MAX_COMPILED_TEMPLATES = 256
+
+# customers rendered per chunk by render_segment
+RENDER_CHUNK_SIZE = 10000
+
+# customer column holding the product id
+PRODUCT_COLUMN = "User.UserAttributes.Product"
+
+SOURCE_CUSTOMER = "customer"
+SOURCE_PRODUCT = "product"
+
+_FORMATTER = string.Formatter()
+
+
+#########################
+#        HELPER
+#########################
+
+
+def placeholder_name(key: str) -> str:
+    """
+    Name of a customer column in templates: dots are not allowed in placeholders,
+    {User.UserAttributes.FirstName} and {UserUserAttributesFirstName} are the same field
+    """
+    return key.replace(".", "")
+
+
+def product_placeholder_name(key: str) -> str:
+    """
+    Name of a product field in templates
+    """
+    for field, alias in PRODUCT_FIELD_ALIASES:
+        key = key.replace(field, alias)
+    return key
+
+
+def split_field_name(field_name: str) -> Tuple[str, str]:
+    """
+    Splits a placeholder into its name and its index accessors, "Key Features[0]" -> ("Key Features", "[0]")
+    """
+    position = field_name.find("[")
+    if position == -1:
+        return field_name, ""
+    return field_name[:position], field_name[position:]
+
+
+class TemplateError(ValueError):
+    """
+    Raised when a template references fields that are not available, with all of them at once
+    """
+
+    def __init__(self, missing_fields: List[str]) -> None:
+        self.missing_fields = missing_fields
+        super().__init__(
+            "Invalid input parameter in prompt: "
+            + ", ".join(f"'{field}'" for field in missing_fields)
+        )
+
+
+#########################
+#       TEMPLATES
+#########################
+
+
+class CompiledTemplate:
+    """
+    A prompt template parsed into literal and placeholder segments.
+
+    The placeholders are rewritten to positional fields of one format string, so rendering
+    a customer is a single str.format call on the values of the bound columns. Format specs,
+    conversions and indexing ({Key Features[0]}) are kept.
+    """
+
+    def __init__(self, template: str) -> None:
+        self.template = template
+        self.fields: List[str] = []  # placeholder names, in order of first use
+        self.static_prefix_length = None  # length of the text before the first placeholder
+        # (literal, field index, value format) segments, the value format is None for plain {field}
+        self.segments: List[Tuple[str, int, str]] = []
+
+        positions: Dict[str, int] = {}
+        parts = []
+        length = 0
+        for literal, field_name, format_spec, conversion in _FORMATTER.parse(template):
+            parts.append(literal.replace("{", "{{").replace("}", "}}"))
+            length += len(literal)
+            if field_name is None:
+                self.segments.append((literal, None, None))
+                continue
+            if self.static_prefix_length is None:
+                self.static_prefix_length = length
+            name, accessor = split_field_name(placeholder_name(field_name))
+            if name not in positions:
+                positions[name] = len(self.fields)
+                self.fields.append(name)
+            value_format = (
+                accessor
+                + (f"!{conversion}" if conversion else "")
+                + (f":{format_spec}" if format_spec else "")
+            )
+            parts.append("{" + str(positions[name]) + value_format + "}")
+            self.segments.append((literal, positions[name], "{0" + value_format + "}" if value_format else None))
+        if self.static_prefix_length is None:
+            self.static_prefix_length = len(template)
+        self._format = "".join(parts)
+
+    def missing_fields(self, available: Iterable[str]) -> List[str]:
+        available = set(available)
+        return [field for field in self.fields if field not in available]
+
+    def bind(self, columns: Iterable[str], product_fields: Iterable[str] = ()) -> "BoundTemplate":
+        """
+        Maps every placeholder to a customer column or a product field.
+        Customer columns take precedence over product fields of the same name.
+
+        Raises:
+            TemplateError: with all the placeholders that match neither
+        """
+        sources: Dict[str, Tuple[str, str]] = {
+            product_placeholder_name(key): (SOURCE_PRODUCT, key) for key in product_fields
+        }
+        sources.update({placeholder_name(column): (SOURCE_CUSTOMER, column) for column in columns})
+        missing = self.missing_fields(sources)
+        if missing:
+            raise TemplateError(missing)
+        return BoundTemplate(self, [sources[field] for field in self.fields])
+
+    def render(self, customer: Mapping, product: Mapping = None) -> str:
+        """
+        Renders the template for one customer and its product
+        """
+        product = product or {}
+        if hasattr(customer, "to_dict"):
+            customer = customer.to_dict()
+        return self.bind(customer.keys(), product.keys()).render(customer, product)
+
+
+class BoundTemplate:
+    """
+    A compiled template bound to the columns of a dataset: rendering looks up
+    the bound keys and formats them, nothing is parsed or renamed per customer
+    """
+
+    def __init__(self, template: CompiledTemplate, sources: List[Tuple[str, str]]) -> None:
+        self.template = template
+        self.sources = sources
+        self.customer_columns = [key for source, key in sources if source == SOURCE_CUSTOMER]
+        self.product_fields = [key for source, key in sources if source == SOURCE_PRODUCT]
+
+    def render(self, customer: Mapping, product: Mapping = None) -> str:
+        if hasattr(customer, "to_dict"):
+            # a DataFrame row: native Python values, as rendered by {field!r} or {field:d}
+            customer = customer.to_dict()
+        values = [
+            customer[key] if source == SOURCE_CUSTOMER else product[key]
+            for source, key in self.sources
+        ]
+        return self.template._format.format(*values)
+
+    def render_columns(self, columns: List[list], size: int) -> List[str]:
+        """
+        Renders many customers at once from the values of every field (in the order of
+        template.fields): each placeholder is converted to strings column by column, then
+        the literals and the converted columns are joined row by row
+        """
+        if not self.template.fields:
+            # the parsed literals, with {{ and }} unescaped as in render()
+            return ["".join(literal for literal, _, _ in self.template.segments)] * size
+        converted: Dict[Tuple[int, str], list] = {}
+        parts = []
+        for literal, field_index, value_format in self.template.segments:
+            if literal:
+                parts.append(repeat(literal))
+            if field_index is None:
+                continue
+            key = (field_index, value_format)
+            if key not in converted:
+                values = columns[field_index]
+                converted[key] = list(map(str if value_format is None else value_format.format, values))
+            parts.append(converted[key])
+        return ["".join(row) for row in zip(*parts)]
+
+
+@lru_cache(maxsize=MAX_COMPILED_TEMPLATES)
+def compile_template(template: str) -> CompiledTemplate:
+    """
+    Returns the compiled template, parsed once per template text
+    """
+    compiled = CompiledTemplate(template)
+    LOGGER.debug(f"Compiled template with fields {compiled.fields}")
+    return compiled
+
+
+#########################
+#   SEGMENT RENDERING
+#########################
+
+
+def render_segment(
+    template: Union[str, CompiledTemplate],
+    df: pd.DataFrame,
+    products: Mapping[str, Mapping],
+    chunk_size: int = RENDER_CHUNK_SIZE,
+    product_column: str = PRODUCT_COLUMN,
+) -> Iterator[pd.Series]:
+    """
+    Renders the prompts of all customers of a segment, chunk by chunk, without building
+    a dict per customer. Products are joined on the product column of the customers.
+
+    Args:
+        template: template text or compiled template
+        df: customers of the segment
+        products: product info by product id
+        chunk_size: customers rendered at once, bounds the memory of large segments
+
+    Yields:
+        pd.Series: the prompts of a chunk, indexed like df
+
+    Raises:
+        TemplateError: if placeholders match neither a column nor a field of every product
+        ValueError: if a customer references a product that is not in products
+    """
+    compiled = template if isinstance(template, CompiledTemplate) else compile_template(template)
+    product_fields = set.intersection(*(set(product) for product in products.values())) if products else set()
+    bound = compiled.bind(df.columns, product_fields)
+
+    if bound.product_fields:
+        unknown = set(df[product_column].astype(str).unique()) - set(map(str, products))
+        if unknown:
+            raise ValueError(f"Unknown products in segment: {', '.join(sorted(unknown))}")
+        products = {str(product_id): product for product_id, product in products.items()}
+
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start : start + chunk_size]
+        product_ids = chunk[product_column].astype(str) if bound.product_fields else None
+        columns = [
+            chunk[key].tolist()
+            if source == SOURCE_CUSTOMER
+            else product_ids.map({product_id: product[key] for product_id, product in products.items()}).tolist()
+            for source, key in bound.sources
+        ]
+        yield pd.Series(bound.render_columns(columns, len(chunk)), index=chunk.index, dtype=object)
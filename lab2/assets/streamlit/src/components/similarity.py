@@ -0,0 +1,463 @@
+"""
+Embedding-based similarity of prompt templates: near-duplicate detection on save and
+"find templates like this one" in the catalog
+"""
+
+#########################
+#    IMPORTS & LOGGER
+#########################
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import numpy as np
+import streamlit as st
+
+import components.catalog_cache as catalog_cache
+import components.genai_api as genai_api
+
+LOGGER = logging.Logger("Similarity", level=logging.DEBUG)
+HANDLER = logging.StreamHandler(sys.stdout)
+HANDLER.setFormatter(logging.Formatter("%(levelname)s | %(name)s | %(message)s"))
+LOGGER.addHandler(HANDLER)
+
+#########################
+#      CONSTANTS
+#########################
+
+# "bedrock" embeds with Titan Text Embeddings through the API, "hashing" is the local deterministic stand-in
+EMBEDDER = os.environ.get("SIMILARITY_EMBEDDER", "bedrock")
+EMBEDDING_DIMENSIONS = 512
+
+# cosine similarity above which a template is reported as a near-duplicate
+DUPLICATE_THRESHOLD = float(os.environ.get("DUPLICATE_THRESHOLD", 0.92))
+
+# number of templates returned by "find similar" and the similarity they need at least
+SIMILAR_LIMIT = 5
+SIMILAR_THRESHOLD = 0.3
+
+# catalogs larger than this are searched with the LSH index instead of the exact one
+LSH_MIN_SIZE = 5000
+LSH_TABLES = 8
+LSH_BITS = 12
+
+# number of embeddings kept across all users
+MAX_CACHED_EMBEDDINGS = 100_000
+
+# catalog pages listed per request when the index is synced
+SYNC_PAGE_SIZE = 200
+
+# seconds between two syncs that list the whole catalog, the syncs in between only list the
+# templates saved since the last one and take the deletions from the catalog cache of this server:
+# the full sync catches the deletions made through other servers
+FULL_SYNC_INTERVAL = 3600
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+#########################
+#       EMBEDDERS
+#########################
+
+
+@lru_cache(maxsize=65536)
+def _feature_bucket(feature: str, dimensions: int) -> Tuple[int, float]:
+    digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return digest % dimensions, 1.0 if digest >> 63 else -1.0
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class HashingEmbedder:
+    """
+    Deterministic local embedder: signed feature hashing of the word unigrams and bigrams.
+    Needs no network, stable across processes, used in tests and when no API is configured.
+    """
+
+    def __init__(self, dimensions: int = EMBEDDING_DIMENSIONS) -> None:
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = TOKEN_PATTERN.findall(text.lower())
+            features = tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+            for feature in features:
+                column, sign = _feature_bucket(feature, self.dimensions)
+                vectors[row, column] += sign
+        return normalize(vectors)
+
+
+class ApiEmbedder:
+    """
+    Titan Text Embeddings V2 through the content generation API
+    """
+
+    def __init__(self, access_token: str, dimensions: int = EMBEDDING_DIMENSIONS) -> None:
+        self.access_token = access_token
+        self.dimensions = dimensions
+        self.name = f"titan-embed-text-v2-{dimensions}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        embeddings = genai_api.invoke_embeddings(
+            texts=texts, access_token=self.access_token, dimensions=self.dimensions
+        )
+        return normalize(np.asarray(embeddings, dtype=np.float32))
+
+
+def get_embedder(access_token: str):
+    if EMBEDDER == "hashing":
+        return HashingEmbedder()
+    return ApiEmbedder(access_token)
+
+
+#########################
+#    EMBEDDING CACHE
+#########################
+
+
+class EmbeddingCache:
+    """
+    LRU cache of embeddings by (embedder, text hash). Missing texts are embedded in one batch.
+    """
+
+    def __init__(self, max_size: int = MAX_CACHED_EMBEDDINGS) -> None:
+        self._lock = threading.Lock()
+        self._vectors = OrderedDict()
+        self.max_size = max_size
+
+    def embed(self, embedder, texts: List[str]) -> np.ndarray:
+        keys = [(embedder.name, hashlib.sha256(text.encode("utf-8")).digest()) for text in texts]
+        with self._lock:
+            cached = {key: self._vectors[key] for key in keys if key in self._vectors}
+            for key in cached:
+                self._vectors.move_to_end(key)
+        missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in cached))
+        if missing:
+            LOGGER.info(f"Embedding {len(missing)} texts with {embedder.name}")
+            vectors = embedder.embed(missing)
+            computed = {
+                (embedder.name, hashlib.sha256(text.encode("utf-8")).digest()): vector
+                for text, vector in zip(missing, vectors)
+            }
+            cached.update(computed)
+            with self._lock:
+                self._vectors.update(computed)
+                while len(self._vectors) > self.max_size:
+                    self._vectors.popitem(last=False)
+        if not keys:
+            return np.zeros((0, embedder.dimensions), dtype=np.float32)
+        return np.stack([cached[key] for key in keys])
+
+
+@st.cache_resource
+def get_embedding_cache() -> EmbeddingCache:
+    return EmbeddingCache()
+
+
+#########################
+#    VECTOR INDEXES
+#########################
+
+
+class FlatIndex:
+    """
+    Exact cosine similarity over normalized vectors, one matrix product per query
+    """
+
+    def __init__(self, dimensions: int) -> None:
+        self.dimensions = dimensions
+        self.ids: List[str] = []
+        self.vectors = np.zeros((0, dimensions), dtype=np.float32)
+        self._positions: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._positions
+
+    def vector(self, item_id: str) -> np.ndarray:
+        return self.vectors[self._positions[item_id]]
+
+    def add(self, ids: List[str], vectors: np.ndarray) -> None:
+        """
+        Adds vectors, replacing the vectors of ids already in the index
+        """
+        self.remove([item_id for item_id in ids if item_id in self._positions])
+        self._positions.update({item_id: len(self.ids) + offset for offset, item_id in enumerate(ids)})
+        self.ids.extend(ids)
+        self.vectors = np.vstack([self.vectors, np.asarray(vectors, dtype=np.float32)])
+
+    def remove(self, ids: List[str]) -> None:
+        removed = {item_id for item_id in ids if item_id in self._positions}
+        if not removed:
+            return
+        keep = np.array([item_id not in removed for item_id in self.ids], dtype=bool)
+        self.ids = [item_id for item_id in self.ids if item_id not in removed]
+        self.vectors = self.vectors[keep]
+        self._positions = {item_id: position for position, item_id in enumerate(self.ids)}
+
+    def _rank(self, positions: np.ndarray, vector: np.ndarray, limit: int, threshold: float, exclude):
+        scores = self.vectors[positions] @ vector
+        order = np.argsort(-scores)
+        results = []
+        for rank in order:
+            if scores[rank] < threshold:
+                break
+            item_id = self.ids[positions[rank]]
+            if item_id in exclude:
+                continue
+            results.append((item_id, float(scores[rank])))
+            if len(results) == limit:
+                break
+        return results
+
+    def search(self, vector: np.ndarray, limit: int = SIMILAR_LIMIT, threshold: float = -1.0, exclude=()):
+        """
+        Returns the (id, cosine similarity) pairs of the closest vectors, best first
+        """
+        if not self.ids:
+            return []
+        scores = self.vectors @ vector
+        # partial sort of the best candidates, enough to skip the excluded ids
+        candidates = min(len(scores), limit + len(exclude))
+        positions = np.argpartition(-scores, candidates - 1)[:candidates]
+        return self._rank(positions, vector, limit, threshold, set(exclude))
+
+
+class LSHIndex(FlatIndex):
+    """
+    Approximate index: random-hyperplane LSH tables select candidates that are ranked exactly.
+    Recall is traded for speed on large catalogs, near-duplicates (high similarity) are almost
+    always found since they share most signature bits.
+    """
+
+    def __init__(self, dimensions: int, tables: int = LSH_TABLES, bits: int = LSH_BITS, seed: int = 0) -> None:
+        super().__init__(dimensions)
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((tables, bits, dimensions)).astype(np.float32)
+        self._weights = 1 << np.arange(bits)
+        self._buckets = [{} for _ in range(tables)]
+        self._signatures: Dict[str, np.ndarray] = {}
+
+    def _signature(self, vectors: np.ndarray) -> np.ndarray:
+        # (n, tables) bucket keys
+        return ((np.einsum("tbd,nd->ntb", self.planes, vectors) > 0) * self._weights).sum(axis=2)
+
+    def add(self, ids: List[str], vectors: np.ndarray) -> None:
+        super().add(ids, vectors)
+        for item_id, signature in zip(ids, self._signature(np.asarray(vectors, dtype=np.float32))):
+            self._signatures[item_id] = signature
+            for table, key in enumerate(signature):
+                self._buckets[table].setdefault(int(key), set()).add(item_id)
+
+    def remove(self, ids: List[str]) -> None:
+        for item_id in ids:
+            signature = self._signatures.pop(item_id, None)
+            if signature is None:
+                continue
+            for table, key in enumerate(signature):
+                self._buckets[table].get(int(key), set()).discard(item_id)
+        super().remove(ids)
+
+    def search(self, vector: np.ndarray, limit: int = SIMILAR_LIMIT, threshold: float = -1.0, exclude=()):
+        candidates = set()
+        for table, key in enumerate(self._signature(vector[np.newaxis, :])[0]):
+            candidates |= self._buckets[table].get(int(key), set())
+        if not candidates:
+            return []
+        positions = np.fromiter((self._positions[item_id] for item_id in candidates), dtype=np.int64)
+        return self._rank(positions, vector, limit, threshold, set(exclude))
+
+
+def create_index(dimensions: int, size: int = 0):
+    """
+    Exact index for small catalogs, LSH index from LSH_MIN_SIZE templates on
+    """
+    if size >= LSH_MIN_SIZE:
+        return LSHIndex(dimensions)
+    return FlatIndex(dimensions)
+
+
+#########################
+#    TEMPLATE INDEX
+#########################
+
+
+class TemplateIndex:
+    """
+    Vector index of the prompt templates of one user, synced incrementally with the catalog:
+    only templates saved since the last sync are listed, retrieved and embedded.
+    """
+
+    def __init__(self, embedder) -> None:
+        self.embedder = embedder
+        self.lock = threading.Lock()
+        self.index = create_index(embedder.dimensions)
+        self.summaries: Dict[str, dict] = {}
+        self.synced_version = None
+        self.synced_at = 0.0
+        self.full_synced_at = 0.0
+
+    def is_stale(self, version: int) -> bool:
+        return self.synced_version != version or time.time() - self.synced_at > catalog_cache.CATALOG_FRESHNESS
+
+    def list_summaries(self, user_id: str, access_token: str, since: str = None) -> Dict[str, dict]:
+        """
+        Lists the summaries of the templates of a user, all of them or those saved at or after since
+        """
+        summaries = {}
+        next_token = None
+        while True:
+            page = catalog_cache.get_catalog_page(
+                user_id=user_id,
+                ai_model_filter="ALL",
+                access_token=access_token,
+                page_size=SYNC_PAGE_SIZE,
+                next_token=next_token,
+                since=since,
+            )
+            summaries.update({item["session_id"]: item for item in page["items"]})
+            next_token = page["next_token"]
+            if not next_token:
+                return summaries
+
+    def sync(self, user_id: str, access_token: str) -> None:
+        store = catalog_cache.get_catalog_store()
+        version = store.version(user_id)
+        if not self.is_stale(version):
+            return
+        started_at = time.time()
+        full = started_at - self.full_synced_at > FULL_SYNC_INTERVAL
+        # the timestamps have a one second resolution: the templates of the last second are listed again
+        since = None if full else max((item.get("timestamp") or "" for item in self.summaries.values()), default="")
+        listed = self.list_summaries(user_id, access_token, since=since or None)
+
+        if full:
+            summaries = listed
+            removed = [session_id for session_id in self.index.ids if session_id not in listed]
+        else:
+            summaries = {**self.summaries, **listed}
+            deleted = store.deleted_since(user_id, self.synced_at)
+            removed = [session_id for session_id in deleted if session_id in summaries]
+            for session_id in removed:
+                summaries.pop(session_id)
+        # templates new to the index or saved again since they were embedded
+        embedded = {session_id: item.get("timestamp") for session_id, item in self.summaries.items()}
+        added = [
+            session_id
+            for session_id, item in listed.items()
+            if session_id not in self.index or embedded.get(session_id) != item.get("timestamp")
+        ]
+        if removed:
+            self.index.remove(removed)
+        if added:
+            items = genai_api.invoke_dynamo_get_details(
+                session_ids=added, access_token=access_token, fields=["Prompt Template"]
+            )
+            self.add([item["session_id"] for item in items], [item.get("Prompt Template") or "" for item in items])
+        self.summaries = summaries
+        self.synced_version = version
+        self.synced_at = started_at
+        if full:
+            self.full_synced_at = started_at
+        LOGGER.info(
+            f"Synced templates of {user_id} ({'full' if full else f'since {since}'}): "
+            f"{len(added)} added, {len(removed)} removed"
+        )
+
+    def add(self, session_ids: List[str], templates: List[str]) -> None:
+        if not session_ids:
+            return
+        vectors = get_embedding_cache().embed(self.embedder, templates)
+        if type(self.index) is FlatIndex and len(self.index) + len(session_ids) >= LSH_MIN_SIZE:
+            # switch to the approximate index once the catalog grows large
+            index = create_index(self.embedder.dimensions, len(self.index) + len(session_ids))
+            index.add(self.index.ids, self.index.vectors)
+            self.index = index
+        self.index.add(session_ids, vectors)
+
+    def search(self, vector: np.ndarray, limit: int, threshold: float, exclude=()) -> List[dict]:
+        return [
+            {**self.summaries.get(session_id, {"session_id": session_id}), "similarity": round(score, 4)}
+            for session_id, score in self.index.search(vector, limit=limit, threshold=threshold, exclude=exclude)
+        ]
+
+
+@st.cache_resource
+def get_template_indexes() -> Dict[tuple, TemplateIndex]:
+    return {}
+
+
+def get_template_index(user_id: str, access_token: str) -> TemplateIndex:
+    """
+    Returns the synced template index of a user, shared by the sessions of the server
+    """
+    embedder = get_embedder(access_token)
+    indexes = get_template_indexes()
+    template_index = indexes.setdefault((user_id, embedder.name), TemplateIndex(embedder))
+    # the token of the current session is used for the API calls of this sync
+    template_index.embedder = embedder
+    with template_index.lock:
+        template_index.sync(user_id, access_token)
+    return template_index
+
+
+#########################
+#        QUERIES
+#########################
+
+
+def find_near_duplicates(
+    user_id: str, session_id: str, template: str, access_token: str, threshold: float = DUPLICATE_THRESHOLD
+) -> List[dict]:
+    """
+    Returns the saved templates of a user that are near-duplicates of a template, most similar first.
+    The template is about to be saved as session_id: its own previous version is not a duplicate.
+    """
+    template_index = get_template_index(user_id, access_token)
+    vector = get_embedding_cache().embed(template_index.embedder, [template])[0]
+    return template_index.search(vector, limit=SIMILAR_LIMIT, threshold=threshold, exclude=(session_id,))
+
+
+def find_similar_templates(
+    user_id: str, session_id: str, access_token: str, limit: int = SIMILAR_LIMIT
+) -> List[dict]:
+    """
+    Returns the saved templates of a user most similar to one of them
+    """
+    template_index = get_template_index(user_id, access_token)
+    if session_id not in template_index.index:
+        return []
+    vector = template_index.index.vector(session_id)
+    return template_index.search(vector, limit=limit, threshold=SIMILAR_THRESHOLD, exclude=(session_id,))
+
+
+def add_saved_template(user_id: str, session_id: str, template: str, access_token: str) -> None:
+    """
+    Adds a template that was just saved to the index of its user, so that the next sync
+    does not retrieve it again
+    """
+    embedder = get_embedder(access_token)
+    template_index = get_template_indexes().get((user_id, embedder.name))
+    if template_index is None:
+        return
+    with template_index.lock:
+        template_index.add([session_id], [template])
@@ -2,8 +2,11 @@
 Helper functions with StreamLit UI utils
 """
 
+import csv
 import os
 import json
+import threading
+import time
 from pathlib import Path
 from datetime import datetime
 
@@ -147,17 +150,92 @@ def display_search_result(
             )
 
 
-def get_product_info(product_id, return_dict=True):
-    path = Path(os.path.dirname(__file__))
-    with open(f"{path.parent.absolute()}/data/products.json", "r") as f:
-        data = json.load(f)
+# product data: products.json and the same products as item table with pipe-delimited lists
+DATA_PATH = Path(os.path.dirname(__file__)).parent / "data"
+PRODUCTS_JSON_PATH = DATA_PATH / "products.json"
+PRODUCTS_CSV_PATH = DATA_PATH / "df_item_banking.csv"
+PRODUCT_LIST_FIELDS = ["Key Features", "Key Benefits", "Great For"]
+
+# seconds between two checks of the product files for changes
+PRODUCT_RELOAD_INTERVAL = 5
+
+
+class ProductCatalog:
+    """
+    Products indexed by id, loaded once and reloaded only when a source file changes (mtime).
+    products.json and df_item_banking.csv describe the same products, they are merged per id:
+    the JSON fields win, the item table fills the fields the JSON lacks.
+    The returned products are shared, callers must not modify them.
+    """
+
+    def __init__(self, json_path: Path, csv_path: Path) -> None:
+        self.json_path = json_path
+        self.csv_path = csv_path
+        self._lock = threading.Lock()
+        self._products = {}
+        self._mtimes = None
+        self._checked_at = 0.0
+
+    def _source_mtimes(self) -> tuple:
+        return tuple(
+            path.stat().st_mtime_ns if path.exists() else None
+            for path in (self.json_path, self.csv_path)
+        )
+
+    def _load(self) -> dict:
+        products = {}
+        if self.csv_path.exists():
+            with open(self.csv_path, newline="") as f:
+                for row in csv.DictReader(f):
+                    product = {"id": row.pop("itemId")}
+                    for field, value in row.items():
+                        if field in PRODUCT_LIST_FIELDS:
+                            value = [item for item in (value or "").split("|") if item]
+                        product[field] = value
+                    products[product["id"]] = product
+        if self.json_path.exists():
+            with open(self.json_path, "r") as f:
+                for product in json.load(f)["products"]:
+                    products[product["id"]] = {**products.get(product["id"], {}), **product}
+        return products
+
+    def refresh(self) -> None:
+        """
+        Reloads the products if a source file changed, checked at most every PRODUCT_RELOAD_INTERVAL seconds
+        """
+        now = time.time()
+        if self._mtimes is not None and now - self._checked_at < PRODUCT_RELOAD_INTERVAL:
+            return
+        with self._lock:
+            self._checked_at = now
+            mtimes = self._source_mtimes()
+            if mtimes != self._mtimes:
+                self._products = self._load()
+                self._mtimes = mtimes
 
-        if return_dict:
-            for product in data["products"]:
-                if product["id"] == product_id:
-                    return product
-        else:
-            return data
+    def get(self, product_id):
+        self.refresh()
+        return self._products.get(product_id)
+
+    def products(self) -> list:
+        self.refresh()
+        return list(self._products.values())
+
+
+@st.cache_resource
+def get_product_catalog() -> ProductCatalog:
+    return ProductCatalog(PRODUCTS_JSON_PATH, PRODUCTS_CSV_PATH)
+
+
+def get_product_info(product_id, return_dict=True):
+    """
+    Returns the product with the given id (None if unknown), or all products as
+    {"products": [...]} if return_dict is False. Lookups are served from memory.
+    """
+    catalog = get_product_catalog()
+    if return_dict:
+        return catalog.get(product_id)
+    return {"products": catalog.products()}
 
 
 def display_product_info(card_info):
@@ -209,6 +287,8 @@ def reset_session_state(page_name: str) -> None:
                 "email",
                 "df",
                 "df_name",
+                "customer_data",
+                "filter_engines",
                 "df_selected",
                 "df_selected_prompt",
             ]:
@@ -4,18 +4,29 @@ from typing import Any, Dict, List, Tuple
 
 BEDROCK_MODELS = [
     "Bedrock: Claude 3 Sonnet",
+    "Bedrock: Claude 3.5 Haiku",
     "Bedrock: Amazon Titan",
 ]
 # TODO - AFTER REINVENT - UNCOMMENT
 BEDROCK_MODELS_after_reinvent = [
-    "Bedrock: Claude 3 Sonnet"
+    "Bedrock: Claude 3 Sonnet",
+    "Bedrock: Claude 3.5 Haiku",
     "Bedrock: Claude Instant",
     "Bedrock: J2 Grande Instruct",
     "Bedrock: J2 Jumbo Instruct",
     "Bedrock: Amazon Titan",
+    "Bedrock: Amazon Titan Premier",
     "Bedrock: LLama2",
+    "Bedrock: Llama 3 8B Instruct",
+    "Bedrock: Mistral 7B Instruct",
 ]
 FILTER_BEDROCK_MODELS = ["ALL"] + BEDROCK_MODELS
+# models that accept a separate system prompt through the Converse API
+SYSTEM_PROMPT_MODELS = {
+    "Bedrock: Claude 3 Sonnet",
+    "Bedrock: Claude 3.5 Haiku",
+    "Bedrock: Llama 3 8B Instruct",
+}
 
 
 def get_models_specs(path: Path) -> Tuple[List[str], Dict[str, Any]]:
@@ -0,0 +1,121 @@
+"""
+Micro-benchmark of the shared boto3 client factory (assets/layers/aws_clients) against a local stub endpoint.
+
+Compares a DynamoDB GetItem with a client created per invocation (the pattern the lambdas used before the
+factory) to the same call with the client cached by get_client(). The stub answers over plain HTTP on
+localhost, so the measured gap is the client construction and the connection setup only; TLS handshakes
+against real endpoints widen it.
+
+The factory client is pointed at the stub with AWS_ENDPOINT_URL_DYNAMODB, which needs botocore >= 1.31.
+
+Usage (from lab2): python bench/bench_aws_clients.py [--calls 200]
+"""
+
+#########################
+#       LIBRARIES
+#########################
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import boto3
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "assets" / "layers" / "aws_clients" / "python"))
+
+from aws_clients import get_client  # noqa: E402
+
+REGION = "us-east-1"
+TABLE_NAME = "bench-table"
+GET_ITEM_RESPONSE = b'{"Item": {"session_id": {"S": "bench"}}}'
+
+
+#########################
+#      STUB ENDPOINT
+#########################
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers every DynamoDB call with the same item, on keep-alive HTTP/1.1 connections
+    """
+
+    protocol_version = "HTTP/1.1"
+    # one buffered write per response without Nagle delays, as a real endpoint answers
+    disable_nagle_algorithm = True
+    wbufsize = 64 * 1024
+    connections = set()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        StubHandler.connections.add(self.client_address)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-amz-json-1.0")
+        self.send_header("Content-Length", str(len(GET_ITEM_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(GET_ITEM_RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+#########################
+#       BENCHMARK
+#########################
+
+
+def get_item(client):
+    client.get_item(TableName=TABLE_NAME, Key={"session_id": {"S": "bench"}})
+
+
+def measure(name, calls, make_client):
+    StubHandler.connections = set()
+    get_item(make_client())  # warm-up: service model loading, first connection
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        get_item(make_client())
+        timings.append((time.perf_counter() - start) * 1000)
+    print(
+        f"{name:<28} mean {statistics.mean(timings):6.2f} ms  p50 {statistics.median(timings):6.2f} ms  "
+        f"p99 {sorted(timings)[int(len(timings) * 0.99) - 1]:6.2f} ms  connections {len(StubHandler.connections)}"
+    )
+    return statistics.mean(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--calls", type=int, default=200, help="warm calls per variant")
+    args = parser.parse_args()
+
+    # the stub does not check signatures, any credentials do
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    server, endpoint_url = start_stub()
+    try:
+        per_call = measure(
+            "boto3.client() per call",
+            args.calls,
+            lambda: boto3.client("dynamodb", region_name=REGION, endpoint_url=endpoint_url),
+        )
+        # get_client has no endpoint override, the stub is reached by the service endpoint env var
+        os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = endpoint_url
+        reused = measure("get_client() reused", args.calls, lambda: get_client("dynamodb", region_name=REGION))
+    finally:
+        server.shutdown()
+    print(f"speed-up: {per_call / reused:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,18 +6,26 @@ import aws_cdk.aws_apigatewayv2_alpha as _apigw
 import aws_cdk.aws_apigatewayv2_integrations_alpha as _integrations
 from aws_cdk import aws_apigateway
 from aws_cdk import Aws, CfnOutput, Duration, RemovalPolicy
+from aws_cdk import aws_cloudwatch as cloudwatch
 from aws_cdk import aws_cognito as cognito
 from aws_cdk import aws_dynamodb as ddb
 from aws_cdk import aws_sns as sns
 from aws_cdk import aws_iam as iam
 from aws_cdk import aws_lambda as _lambda
 from aws_cdk import aws_logs as logs
+from aws_cdk import aws_s3 as _s3
 from aws_cdk import custom_resources as cr
 from aws_cdk.aws_apigatewayv2_authorizers_alpha import HttpUserPoolAuthorizer
 from aws_cdk import aws_kms as kms
 from constructs import Construct
 
 QUERY_BEDROCK_TIMEOUT = 900
+RESPONSE_CACHE_TTL = 7 * 24 * 3600
+PROMPTS_USER_INDEX = "user_id-timestamp-index"
+# Non-key prompt attributes projected into the catalog indexes, the prompt and output texts are read from the table
+PROMPTS_SUMMARY_ATTRIBUTES = ["model", "answer_length", "temperature", "Industry", "Language", "Task", "Technique"]
+# Namespace of the custom metrics of the prompt catalog lambda
+PROMPT_METRICS_NAMESPACE = "PromptCatalog"
 
 
 class bdrk_reinventAPIConstructs(Construct):
@@ -51,6 +59,7 @@ class bdrk_reinventAPIConstructs(Construct):
         self.create_sns_topic()
         self.create_roles()
         self.create_lambda_functions()
+        self.create_alarms()
 
         self.authorizer = HttpUserPoolAuthorizer(
             "BooksAuthorizer", self.user_pool, user_pool_clients=[self.user_pool_client]
@@ -96,6 +105,24 @@ class bdrk_reinventAPIConstructs(Construct):
             ),
         )
 
+        # add content/bedrock/batch to POST /
+        http_api.add_routes(
+            path="/content/bedrock/batch",
+            methods=[_apigw.HttpMethod.POST],
+            integration=_integrations.HttpLambdaIntegration(
+                "LambdaProxyIntegration", handler=self.bedrock_content_generation_lambda
+            ),
+        )
+
+        # add content/bedrock/embed to POST /
+        http_api.add_routes(
+            path="/content/bedrock/embed",
+            methods=[_apigw.HttpMethod.POST],
+            integration=_integrations.HttpLambdaIntegration(
+                "LambdaProxyIntegration", handler=self.bedrock_content_generation_lambda
+            ),
+        )
+
         # add dynamo/put to POST /
         http_api.add_routes(
             path="/dynamo/put",
@@ -110,6 +137,34 @@ class bdrk_reinventAPIConstructs(Construct):
             integration=_integrations.HttpLambdaIntegration("LambdaProxyIntegration", handler=self.prompt_ddb_lambda),
         )
 
+        # add dynamo/batch to POST /
+        http_api.add_routes(
+            path="/dynamo/batch",
+            methods=[_apigw.HttpMethod.POST],
+            integration=_integrations.HttpLambdaIntegration("LambdaProxyIntegration", handler=self.prompt_ddb_lambda),
+        )
+
+        # add dynamo/search to GET /
+        http_api.add_routes(
+            path="/dynamo/search",
+            methods=[_apigw.HttpMethod.GET],
+            integration=_integrations.HttpLambdaIntegration("LambdaProxyIntegration", handler=self.prompt_ddb_lambda),
+        )
+
+        # add dynamo/detail to GET /
+        http_api.add_routes(
+            path="/dynamo/detail",
+            methods=[_apigw.HttpMethod.GET],
+            integration=_integrations.HttpLambdaIntegration("LambdaProxyIntegration", handler=self.prompt_ddb_lambda),
+        )
+
+        # add dynamo/reindex to POST /
+        http_api.add_routes(
+            path="/dynamo/reindex",
+            methods=[_apigw.HttpMethod.POST],
+            integration=_integrations.HttpLambdaIntegration("LambdaProxyIntegration", handler=self.prompt_ddb_lambda),
+        )
+
         # add dynamo/put to POST /
         http_api.add_routes(
             path="/dynamo/delete",
@@ -193,6 +248,35 @@ class bdrk_reinventAPIConstructs(Construct):
             removal_policy=RemovalPolicy.DESTROY,
             point_in_time_recovery=True,
         )
+        # Prompt catalog of a user, newest first
+        self.prompts_table.add_global_secondary_index(
+            index_name=PROMPTS_USER_INDEX,
+            partition_key=ddb.Attribute(name="user_id", type=ddb.AttributeType.STRING),
+            sort_key=ddb.Attribute(name="timestamp", type=ddb.AttributeType.STRING),
+            projection_type=ddb.ProjectionType.INCLUDE,
+            non_key_attributes=PROMPTS_SUMMARY_ATTRIBUTES,
+        )
+
+        # Prompt texts too large to be kept in the prompts table items and the search indexes of the catalogs
+        self.prompt_texts_bucket = _s3.Bucket(
+            self,
+            f"{self.stack_name}-prompt-texts",
+            encryption=_s3.BucketEncryption.S3_MANAGED,
+            block_public_access=_s3.BlockPublicAccess.BLOCK_ALL,
+            enforce_ssl=True,
+            removal_policy=RemovalPolicy.DESTROY,
+            auto_delete_objects=True,
+        )
+
+        self.response_cache_table = ddb.Table(
+            self,
+            f"{self.stack_name}-response-cache",
+            partition_key=ddb.Attribute(name="cache_key", type=ddb.AttributeType.STRING),
+            time_to_live_attribute="expires_at",
+            table_class=ddb.TableClass.STANDARD,
+            billing_mode=ddb.BillingMode("PAY_PER_REQUEST"),
+            removal_policy=RemovalPolicy.DESTROY,
+        )
 
     ## **************** Create SNS Topic ****************
     def create_sns_topic(self):
@@ -227,10 +311,13 @@ class bdrk_reinventAPIConstructs(Construct):
             environment={
                 "BEDROCK_REGION": self.bedrock_region,
                 "BEDROCK_ROLE_ARN": str(self.bedrock_role_arn),
+                "RESPONSE_CACHE_TABLE": self.response_cache_table.table_name,
+                "RESPONSE_CACHE_TTL": str(RESPONSE_CACHE_TTL),
             },
             role=self.bedrock_content_generation_role,
             layers=[
                 self.layers.bedrock_compatible_sdk,
+                self.layers.aws_clients,
             ],
         )
         self.bedrock_content_generation_lambda.add_alias(
@@ -251,7 +338,13 @@ class bdrk_reinventAPIConstructs(Construct):
             timeout=Duration.seconds(20),
             environment={
                 "TABLE_NAME": self.prompts_table.table_name,
+                "USER_INDEX_NAME": PROMPTS_USER_INDEX,
+                "SPILL_BUCKET": self.prompt_texts_bucket.bucket_name,
+                "SEARCH_INDEX_BUCKET": self.prompt_texts_bucket.bucket_name,
+                "METRICS_NAMESPACE": PROMPT_METRICS_NAMESPACE,
             },
+            # the search index needs a boto3 with S3 conditional writes, newer than the one of the runtime
+            layers=[self.layers.bedrock_compatible_sdk, self.layers.aws_clients],
             role=self.lambda_DDB_role,
         )
         self.prompt_ddb_lambda.add_alias(
@@ -273,9 +366,29 @@ class bdrk_reinventAPIConstructs(Construct):
             environment={
                 "SNS_TOPIC_ARN": self.sns_topic.topic_arn,
             },
+            layers=[self.layers.aws_clients],
             role=self.sns_topic_role,
         )
 
+    def create_alarms(self):
+        # search index updates that failed after the catalog write, see the REINDEX operation to repair them
+        cloudwatch.Alarm(
+            self,
+            f"{self.stack_name}-search-index-failures",
+            alarm_name=f"{self.stack_name}-search-index-failures",
+            alarm_description="Search index updates of the prompt catalog are failing",
+            metric=cloudwatch.Metric(
+                namespace=PROMPT_METRICS_NAMESPACE,
+                metric_name="SearchIndexUpdateFailures",
+                statistic="Sum",
+                period=Duration.minutes(5),
+            ),
+            threshold=1,
+            evaluation_periods=1,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+        )
+
     ## **************** IAM Permissions ****************
     def create_roles(self: str):
         ## ********* IAM Roles *********
@@ -393,11 +506,27 @@ class bdrk_reinventAPIConstructs(Construct):
                         "dynamodb:DeleteItem",
                         "dynamodb:UpdateItem",
                         "dynamodb:Scan",
+                        "dynamodb:Query",
+                        "dynamodb:BatchWriteItem",
+                        "dynamodb:BatchGetItem",
                     ],
                     resources=[
                         self.prompts_table.table_arn,
+                        f"{self.prompts_table.table_arn}/index/*",
                     ],
-                )
+                ),
+                iam.PolicyStatement(
+                    actions=["s3:GetObject", "s3:PutObject", "s3:DeleteObject"],
+                    resources=[
+                        self.prompt_texts_bucket.arn_for_objects("prompts/*"),
+                        self.prompt_texts_bucket.arn_for_objects("search-index/*"),
+                    ],
+                ),
+                # without ListBucket, reading a missing index is AccessDenied instead of NoSuchKey
+                iam.PolicyStatement(
+                    actions=["s3:ListBucket"],
+                    resources=[self.prompt_texts_bucket.bucket_arn],
+                ),
             ]
         )
         prompt_db_policy = iam.Policy(
@@ -458,3 +587,25 @@ class bdrk_reinventAPIConstructs(Construct):
             document=bedrock_access_docpolicy,
         )
         self.bedrock_content_generation_role.attach_inline_policy(bedrock_access_policy)
+
+        ## ********* Response cache *********
+        response_cache_docpolicy = iam.PolicyDocument(
+            statements=[
+                iam.PolicyStatement(
+                    actions=[
+                        "dynamodb:GetItem",
+                        "dynamodb:PutItem",
+                    ],
+                    resources=[
+                        self.response_cache_table.table_arn,
+                    ],
+                )
+            ]
+        )
+        response_cache_policy = iam.Policy(
+            self,
+            f"{self.stack_name}-response-cache-policy",
+            policy_name=f"{self.stack_name}-response-cache-policy",
+            document=response_cache_docpolicy,
+        )
+        self.bedrock_content_generation_role.attach_inline_policy(response_cache_policy)
@@ -19,12 +19,21 @@ class bdrk_reinventLambdaLayers(Construct):
         self.bedrock_compatible_sdk = _lambda.LayerVersion(
             self,
             f"{stack_name}-bedrock-compatible-sdk-layer",
-            compatible_runtimes=[_lambda.Runtime.PYTHON_3_9],
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_9, _lambda.Runtime.PYTHON_3_11],
             code=_lambda.Code.from_asset("./assets/layers/bedrock-compatible-sdk.zip"),
-            description="A layer for bedrock compatible boto3 sdk",
+            description="A layer for bedrock compatible boto3 sdk, with S3 conditional writes",
             layer_version_name=f"{stack_name}-bedrock-compatible-sdk-layer-3",
         )
 
+        self.aws_clients = _lambda.LayerVersion(
+            self,
+            f"{stack_name}-aws-clients-layer",
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_9, _lambda.Runtime.PYTHON_3_11],
+            code=_lambda.Code.from_asset("./assets/layers/aws_clients"),
+            description="A layer with the shared boto3 client factory",
+            layer_version_name=f"{stack_name}-aws-clients-layer",
+        )
+
         # self.jwt = _lambda.LayerVersion(
         #     self,
         #     f"{stack_name}-jwt",
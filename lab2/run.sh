@@ -104,7 +104,8 @@ conda create -n lambda_layer_env python=3.9 -y
 conda activate lambda_layer_env
 
 # Install necessary packages in this environment
-pip install boto3 
+# (S3 conditional writes of the search index need boto3 1.35.69 or later)
+pip install "boto3>=1.35.69"
 
 # Prepare directory for Lambda Layer
 LAYER_DIR="./assets/layers/"
@@ -0,0 +1,55 @@
+"""
+Catalog cache: recently written prompts overlaid on the pages of the backend
+"""
+
+import sys
+from pathlib import Path
+
+# the Streamlit app imports its packages from its source directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "assets" / "streamlit" / "src"))
+
+from components import catalog_cache  # noqa: E402
+
+USER = "user-1"
+
+
+def make_prompt(session_id, timestamp, model="Bedrock: Claude 3 Sonnet"):
+    return {
+        "session_id": session_id,
+        "user_id": USER,
+        "timestamp": timestamp,
+        "model": model,
+        "Prompt Template": "Write to {Name}",
+        "Output": "Dear Jane",
+    }
+
+
+def test_recent_puts_get_the_fields_of_the_page():
+    store = catalog_cache.CatalogStore()
+    store.record_put(USER, make_prompt("s1", "2024-06-01"))
+    store.record_put(USER, make_prompt("s2", "2024-06-02", model="Bedrock: Amazon Titan"))
+    page = {"items": [], "next_token": None, "fields": ["session_id", "timestamp", "model", "Industry"]}
+
+    overlaid = store.overlay(USER, "ALL", page, first_page=True)
+    assert overlaid["items"] == [
+        {"session_id": "s2", "timestamp": "2024-06-02", "model": "Bedrock: Amazon Titan"},
+        {"session_id": "s1", "timestamp": "2024-06-01", "model": "Bedrock: Claude 3 Sonnet"},
+    ]
+    assert [item["session_id"] for item in store.overlay(USER, "Bedrock: Amazon Titan", page, True)["items"]] == ["s2"]
+    assert store.overlay(USER, "ALL", page, first_page=False)["items"] == []
+
+
+def test_recent_writes_expire(monkeypatch):
+    store = catalog_cache.CatalogStore()
+    now = 1_000_000.0
+    monkeypatch.setattr(catalog_cache.time, "time", lambda: now)
+    store.record_put(USER, make_prompt("s1", "2024-06-01"))
+    store.record_deletes(USER, ["s0"])
+    page = {"items": [{"session_id": "s0"}], "next_token": None, "fields": ["session_id"]}
+    assert store.overlay(USER, "ALL", page, first_page=True)["items"] == [{"session_id": "s1"}]
+
+    now += catalog_cache.CATALOG_TTL + 1
+    store.record_put(USER, make_prompt("s2", "2024-06-02"))
+    assert store.overlay(USER, "ALL", page, first_page=True)["items"] == [{"session_id": "s2"}, {"session_id": "s0"}]
+    # the expired put is dropped, not only hidden
+    assert list(store._recent_puts[USER]) == ["s2"]
@@ -0,0 +1,91 @@
+"""
+Batch content generation client: slicing of the records, slices in flight and per-slice results against a
+mocked batch API
+"""
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+# the Streamlit app imports its packages from its source directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "assets" / "streamlit" / "src"))
+
+import components.genai_api as genai_api  # noqa: E402
+
+
+class FakeBatchApi:
+    """
+    Mocked /content/bedrock/batch endpoint: echoes the prompts of the records as outputs, one NDJSON line
+    per record in reverse order (the lambda returns them in order of completion)
+    """
+
+    def __init__(self, fail_prompt=None):
+        self.slices = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail_prompt = fail_prompt
+
+    async def handle(self, request):
+        records = json.loads(request.content)["records"]
+        self.slices.append([record["prompt"] for record in records])
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        if any(record["prompt"] == self.fail_prompt for record in records):
+            return httpx.Response(502)
+        lines = [
+            json.dumps({"index": index, "status": "SUCCESS", "output": record["prompt"]})
+            for index, record in enumerate(records)
+        ]
+        return httpx.Response(200, text="\n".join(reversed(lines)) + "\n")
+
+
+@pytest.fixture
+def api(monkeypatch):
+    api = FakeBatchApi()
+
+    def create_client(self, access_token, **kwargs):
+        self._client = httpx.AsyncClient(base_url="https://api", transport=httpx.MockTransport(api.handle))
+
+    monkeypatch.setattr(genai_api.AsyncGenAIClient, "__init__", create_client)
+    return api
+
+
+def generate(count, **kwargs):
+    records = ({"User.UserId": str(number), "prompt": f"prompt {number}"} for number in range(count))
+    return genai_api.invoke_batch_content_creation(records=records, model_id="model", access_token="token", **kwargs)
+
+
+def test_batch_is_sent_in_concurrent_slices(api):
+    slices = list(generate(50))
+    assert [len(records) for records in api.slices] == [16, 16, 16, 2]
+    assert api.max_in_flight == genai_api.BATCH_CONCURRENCY
+    assert sorted(len(results) for results in slices) == [2, 16, 16, 16]
+    # indexes are positions in all records, whatever the slice and order of completion
+    outputs = {result["index"]: result["output"] for results in slices for result in results}
+    assert outputs == {number: f"prompt {number}" for number in range(50)}
+
+
+def test_batch_size_and_concurrency_are_bounded(api):
+    list(generate(40, batch_size=100, concurrency=1))
+    assert [len(records) for records in api.slices] == [16, 16, 8]
+    assert api.max_in_flight == 1
+
+
+def test_batch_failure_is_raised(api):
+    api.fail_prompt = "prompt 20"
+    with pytest.raises(ValueError, match="Error making request to LLM API"):
+        list(generate(50))
+
+
+def test_batch_stopped_early_cancels_the_slices_in_flight(api):
+    slices = generate(1000)
+    next(slices)
+    slices.close()
+    # one slice completed, the others in flight were cancelled and no further slice was sent
+    assert len(api.slices) == genai_api.BATCH_CONCURRENCY
@@ -0,0 +1,40 @@
+"""
+Background draft prefetcher: drafts are tied to the generation settings
+"""
+
+import sys
+import threading
+from pathlib import Path
+
+# the Streamlit app imports its packages from its source directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "assets" / "streamlit" / "src"))
+
+from components.prefetch import DraftPrefetcher, make_prefetch_key  # noqa: E402
+
+
+def test_collected_drafts_are_handed_back_on_settings_change():
+    prefetcher = DraftPrefetcher()
+    assert prefetcher.reset(make_prefetch_key(prompt_template="v1")) == {}
+    prefetcher.submit(1, lambda: "draft 1")
+    prefetcher.submit(2, lambda: "draft 2")
+    prefetcher.wait(2)
+    while prefetcher.is_pending(1):
+        prefetcher.collect()
+
+    # the same settings keep the drafts, new settings hand back the collected ones
+    assert prefetcher.reset(make_prefetch_key(prompt_template="v1")) == {}
+    assert prefetcher.reset(make_prefetch_key(prompt_template="v2")) == {1: "draft 1"}
+    assert prefetcher.reset(make_prefetch_key(prompt_template="v3")) == {}
+
+
+def test_pending_drafts_are_dropped_on_settings_change():
+    release = threading.Event()
+    prefetcher = DraftPrefetcher(max_workers=1)
+    prefetcher.reset("v1")
+    prefetcher.submit(1, lambda: release.wait(5) and "running")
+    prefetcher.submit(2, lambda: "queued")
+    prefetcher.reset("v2")
+    release.set()
+    assert not prefetcher.is_pending(1)
+    assert not prefetcher.is_pending(2)
+    assert prefetcher.collect() == {}
@@ -0,0 +1,330 @@
+"""
+Round trips of prompts through the prompt lambda handler (PUT -> GET / DETAIL / SEARCH -> DELETE) against
+in-memory DynamoDB and S3 stand-ins, with the item shapes DynamoDB stores: strings, gzip Binary texts and
+S3 pointer maps
+"""
+
+import itertools
+import json
+import random
+import re
+import string
+import sys
+from pathlib import Path
+
+import pytest
+from botocore.exceptions import ClientError
+
+# the lambda imports its modules and the layer as top-level modules, as in the deployed package
+ASSETS = Path(__file__).resolve().parent.parent / "assets"
+sys.path[:0] = [
+    str(ASSETS / "lambda" / "db_connections" / "prompt_lambda"),
+    str(ASSETS / "layers" / "aws_clients" / "python"),
+]
+
+import prompt_lambda  # noqa: E402
+import search_index  # noqa: E402
+import text_storage  # noqa: E402
+
+TABLE = "prompts"
+BUCKET = "prompt-texts"
+# DynamoDB rejects items above 400 KB
+MAX_ITEM_SIZE = 400 * 1024
+
+
+def client_error(code, message=""):
+    return ClientError({"Error": {"Code": code, "Message": message}}, "operation")
+
+
+class FakeDynamoDB:
+    """
+    In-memory stand-in for the DynamoDB calls of the prompt lambda: one table keyed by session_id and its
+    user_id/timestamp index, with the validations DynamoDB applies to the typed items
+    """
+
+    def __init__(self):
+        self.items = {}
+
+    @staticmethod
+    def validate(item):
+        for name, value in item.items():
+            ((kind, content),) = value.items()
+            if kind == "B" and not isinstance(content, bytes):
+                raise client_error("ValidationException", f"{name} is not binary")
+            if name in ("session_id", "user_id", "timestamp") and kind == "S" and not content:
+                raise client_error("ValidationException", f"Empty string for key attribute {name}")
+        size = 0
+        for name, value in item.items():
+            content = next(iter(value.values()))
+            size += len(name) + len(content if isinstance(content, bytes) else json.dumps(content))
+        if size > MAX_ITEM_SIZE:
+            raise client_error("ValidationException", "Item size has exceeded the maximum allowed size")
+
+    @staticmethod
+    def project(item, projection, names=None):
+        if not projection:
+            return dict(item)
+        fields = [(names or {}).get(field.strip(), field.strip()) for field in projection.split(",")]
+        return {field: item[field] for field in fields if field in item}
+
+    def put_item(self, TableName, Item):
+        self.validate(Item)
+        self.items[Item["session_id"]["S"]] = Item
+        return {}
+
+    def get_item(self, TableName, Key, ConsistentRead=False):
+        item = self.items.get(Key["session_id"]["S"])
+        return {"Item": item} if item else {}
+
+    def delete_item(self, TableName, Key, ReturnValues="NONE"):
+        item = self.items.pop(Key["session_id"]["S"], None)
+        return {"Attributes": item} if item and ReturnValues == "ALL_OLD" else {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+        item = self.items.setdefault(Key["session_id"]["S"], dict(Key))
+        for action, name, value in re.findall(r"(ADD|SET) (#\w+) =? ?(:\w+)", UpdateExpression):
+            attribute, number = ExpressionAttributeNames[name], float(ExpressionAttributeValues[value]["N"])
+            if action == "ADD":
+                number += float(item.get(attribute, {"N": "0"})["N"])
+            item[attribute] = {"N": str(int(number)) if number.is_integer() else str(number)}
+        return {}
+
+    def query(
+        self,
+        TableName,
+        IndexName,
+        KeyConditionExpression,
+        ExpressionAttributeNames,
+        ExpressionAttributeValues,
+        ProjectionExpression=None,
+        FilterExpression=None,
+        ScanIndexForward=True,
+        Limit=None,
+        ExclusiveStartKey=None,
+    ):
+        assert IndexName == prompt_lambda.USER_INDEX_NAME
+        names, values = ExpressionAttributeNames, ExpressionAttributeValues
+        items = sorted(
+            (item for item in self.items.values() if "user_id" in item and "timestamp" in item),
+            key=lambda item: (item["timestamp"]["S"], item["session_id"]["S"]),
+            reverse=not ScanIndexForward,
+        )
+        items = [item for item in items if item[names["#pk"]] == values[":pk"]]
+        if "#sk >= :sk" in KeyConditionExpression:
+            items = [item for item in items if item[names["#sk"]]["S"] >= values[":sk"]["S"]]
+        start = 0
+        if ExclusiveStartKey:
+            start = next(i for i, item in enumerate(items) if item["session_id"] == ExclusiveStartKey["session_id"]) + 1
+        evaluated = items[start : start + Limit] if Limit else items[start:]
+        conditions = re.findall(r"(#\w+) = (:\w+)", FilterExpression or "")
+        matching = [
+            item for item in evaluated if all(item.get(names[name]) == values[value] for name, value in conditions)
+        ]
+        response = {"Items": [self.project(item, ProjectionExpression, names) for item in matching]}
+        if start + len(evaluated) < len(items):
+            last = evaluated[-1]
+            response["LastEvaluatedKey"] = {key: last[key] for key in ("session_id", "user_id", "timestamp")}
+        return response
+
+    def batch_get_item(self, RequestItems):
+        ((table, request),) = RequestItems.items()
+        found = [self.items[key["session_id"]["S"]] for key in request["Keys"] if key["session_id"]["S"] in self.items]
+        projection, names = request.get("ProjectionExpression"), request.get("ExpressionAttributeNames")
+        return {"Responses": {table: [self.project(item, projection, names) for item in found]}}
+
+    def batch_write_item(self, RequestItems):
+        ((table, requests),) = RequestItems.items()
+        for request in requests:
+            if "PutRequest" in request:
+                self.put_item(table, request["PutRequest"]["Item"])
+            else:
+                self.delete_item(table, request["DeleteRequest"]["Key"])
+        return {"UnprocessedItems": {}}
+
+
+class FakeS3:
+    """
+    In-memory stand-in for the S3 calls of the text storage and the search index, with conditional writes
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.versions = itertools.count()
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        if (Bucket, Key) not in self.objects:
+            raise client_error("NoSuchKey")
+        etag, body = self.objects[(Bucket, Key)]
+        if IfNoneMatch == etag:
+            raise client_error("304")
+        return {"ETag": etag, "Body": type("Body", (), {"read": lambda self: body})()}
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs):
+        current = self.objects.get((Bucket, Key))
+        if (IfMatch and (current is None or current[0] != IfMatch)) or (IfNoneMatch == "*" and current):
+            raise client_error("PreconditionFailed")
+        etag = f'"{next(self.versions)}"'
+        self.objects[(Bucket, Key)] = (etag, Body)
+        return {"ETag": etag}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete["Objects"]:
+            self.objects.pop((Bucket, obj["Key"]), None)
+
+    def keys(self, prefix):
+        return {key for _, key in self.objects if key.startswith(prefix)}
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    dynamodb, s3 = FakeDynamoDB(), FakeS3()
+    monkeypatch.setenv("TABLE_NAME", TABLE)
+    monkeypatch.setattr(prompt_lambda, "get_client", {"dynamodb": dynamodb, "s3": s3}.get)
+    monkeypatch.setattr(text_storage, "SPILL_BUCKET", BUCKET)
+    monkeypatch.setattr(search_index, "SEARCH_INDEX_BUCKET", BUCKET)
+    monkeypatch.setattr(search_index, "_LOADED", {})
+    return dynamodb, s3
+
+
+def invoke(payload_type, headers=None, **body):
+    event = {"body": json.dumps({"type": payload_type, **body}), "headers": headers}
+    response = prompt_lambda.lambda_handler(event, None)
+    return response["statusCode"], json.loads(response["body"]) if "body" in response else None, response
+
+
+def random_text(size):
+    # incompressible enough to be spilled to S3 once gzipped
+    return "".join(random.Random(size).choices(string.ascii_letters + " ", k=size))
+
+
+def make_prompt(session_id, timestamp, output, user_id="user-1", model="Bedrock: Claude 3 Sonnet"):
+    return {
+        "session_id": session_id,
+        "user_id": user_id,
+        "timestamp": timestamp,
+        "model": model,
+        "answer_length": "200",
+        "temperature": "0",
+        "Prompt Template": "Write to {UserUserAttributesFirstName} about our summer sale",
+        "Prompt": "Write to Jane about our summer sale. " * 100,
+        "Output": output,
+    }
+
+
+def test_put_get_detail_search_delete_round_trip(clients):
+    dynamodb, s3 = clients
+    output = "Dear Jane, our summer sale starts today. " + random_text(600_000)
+    prompt = make_prompt("s1", "2024-06-01T10:00:00", output)
+    assert invoke("PUT", item=prompt)[0] == 200
+
+    # stored shapes: short template as string, repeated prompt gzip-compressed, huge output spilled to S3
+    stored = dynamodb.items["s1"]
+    assert "S" in stored["Prompt Template"]
+    assert isinstance(stored["Prompt"]["B"], bytes)
+    assert stored["Output"]["M"]["bucket"]["S"] == BUCKET
+    assert stored["Output"]["M"]["key"]["S"] in s3.keys("prompts/")
+
+    status, page, _ = invoke("GET", filter_params={"user_id": "user-1"})
+    assert status == 200
+    assert page["items"] == [{key: prompt[key] for key in prompt_lambda.SUMMARY_FIELDS if key in prompt}]
+    assert page["fields"] == prompt_lambda.SUMMARY_FIELDS
+
+    assert invoke("DETAIL", item={"session_id": "s1"})[1] == prompt
+    status, detail, _ = invoke("DETAIL", session_ids=["s1", "missing"], fields=["Prompt", "Output"])
+    assert detail["items"] == [{"session_id": "s1", "Prompt": prompt["Prompt"], "Output": prompt["Output"]}]
+
+    status, results, _ = invoke("SEARCH", user_id="user-1", query="summer sale")
+    assert [item["session_id"] for item in results["items"]] == ["s1"]
+
+    assert invoke("DELETE", item={"session_id": "s1"})[0] == 200
+    assert "s1" not in dynamodb.items
+    assert not s3.keys("prompts/")
+    assert invoke("DETAIL", item={"session_id": "s1"})[0] == 404
+    assert invoke("GET", filter_params={"user_id": "user-1"})[1]["items"] == []
+    assert invoke("SEARCH", user_id="user-1", query="summer sale")[1]["items"] == []
+
+
+def test_get_pages_and_filters_by_model(clients):
+    for number in range(5):
+        model = "Bedrock: Amazon Titan" if number % 2 else "Bedrock: Claude 3 Sonnet"
+        invoke("PUT", item=make_prompt(f"s{number}", f"2024-06-0{number + 1}", "Hello", model=model))
+
+    session_ids, next_token = [], None
+    while True:
+        _, page, _ = invoke("GET", filter_params={"user_id": "user-1"}, page_size=2, next_token=next_token)
+        session_ids += [item["session_id"] for item in page["items"]]
+        next_token = page["next_token"]
+        if not next_token:
+            break
+    assert session_ids == ["s4", "s3", "s2", "s1", "s0"]
+
+    _, page, _ = invoke("GET", filter_params={"user_id": "user-1", "ai_model_filter": "Bedrock: Amazon Titan"})
+    assert [item["session_id"] for item in page["items"]] == ["s3", "s1"]
+
+    _, page, _ = invoke("GET", filter_params={"user_id": "user-1", "since_timestamp": "2024-06-03"})
+    assert [item["session_id"] for item in page["items"]] == ["s4", "s3", "s2"]
+
+
+def test_get_is_conditional_once_the_index_settled(clients, monkeypatch):
+    invoke("PUT", item=make_prompt("s1", "2024-06-01", "Hello"))
+    # right after a write the page is served without ETag
+    _, _, response = invoke("GET", filter_params={"user_id": "user-1"})
+    assert "ETag" not in response["headers"]
+
+    monkeypatch.setattr(prompt_lambda, "GSI_SETTLE_SECONDS", 0)
+    _, _, response = invoke("GET", filter_params={"user_id": "user-1"})
+    etag = response["headers"]["ETag"]
+    assert invoke("GET", headers={"If-None-Match": etag}, filter_params={"user_id": "user-1"})[0] == 304
+
+    invoke("PUT", item=make_prompt("s2", "2024-06-02", "Hello"))
+    assert invoke("GET", headers={"If-None-Match": etag}, filter_params={"user_id": "user-1"})[0] == 200
+
+
+def test_batch_round_trip(clients):
+    dynamodb, s3 = clients
+    invoke("PUT", item=make_prompt("old", "2024-06-01", random_text(600_000)))
+    operations = [
+        {"type": "PUT", "item": make_prompt("s1", "2024-06-02", "Summer offer")},
+        {"type": "PUT", "item": {**make_prompt("s2", "", "No timestamp"), "user_id": ""}},
+        {"type": "DELETE", "item": {"session_id": "old"}},
+        {"type": "PUT", "item": make_prompt("s1", "2024-06-03", "Duplicate")},
+        {"type": "UPSERT", "item": {"session_id": "s3"}},
+    ]
+    status, results, _ = invoke("BATCH", operations=operations)
+    assert status == 200
+    assert [result["status"] for result in results] == ["SUCCESS", "SUCCESS", "SUCCESS", "FAILED", "FAILED"]
+    # a prompt without user or timestamp is stored, out of the user index
+    assert "user_id" not in dynamodb.items["s2"] and "timestamp" not in dynamodb.items["s2"]
+    assert "old" not in dynamodb.items and not s3.keys("prompts/")
+    assert [item["session_id"] for item in invoke("GET", filter_params={"user_id": "user-1"})[1]["items"]] == ["s1"]
+
+
+def test_index_failures_are_counted(clients, monkeypatch, capsys):
+    monkeypatch.setattr(search_index, "CONDITIONAL_WRITES", False)
+    assert invoke("PUT", item=make_prompt("s1", "2024-06-01", "Hello"))[0] == 200
+    metrics = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"_aws"')]
+    assert [metric["SearchIndexUpdateFailures"] for metric in metrics] == [1]
+
+
+def test_reindex_restores_search(clients):
+    _, s3 = clients
+    for number in range(3):
+        invoke("PUT", item=make_prompt(f"s{number}", f"2024-06-0{number + 1}", f"Offer number{number}"))
+    for key in s3.keys("search-index/"):
+        s3.delete_object(Bucket=BUCKET, Key=key)
+    search_index._LOADED.clear()
+    assert invoke("SEARCH", user_id="user-1", query="offer")[1]["items"] == []
+
+    assert invoke("REINDEX", user_id="user-1")[1] == {"indexed": 3}
+    assert {item["session_id"] for item in invoke("SEARCH", user_id="user-1", query="offer")[1]["items"]} == {
+        "s0",
+        "s1",
+        "s2",
+    }
+
+
+def test_invalid_payload_type(clients):
+    assert invoke("UPSERT")[0] == 400
@@ -0,0 +1,28 @@
+"""
+Response cache keys: every setting a generation depends on is part of the key
+"""
+
+import sys
+from pathlib import Path
+
+# the lambda imports its modules and the layer as top-level modules, as in the deployed package
+ASSETS = Path(__file__).resolve().parent.parent / "assets"
+sys.path[:0] = [
+    str(ASSETS / "lambda" / "genai" / "bedrock_content_generation_lambda"),
+    str(ASSETS / "layers" / "aws_clients" / "python"),
+]
+
+from response_cache import make_cache_key  # noqa: E402
+
+MODEL_ID = "anthropic.claude-3-5-haiku-20241022-v1:0"
+FIXED_PARAMS = {"STOP_WORDS": ["\n\nHuman:"], "TOP_P": 0.9, "EXAMPLES": None}
+MODEL_PARAMS = {"answer_length": 400, "temperature": 0.0}
+
+
+def test_cache_key_depends_on_the_model_config():
+    key = make_cache_key(MODEL_ID, FIXED_PARAMS, "Write to Jane", MODEL_PARAMS)
+    assert key == make_cache_key(MODEL_ID, dict(reversed(FIXED_PARAMS.items())), "Write to Jane", dict(MODEL_PARAMS))
+    assert key != make_cache_key(MODEL_ID, {**FIXED_PARAMS, "TOP_P": 0.5}, "Write to Jane", MODEL_PARAMS)
+    assert key != make_cache_key(MODEL_ID, {**FIXED_PARAMS, "STOP_WORDS": []}, "Write to Jane", MODEL_PARAMS)
+    assert key != make_cache_key(MODEL_ID, FIXED_PARAMS, "Write to John", MODEL_PARAMS)
+    assert key != make_cache_key(MODEL_ID, FIXED_PARAMS, "Write to Jane", {**MODEL_PARAMS, "answer_length": 800})
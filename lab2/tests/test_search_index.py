@@ -0,0 +1,183 @@
+"""
+Sharded BM25 search index: tokenizing, scoring, concurrent updates and rebuilds against an in-memory S3
+"""
+
+import gzip
+import itertools
+import json
+import math
+from collections import Counter
+
+import pytest
+from botocore.exceptions import ClientError
+
+from db_connections.prompt_lambda import search_index
+
+BUCKET = "index-bucket"
+USER = "user-1"
+
+
+class FakeS3:
+    """
+    In-memory stand-in for the S3 calls of search_index, with ETags and conditional requests.
+    before_put(key) runs before every write, e.g. to let a concurrent writer in.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.versions = itertools.count()
+        self.before_put = None
+
+    @staticmethod
+    def error(code):
+        return ClientError({"Error": {"Code": code}}, "operation")
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        if (Bucket, Key) not in self.objects:
+            raise self.error("NoSuchKey")
+        etag, body = self.objects[(Bucket, Key)]
+        if IfNoneMatch == etag:
+            raise self.error("304")
+        return {"ETag": etag, "Body": type("Body", (), {"read": lambda self: body})()}
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs):
+        if self.before_put:
+            before_put, self.before_put = self.before_put, None
+            before_put(Key)
+        current = self.objects.get((Bucket, Key))
+        if (IfMatch and (current is None or current[0] != IfMatch)) or (IfNoneMatch == "*" and current):
+            raise self.error("PreconditionFailed")
+        etag = f'"{next(self.versions)}"'
+        self.objects[(Bucket, Key)] = (etag, Body)
+        return {"ETag": etag}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def content(self, shard):
+        _, body = self.objects[(BUCKET, search_index.shard_key(USER, shard))]
+        return json.loads(gzip.decompress(body))
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setattr(search_index, "SEARCH_INDEX_BUCKET", BUCKET)
+    monkeypatch.setattr(search_index, "_LOADED", {})
+    return FakeS3()
+
+
+DOCUMENTS = {
+    "s1": {"Prompt Template": "Summer sale on shoes", "Output": "Enjoy the summer sale, shoes and bags"},
+    "s2": {"Prompt Template": "Winter offer", "Output": "Warm boots for the winter"},
+    "s3": {"Prompt Template": "Loyalty discount", "Output": "A discount on shoes for loyal customers"},
+}
+
+
+def reference_scores(documents, query):
+    """
+    BM25 scores computed from scratch over the plain documents
+    """
+    counts = {
+        session_id: Counter(search_index.tokenize(search_index.document_text(item)))
+        for session_id, item in documents.items()
+    }
+    average_length = sum(sum(count.values()) for count in counts.values()) / len(counts)
+    scores = Counter()
+    for term in set(search_index.tokenize(query)):
+        matching = {session_id: count[term] for session_id, count in counts.items() if count[term]}
+        idf = math.log(1 + (len(counts) - len(matching) + 0.5) / (len(matching) + 0.5))
+        for session_id, frequency in matching.items():
+            length = sum(counts[session_id].values())
+            scores[session_id] += (
+                idf
+                * frequency
+                * (search_index.K1 + 1)
+                / (frequency + search_index.K1 * (1 - search_index.B + search_index.B * length / average_length))
+            )
+    return scores
+
+
+def assert_scores(s3, documents, query):
+    scores = dict(search_index.search_prompts(s3, USER, query, limit=100))
+    expected = reference_scores(documents, query)
+    assert scores.keys() == expected.keys()
+    for session_id, score in expected.items():
+        assert scores[session_id] == pytest.approx(score)
+
+
+def test_tokenize():
+    tokens = search_index.tokenize("The SUMMER_sale, a 50% off on Été shoes!")
+    assert tokens == ["summer", "sale", "50", "off", "été", "shoes"]
+
+
+def test_search_matches_bm25(s3):
+    search_index.update_index(s3, USER, added=DOCUMENTS)
+    assert_scores(s3, DOCUMENTS, "summer shoes")
+    assert_scores(s3, DOCUMENTS, "discount for loyal customers")
+    assert search_index.search_prompts(s3, USER, "summer shoes")[0][0] == "s1"
+    assert search_index.search_prompts(s3, USER, "unknown words") == []
+
+
+def test_update_replaces_and_removes(s3):
+    search_index.update_index(s3, USER, added=DOCUMENTS)
+    replaced = {"Prompt Template": "Summer party", "Output": "Summer drinks"}
+    search_index.update_index(s3, USER, added={"s2": replaced}, removed=["s3"])
+    documents = {"s1": DOCUMENTS["s1"], "s2": replaced}
+    assert_scores(s3, documents, "summer winter discount")
+    assert s3.content(search_index.STATS_SHARD)["docs"] == 2
+    # postings of removed terms are dropped, not left empty
+    assert "winter" not in s3.content(search_index.term_shard("winter"))
+
+
+def test_update_touches_only_its_shards(s3):
+    search_index.update_index(s3, USER, added=DOCUMENTS)
+    written = dict(s3.objects)
+    search_index.update_index(s3, USER, added={"s4": {"Output": "shoes"}})
+    changed = {key for key, value in s3.objects.items() if written.get(key) != value}
+    assert changed == {
+        (BUCKET, search_index.shard_key(USER, shard))
+        for shard in [search_index.doc_shard("s4"), search_index.term_shard("shoes"), search_index.STATS_SHARD]
+    }
+
+
+def test_concurrent_update_is_retried(s3):
+    search_index.update_index(s3, USER, added={"s1": DOCUMENTS["s1"]})
+
+    def concurrent_writer(key):
+        # another container updates the index between our read and our write
+        search_index._LOADED.clear()
+        search_index.update_index(s3, USER, added={"s2": DOCUMENTS["s2"]})
+
+    s3.before_put = concurrent_writer
+    search_index.update_index(s3, USER, added={"s3": DOCUMENTS["s3"]})
+    assert_scores(s3, DOCUMENTS, "summer winter discount")
+    assert s3.content(search_index.STATS_SHARD) == {
+        "docs": 3,
+        "length": sum(len(search_index.tokenize(search_index.document_text(item))) for item in DOCUMENTS.values()),
+    }
+
+
+def test_update_fails_after_max_attempts(s3, monkeypatch):
+    monkeypatch.setattr(s3, "put_object", lambda **kwargs: (_ for _ in ()).throw(FakeS3.error("PreconditionFailed")))
+    with pytest.raises(RuntimeError, match="not updated"):
+        search_index.update_index(s3, USER, added={"s1": DOCUMENTS["s1"]})
+
+
+def test_update_needs_conditional_writes(s3, monkeypatch):
+    monkeypatch.setattr(search_index, "CONDITIONAL_WRITES", False)
+    with pytest.raises(RuntimeError, match="conditional writes"):
+        search_index.update_index(s3, USER, added={"s1": DOCUMENTS["s1"]})
+    assert not s3.objects
+
+
+def test_rebuild_repairs_index(s3):
+    search_index.update_index(s3, USER, added=DOCUMENTS)
+    # a partial update: the postings of "shoes" were lost, an index of the unsharded format is left over
+    s3.objects.pop((BUCKET, search_index.shard_key(USER, search_index.term_shard("shoes"))))
+    s3.objects[(BUCKET, search_index.legacy_index_key(USER))] = ("legacy", b"")
+    search_index._LOADED.clear()
+
+    search_index.rebuild_index(s3, USER, DOCUMENTS)
+    assert_scores(s3, DOCUMENTS, "summer shoes discount")
+    assert (BUCKET, search_index.legacy_index_key(USER)) not in s3.objects
+    assert len(s3.objects) == search_index.DOC_SHARDS + search_index.TERM_SHARDS + 1
@@ -0,0 +1,287 @@
+"""
+Template similarity: the local embedder, the exact and LSH vector indexes and the incremental sync of the
+template index against an in-memory catalog API
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# the Streamlit app imports its packages from its source directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "assets" / "streamlit" / "src"))
+
+import components.catalog_cache as catalog_cache  # noqa: E402
+import components.genai_api as genai_api  # noqa: E402
+import components.similarity as similarity  # noqa: E402
+
+USER = "user-1"
+DIMENSIONS = 64
+
+
+def random_vectors(count, seed=0, dimensions=DIMENSIONS):
+    return similarity.normalize(np.random.default_rng(seed).standard_normal((count, dimensions)).astype(np.float32))
+
+
+#########################
+#       EMBEDDER
+#########################
+
+
+def test_hashing_embedder_is_deterministic_and_normalized():
+    embedder = similarity.HashingEmbedder()
+    texts = ["Write to {Name} about our summer sale", "Write to {Name} about our summer sale", ""]
+    vectors = embedder.embed(texts)
+    assert vectors.shape == (3, similarity.EMBEDDING_DIMENSIONS)
+    assert np.array_equal(vectors[0], vectors[1])
+    assert np.array_equal(vectors[0], similarity.HashingEmbedder().embed(texts[:1])[0])
+    assert np.linalg.norm(vectors[0]) == pytest.approx(1.0)
+    # an empty text has no features, its vector stays zero instead of NaN
+    assert not vectors[2].any()
+
+
+def test_hashing_embedder_ranks_close_texts_higher():
+    template, close, unrelated = similarity.HashingEmbedder().embed(
+        [
+            "Write an email to {Name} about our summer sale on shoes",
+            "Write an email to {Name} about the summer sale on bags",
+            "Summarize the quarterly revenue report for the board",
+        ]
+    )
+    assert template @ close > 0.5
+    assert template @ close > template @ unrelated
+    assert np.array_equal(*similarity.HashingEmbedder().embed(["WRITE Email", "write email"]))
+
+
+#########################
+#      FLAT INDEX
+#########################
+
+
+def test_flat_index_search():
+    index = similarity.FlatIndex(DIMENSIONS)
+    assert index.search(random_vectors(1)[0]) == []
+    vectors = random_vectors(10)
+    index.add([f"t{number}" for number in range(10)], vectors)
+
+    results = index.search(vectors[3], limit=3)
+    assert results[0] == ("t3", pytest.approx(1.0))
+    assert len(results) == 3
+    scores = [score for _, score in results]
+    assert scores == sorted(scores, reverse=True)
+    expected = np.argsort(-(vectors @ vectors[3]))[:3]
+    assert [item_id for item_id, _ in results] == [f"t{position}" for position in expected]
+
+    assert [item_id for item_id, _ in index.search(vectors[3], limit=1, exclude=("t3",))] == [results[1][0]]
+    assert index.search(vectors[3], limit=10, threshold=0.99) == [("t3", pytest.approx(1.0))]
+
+
+def test_flat_index_replaces_and_removes():
+    index = similarity.FlatIndex(DIMENSIONS)
+    first, second, third = random_vectors(3)
+    index.add(["a", "b"], np.stack([first, second]))
+    index.add(["a"], third[np.newaxis, :])
+    assert len(index) == 2
+    assert np.allclose(index.vector("a"), third)
+    assert index.search(first, limit=1, threshold=0.99) == []
+
+    index.remove(["b", "unknown"])
+    assert "b" not in index
+    assert index.ids == ["a"]
+    assert np.allclose(index.vector("a"), third)
+
+
+#########################
+#      LSH INDEX
+#########################
+
+
+def test_lsh_index_finds_near_duplicates():
+    vectors = random_vectors(2000, dimensions=similarity.EMBEDDING_DIMENSIONS)
+    index = similarity.LSHIndex(similarity.EMBEDDING_DIMENSIONS)
+    index.add([f"t{number}" for number in range(len(vectors))], vectors)
+
+    noise = random_vectors(len(vectors), seed=1, dimensions=similarity.EMBEDDING_DIMENSIONS)
+    queries = similarity.normalize(vectors + 0.2 * noise)
+    found = sum(index.search(query, limit=1)[0][0] == f"t{number}" for number, query in enumerate(queries))
+    # near-duplicates share most signature bits: they are (almost) always among the candidates
+    assert found >= 0.99 * len(vectors)
+
+
+def test_lsh_index_ranks_like_the_flat_index():
+    vectors = random_vectors(300)
+    flat, lsh = similarity.FlatIndex(DIMENSIONS), similarity.LSHIndex(DIMENSIONS, tables=4, bits=2)
+    ids = [f"t{number}" for number in range(len(vectors))]
+    flat.add(ids, vectors)
+    lsh.add(ids, vectors)
+    # with few bits every candidate set is large, the ranking of the candidates is exact
+    for query in vectors[:20]:
+        results = dict(lsh.search(query, limit=5, threshold=0.1))
+        expected = [item_id for item_id, _ in flat.search(query, limit=300, threshold=0.1) if item_id in results]
+        assert list(results) == expected
+        assert all(results[item_id] == pytest.approx(float(query @ flat.vector(item_id))) for item_id in results)
+
+
+def test_lsh_index_remove_clears_buckets():
+    vectors = random_vectors(50)
+    index = similarity.LSHIndex(DIMENSIONS)
+    index.add([f"t{number}" for number in range(50)], vectors)
+    index.remove(["t7"])
+    assert "t7" not in index
+    assert all("t7" not in bucket for buckets in index._buckets for bucket in buckets.values())
+    assert all(item_id != "t7" for item_id, _ in index.search(vectors[7], limit=50))
+    # replacing a vector moves it to the buckets of its new signature
+    index.add(["t8"], vectors[9][np.newaxis, :])
+    assert {item_id for item_id, _ in index.search(vectors[9], limit=2, threshold=0.99)} == {"t8", "t9"}
+
+
+def test_template_index_switches_to_lsh(monkeypatch):
+    monkeypatch.setattr(similarity, "LSH_MIN_SIZE", 20)
+    template_index = similarity.TemplateIndex(similarity.HashingEmbedder(DIMENSIONS))
+    ids, templates = [f"t{number}" for number in range(25)], [f"template {number}" for number in range(25)]
+    template_index.add(ids[:15], templates[:15])
+    assert type(template_index.index) is similarity.FlatIndex
+    template_index.add(ids[15:], templates[15:])
+    assert type(template_index.index) is similarity.LSHIndex
+    assert len(template_index.index) == 25
+    assert template_index.index.search(template_index.index.vector("t3"), limit=1)[0][0] == "t3"
+
+
+#########################
+#     TEMPLATE SYNC
+#########################
+
+
+class FakeResponse:
+    def __init__(self, page):
+        self.status_code = 200
+        self.headers = {}
+        self.page = page
+
+    def json(self):
+        return self.page
+
+
+class FakeCatalogApi:
+    """
+    In-memory stand-in for the catalog requests of genai_api: GET pages (newest first, since_timestamp
+    filter) and DETAIL lookups, with the requests recorded
+    """
+
+    def __init__(self):
+        self.prompts = {}
+        self.gets = []
+        self.details = []
+
+    def save(self, session_id, timestamp, template):
+        self.prompts[session_id] = {
+            "session_id": session_id,
+            "user_id": USER,
+            "timestamp": timestamp,
+            "template": template,
+        }
+
+    def invoke_dynamo_get(self, params, access_token, page_size=None, next_token=None, etag=None):
+        self.gets.append(params)
+        since = params.get("since_timestamp", "")
+        prompts = sorted(
+            (prompt for prompt in self.prompts.values() if prompt["timestamp"] >= since),
+            key=lambda prompt: prompt["timestamp"],
+            reverse=True,
+        )
+        start = int(next_token or 0)
+        page = prompts[start : start + page_size]
+        next_token = str(start + page_size) if start + page_size < len(prompts) else None
+        items = [{key: prompt[key] for key in ("session_id", "user_id", "timestamp")} for prompt in page]
+        return FakeResponse({"items": items, "next_token": next_token})
+
+    def invoke_dynamo_get_details(self, session_ids, access_token, fields=None):
+        self.details.append(list(session_ids))
+        return [
+            {"session_id": session_id, "Prompt Template": self.prompts[session_id]["template"]}
+            for session_id in session_ids
+            if session_id in self.prompts
+        ]
+
+
+@pytest.fixture
+def api(monkeypatch):
+    api = FakeCatalogApi()
+    store = catalog_cache.CatalogStore()
+    cache = similarity.EmbeddingCache()
+    indexes = {}
+    monkeypatch.setattr(genai_api, "invoke_dynamo_get", api.invoke_dynamo_get)
+    monkeypatch.setattr(genai_api, "invoke_dynamo_get_details", api.invoke_dynamo_get_details)
+    monkeypatch.setattr(catalog_cache, "get_catalog_store", lambda: store)
+    monkeypatch.setattr(similarity, "get_embedding_cache", lambda: cache)
+    monkeypatch.setattr(similarity, "get_template_indexes", lambda: indexes)
+    monkeypatch.setattr(similarity, "EMBEDDER", "hashing")
+    monkeypatch.setattr(similarity, "SYNC_PAGE_SIZE", 2)
+    return api
+
+
+def sync(api):
+    # every sync in these tests sees a changed catalog
+    catalog_cache.get_catalog_store().record_deletes(USER, [])
+    api.gets.clear()
+    api.details.clear()
+    return similarity.get_template_index(USER, "token")
+
+
+def test_sync_lists_only_new_templates(api):
+    for number in range(5):
+        api.save(f"s{number}", f"2024-06-0{number + 1}-10-00-00", f"Write about offer number {number}")
+    template_index = sync(api)
+    assert [params.get("since_timestamp") for params in api.gets] == [None, None, None]
+    assert sorted(template_index.index.ids) == ["s0", "s1", "s2", "s3", "s4"]
+
+    api.save("s5", "2024-06-09-10-00-00", "Write about the winter offer")
+    template_index = sync(api)
+    # one page from the newest synced template on, only the new template is retrieved
+    assert [params.get("since_timestamp") for params in api.gets] == ["2024-06-05-10-00-00"]
+    assert api.details == [["s5"]]
+    assert len(template_index.index) == 6
+    assert set(template_index.summaries) == {f"s{number}" for number in range(6)}
+
+
+def test_sync_applies_deletions_and_resaves(api):
+    for number in range(3):
+        api.save(f"s{number}", f"2024-06-0{number + 1}-10-00-00", f"Write about offer number {number}")
+    sync(api)
+
+    api.prompts.pop("s0")
+    catalog_cache.get_catalog_store().record_deletes(USER, ["s0"])
+    api.save("s1", "2024-06-09-10-00-00", "Write a poem about the sea")
+    template_index = sync(api)
+    assert api.details == [["s1"]]
+    assert sorted(template_index.index.ids) == ["s1", "s2"]
+    assert "s0" not in template_index.summaries
+    query = similarity.HashingEmbedder().embed(["Write a poem about the sea"])[0]
+    assert template_index.search(query, limit=1, threshold=0.99)[0]["session_id"] == "s1"
+
+
+def test_full_sync_catches_deletions_of_other_servers(api, monkeypatch):
+    for number in range(3):
+        api.save(f"s{number}", f"2024-06-0{number + 1}-10-00-00", f"Write about offer number {number}")
+    sync(api)
+    # deleted through another server: unknown to the catalog cache of this one
+    api.prompts.pop("s1")
+    assert "s1" in sync(api).index
+    monkeypatch.setattr(similarity, "FULL_SYNC_INTERVAL", -1)
+    template_index = sync(api)
+    assert api.gets[0].get("since_timestamp") is None
+    assert api.details == []
+    assert sorted(template_index.index.ids) == ["s0", "s2"]
+
+
+def test_near_duplicates_exclude_the_saved_session(api):
+    api.save("s1", "2024-06-01-10-00-00", "Write to {Name} about our summer sale on shoes")
+    api.save("s2", "2024-06-02-10-00-00", "Write to {Name} about our summer sale on shoes")
+    api.save("s3", "2024-06-03-10-00-00", "Summarize the quarterly revenue report")
+    template = "Write to {Name} about our summer sale on shoes"
+
+    duplicates = similarity.find_near_duplicates(USER, "s1", template, "token")
+    assert [duplicate["session_id"] for duplicate in duplicates] == ["s2"]
+    assert duplicates[0]["similarity"] == pytest.approx(1.0)
+    assert similarity.find_near_duplicates(USER, "s4", "Plan a team offsite", "token") == []
@@ -0,0 +1,118 @@
+"""
+Round trips of the prompt text storage: inline, gzip-compressed and spilled to S3
+"""
+
+import gzip
+import random
+import string
+
+import pytest
+
+from db_connections.prompt_lambda import text_storage
+
+BUCKET = "spill-bucket"
+
+
+class FakeS3:
+    """
+    In-memory stand-in for the S3 calls of text_storage
+    """
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key):
+        body = self.objects[(Bucket, Key)]
+        return {"Body": type("Body", (), {"read": lambda self: body})()}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete["Objects"]:
+            self.objects.pop((Bucket, obj["Key"]), None)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setattr(text_storage, "SPILL_BUCKET", BUCKET)
+    monkeypatch.setattr(text_storage, "COMPRESSION_THRESHOLD", 1024)
+    monkeypatch.setattr(text_storage, "SPILL_THRESHOLD", 4096)
+    return FakeS3()
+
+
+def random_text(size):
+    # incompressible enough to stay above the spill threshold once gzipped
+    return "".join(random.Random(size).choices(string.printable, k=size)) + " é ✓"
+
+
+@pytest.mark.parametrize(
+    "text, kind",
+    [
+        ("", "S"),
+        ("Hello {UserUserAttributesFirstName}", "S"),
+        ("Dear customer, " * 200 + "é ✓", "B"),
+        (random_text(50_000), "M"),
+    ],
+    ids=["empty", "short", "compressed", "spilled"],
+)
+def test_encode_decode_round_trip(s3, text, kind):
+    value = text_storage.encode_text("user-1", "Prompt Template", text, s3)
+    assert kind in value
+    assert text_storage.decode_text(value, s3) == text
+
+
+def test_compressed_text_is_gzip(s3):
+    text = "Dear customer, " * 200
+    value = text_storage.encode_text("user-1", "Output", text, s3)
+    assert len(value["B"]) < len(text.encode("utf-8"))
+    assert gzip.decompress(value["B"]).decode("utf-8") == text
+    assert not s3.objects
+
+
+def test_spill_writes_s3_and_restores(s3):
+    text = random_text(50_000)
+    value = text_storage.encode_text("user-1", "Prompt", text, s3)
+    key = text_storage.spill_key("user-1", "Prompt")
+    assert value["M"]["bucket"]["S"] == BUCKET
+    assert value["M"]["key"]["S"] == key
+    assert (BUCKET, key) in s3.objects
+    assert text_storage.decode_text(value, s3) == text
+
+
+def test_no_spill_without_bucket(s3, monkeypatch):
+    monkeypatch.setattr(text_storage, "SPILL_BUCKET", None)
+    text = random_text(50_000)
+    value = text_storage.encode_text("user-1", "Prompt", text, s3)
+    assert "B" in value
+    assert not s3.objects
+    assert text_storage.decode_text(value) == text
+
+
+def test_item_round_trip_and_delete(s3):
+    item = {
+        "session_id": {"S": "user-1"},
+        "Prompt Template": {"S": "Hi {UserUserAttributesFirstName}"},
+        "Prompt": {"S": "Dear customer, " * 200},
+        "Output": {"S": random_text(50_000)},
+        "Model": {"S": "Bedrock: Amazon Titan"},
+    }
+    encoded = text_storage.encode_item_texts(item, s3)
+    assert "S" in encoded["Prompt Template"]
+    assert "B" in encoded["Prompt"]
+    assert "M" in encoded["Output"]
+    assert encoded["Model"] == item["Model"]
+    assert text_storage.decode_item_texts(encoded, s3) == item
+
+    text_storage.delete_spilled_texts(encoded, s3)
+    assert not s3.objects
+
+
+def test_delete_spilled_texts_by_session(s3):
+    for session_id in ["user-1", "user-2"]:
+        text_storage.encode_text(session_id, "Output", random_text(50_000), s3)
+    text_storage.delete_spilled_texts_by_session(["user-1", "user-2", "user-3"], s3)
+    assert not s3.objects